@@ -0,0 +1,7 @@
+# Carga la app de Celery con Django para que shared_task use su configuración
+try:
+    from .celery import app as celery_app
+except ImportError:  # Celery es opcional en desarrollo
+    celery_app = None
+
+__all__ = ("celery_app",)
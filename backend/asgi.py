@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# sólo los procesos que atienden HTTP vuelcan métricas (orders/metrics.py)
+from orders import metrics  # noqa: E402
+metrics.start_exporter()
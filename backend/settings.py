@@ -53,6 +53,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "orders.profiling.SlowRequestProfilerMiddleware",  # perfiles de peticiones lentas (opt-in)
+    "orders.querybudget.QueryBudgetMiddleware",  # tope de consultas por acción
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -87,10 +89,36 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Perfil de producción para SQLite (ver orders/writequeue.py):
+# - WAL: las lecturas no bloquean al que escribe ni al revés.
+# - BEGIN IMMEDIATE: toda transacción toma el lock de escritura al empezar y
+#   espera (timeout) en vez de fallar con "database is locked" al pasar de
+#   lectura a escritura, que es el caso en que SQLite no reintenta.
+# - synchronous=NORMAL en WAL: sólo sincroniza en los checkpoints; un corte de
+#   luz puede perder las últimas transacciones, nunca corromper la base.
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",       # 20 MB de caché de páginas por conexión
+    "PRAGMA mmap_size=268435456",     # 256 MB mapeados en memoria
+    "PRAGMA temp_store=MEMORY",
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,          # conexiones persistentes (los pragmas se aplican una vez)
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,            # busy_timeout en segundos
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ";".join(SQLITE_PRAGMAS),
+        },
+        # Tests en archivo, no en memoria: la memoria compartida de SQLite
+        # bloquea tablas sin esperar (ni busy_timeout ni WAL), y los tests de
+        # la cola de escrituras y de las vistas async escriben desde varios hilos
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -141,14 +169,111 @@ MEDIA_URL = "/media/"
 from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_ROOT = BASE_DIR / "media"
+# Calculan el SHA-256 de cada archivo mientras se recibe (ver orders/uploads.py)
+FILE_UPLOAD_HANDLERS = [
+    "orders.uploads.HashingMemoryFileUploadHandler",
+    "orders.uploads.HashingTemporaryFileUploadHandler",
+]
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 CELERY_BEAT_SCHEDULE = {
+    # respaldo: el deadline exacto lo cumple orders.expiration.ExpiryScheduler
     "expire-orders": {
         "task": "orders.tasks.expire_orders",
         "schedule": 60.0,  # cada minuto
     },
+    "rollup-orders": {
+        "task": "orders.tasks.rollup_orders",
+        "schedule": 300.0,  # cada 5 minutos
+    },
+    # recupera segmentos de auditoría de procesos web caídos
+    "flush-audit-spool": {
+        "task": "orders.tasks.flush_audit_spool",
+        "schedule": 60.0,
+    },
 }
 CORS_ALLOW_ALL_ORIGINS = True
 
-
-
+# URL del frontend que se codifica en el QR de cada orden
+FRONTEND_URL = "http://localhost:5173/open"
+
+# Caché en disco de los PDFs de órdenes (LRU acotado por tamaño)
+ORDER_PDF_CACHE_DIR = MEDIA_ROOT / "cache" / "pdf"
+ORDER_PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Pre-render del PDF al crear la orden: "async" (Celery, con respaldo en línea), "sync" u "off"
+ORDER_PRERENDER_MODE = "async"
+# Derivados de evidencias (impresión + miniatura), mismo esquema de modos
+ORDER_DERIVATIVES_MODE = "async"
+ORDER_EVIDENCE_PRINT_MAX_PX = 1600
+ORDER_EVIDENCE_THUMB_MAX_PX = 320
+
+
+
+
+# Exportación masiva de PDFs (None = un proceso por núcleo)
+ORDER_BULK_PDF_WORKERS = None
+
+# Expiración de órdenes (ver orders/expiration.py)
+ORDER_EXPIRY_CHUNK_SIZE = 500          # filas por transacción en el respaldo por lotes
+ORDER_EXPIRY_HORIZON = 60              # segundos de deadlines que se cargan en el heap
+ORDER_EXPIRY_REFILL_INTERVAL = 1.0     # cada cuánto se relee el índice
+ORDER_EXPIRY_SCHEDULER_IN_PROCESS = False  # True: hilo dentro del proceso web
+
+# Rollups por hora/día del Dashboard (orders/rollups.py)
+ORDER_ROLLUP_LOOKBACK = 2  # horas que rehace cada corrida de rollup_orders
+ORDER_ROLLUP_RETENTION_DAYS = {"hour": 14, "day": 730}
+ORDER_ROLLUP_MAX_POINTS = 1000  # tramos por consulta de stats_range (por hora: ~6 semanas)
+
+# Caché en memoria de JWTs de OT ya verificados (orders/tokens.py)
+ORDER_TOKEN_CACHE_TTL = 30  # segundos
+ORDER_TOKEN_CACHE_MAX_ENTRIES = 10000
+# contadores por orden que comparten los procesos para invalidar la caché
+# (None: <base SQLite>.tokengen)
+ORDER_TOKEN_GENERATIONS_FILE = None
+
+# Contenido del QR: "jwt" (URL + JWT completo) o "compact" (URL + credencial
+# de 24 caracteres, orders/credentials.py): QR versión ~4 en vez de ~16
+ORDER_QR_FORMAT = "jwt"
+
+# Alta masiva de órdenes (orders/imports.py)
+ORDER_IMPORT_CHUNK_SIZE = 500   # filas por transacción
+ORDER_IMPORT_MAX_ROWS = 10000   # tope por petición de bulk_create_orders
+
+# Auditoría diferida (orders/audit.py): "async" = spool en disco + flush en
+# lote desde un hilo (best-effort: un proceso que muere justo después del
+# COMMIT pierde ese evento); "sync" = INSERT dentro de la petición
+ORDER_AUDIT_MODE = "async"
+ORDER_AUDIT_SPOOL_DIR = BASE_DIR / "audit_spool"
+ORDER_AUDIT_FLUSH_INTERVAL = 1.0  # segundos: latencia máxima hasta AuditLog
+ORDER_AUDIT_FLUSH_BATCH = 500     # eventos por INSERT (y umbral de flush anticipado)
+ORDER_AUDIT_STALE_AFTER = 60      # sin flock (Windows): segundos sin tocar para recuperar un segmento
+ORDER_AUDIT_FSYNC = False         # True: fsync por evento (sobrevive a un corte de luz)
+# Firma de la auditoría: "jwt" (un JWT por fila, con copia del JWT de la OT)
+# o "merkle" (hoja + prueba por fila y una firma por lote encadenado)
+ORDER_AUDIT_SIGNING = "jwt"
+
+# Tope de consultas SQL por acción (query_budgets de cada viewset, orders/querybudget.py):
+# "off", "log" (header X-Query-Count + aviso en el log) o "raise" (tests/CI)
+ORDER_QUERY_BUDGET_MODE = "log" if DEBUG else "off"
+
+# Métricas Prometheus en /metrics (orders/metrics.py): cada proceso que atiende
+# HTTP vuelca su foto a ORDER_METRICS_DIR y /metrics las suma; las de procesos
+# terminados se compactan en ORDER_METRICS_DIR/dead.json. Uno por máquina.
+ORDER_METRICS_ENABLED = True
+ORDER_METRICS_DIR = BASE_DIR / "metrics"
+ORDER_METRICS_FLUSH_INTERVAL = 5.0  # segundos
+ORDER_METRICS_TOKEN = None          # si se define, /metrics exige "Authorization: Bearer <token>"
+
+# Perfilado por muestreo de peticiones lentas (orders/profiling.py, /api/profiles/)
+ORDER_PROFILE_ENABLED = False
+ORDER_PROFILE_THRESHOLD_MS = 2000  # se guarda el perfil de las que tarden más
+ORDER_PROFILE_SAMPLE_RATE = 0      # además, 1 de cada N peticiones (0 = ninguna)
+ORDER_PROFILE_INTERVAL = 0.005     # segundos entre muestras de pila
+ORDER_PROFILE_DIR = BASE_DIR / "profiles"
+ORDER_PROFILE_MAX_FILES = 200      # perfiles que se conservan (los más nuevos)
+
+
+# Cola de escrituras de SQLite (orders/writequeue.py): las transacciones cortas
+# (cierres y expiración) las ejecuta un solo hilo por proceso, agrupando las que
+# llegan juntas en un único COMMIT
+ORDER_WRITE_QUEUE = True
+ORDER_WRITE_QUEUE_BATCH = 32  # transacciones por COMMIT como máximo
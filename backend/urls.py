@@ -17,17 +17,26 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from orders.views import ServiceOrderViewSet
+from orders.views import ProfileViewSet, ServiceOrderViewSet, metrics_view
+from orders import async_views
 from django.conf import settings
 from django.conf.urls.static import static
 router = DefaultRouter()
 router.register(r"orders", ServiceOrderViewSet, basename="orders")
+router.register(r"profiles", ProfileViewSet, basename="profiles")
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/auth/", include("accounts.urls")),
     path("api/", include(router.urls)),
-    
+    # cierre y validación async (ASGI): mismas respuestas que las acciones del router
+    path("api/async/orders/<int:pk>/fail/", async_views.fail),
+    path("api/async/orders/<int:pk>/succeed/", async_views.succeed),
+    path("api/async/orders/<int:pk>/validate_token/", async_views.validate_token),
+    path("api/async/orders/validate_tokens/", async_views.validate_tokens),
+    # métricas Prometheus (orders/metrics.py)
+    path("metrics", metrics_view),
+
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
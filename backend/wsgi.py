@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# sólo los procesos que atienden HTTP vuelcan métricas (orders/metrics.py)
+from orders import metrics  # noqa: E402
+metrics.start_exporter()
@@ -7,6 +7,14 @@ const api = axios.create({
 
 export default api;
 
+// Cierre y validación: las rutas async (/api/async/..., servidor ASGI) sólo
+// con VITE_ASYNC_API=true; si no, las del router (mismas respuestas)
+const ASYNC_API = import.meta.env.VITE_ASYNC_API === "true";
+
+export function orderActionPath(id, action) {
+  return `${ASYNC_API ? "/async" : ""}/orders/${id}/${action}/`;
+}
+
 export function setAuth(token) {
   if (token) {
     api.defaults.headers.common.Authorization = `Bearer ${token}`;
@@ -15,8 +23,14 @@ export function setAuth(token) {
   }
 }
 
-export async function getOrderAudits(orderId) {
-  const res = await api.get(`/orders/${orderId}/audits`);
+// Paginado por cursor: { next, previous, results }. Para seguir, pasar `next`.
+export async function getOrderAudits(orderId, next = null) {
+  const res = next ? await api.get(next) : await api.get(`/orders/${orderId}/audits/`);
+  return res.data;
+}
+
+export async function getAuditFeed(params = {}, next = null) {
+  const res = next ? await api.get(next) : await api.get("/orders/audit_feed/", { params });
   return res.data;
 }
 
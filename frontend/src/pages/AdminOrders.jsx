@@ -4,6 +4,7 @@ import toast from "react-hot-toast";
 
 export default function AdminOrders() {
   const [orders, setOrders] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [technicians, setTechnicians] = useState([]);
   const [loading, setLoading] = useState(false);
 
@@ -19,7 +20,19 @@ export default function AdminOrders() {
   async function loadOrders() {
     try {
       const { data } = await api.get("/orders/");
-      setOrders(data);
+      setOrders(data.results);
+      setNextPage(data.next);
+    } catch {
+      toast.error("Error cargando órdenes");
+    }
+  }
+
+  async function loadMoreOrders() {
+    if (!nextPage) return;
+    try {
+      const { data } = await api.get(nextPage);
+      setOrders((prev) => [...prev, ...data.results]);
+      setNextPage(data.next);
     } catch {
       toast.error("Error cargando órdenes");
     }
@@ -78,6 +91,34 @@ export default function AdminOrders() {
     }
   }
 
+  async function downloadAllPdfs() {
+    if (!orders.length) return;
+    try {
+      const response = await api.post(
+        "/orders/bulk_pdf/",
+        { ids: orders.map((o) => o.id) },
+        { responseType: "blob" }
+      );
+      const url = window.URL.createObjectURL(new Blob([response.data]));
+      const link = document.createElement("a");
+      link.href = url;
+
+      const disposition = response.headers["content-disposition"];
+      let filename = "ordenes.zip";
+      const match = disposition?.match(/filename="?([^"]+)"?/);
+      if (match?.[1]) filename = match[1];
+
+      link.setAttribute("download", filename);
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+    } catch (err) {
+      console.error(err);
+      toast.error("Error descargando PDFs");
+    }
+  }
+
   return (
     <div className="min-h-screen bg-orange-50 p-6">
       <div className="max-w-5xl mx-auto bg-white rounded-lg shadow-lg p-6 space-y-6">
@@ -136,7 +177,15 @@ export default function AdminOrders() {
         </form>
 
         {/* TABLA */}
-        <h2 className="text-xl font-semibold text-orange-600">📄 Órdenes Existentes</h2>
+        <div className="flex items-center justify-between">
+          <h2 className="text-xl font-semibold text-orange-600">📄 Órdenes Existentes</h2>
+          <button
+            onClick={downloadAllPdfs}
+            className="bg-blue-600 hover:bg-blue-700 text-white px-4 py-2 rounded shadow text-sm"
+          >
+            Descargar todos (ZIP)
+          </button>
+        </div>
 
         <div className="overflow-x-auto">
           <table className="w-full text-sm text-left border border-orange-200 shadow-sm rounded overflow-hidden">
@@ -177,6 +226,15 @@ export default function AdminOrders() {
             </tbody>
           </table>
         </div>
+
+        {nextPage && (
+          <button
+            onClick={loadMoreOrders}
+            className="w-full bg-orange-100 hover:bg-orange-200 text-orange-700 py-2 rounded text-sm"
+          >
+            Cargar más
+          </button>
+        )}
       </div>
     </div>
   );
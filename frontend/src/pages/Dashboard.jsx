@@ -7,10 +7,18 @@ import {
   Cell,
   Tooltip,
   ResponsiveContainer,
+  LineChart,
+  Line,
+  XAxis,
+  YAxis,
+  Legend,
 } from "recharts";
 
+const minutes = (s) => (s == null ? "-" : `${(s / 60).toFixed(1)} min`);
+
 export default function Dashboard() {
   const [stats, setStats] = useState(null);
+  const [week, setWeek] = useState(null);
 
   useEffect(() => {
     (async () => {
@@ -21,6 +29,16 @@ export default function Dashboard() {
         toast.error("Error cargando estadísticas");
       }
     })();
+    (async () => {
+      try {
+        // últimos 7 días, por día (rollups)
+        const start = new Date(Date.now() - 7 * 24 * 3600 * 1000).toISOString();
+        const { data } = await api.get("/orders/stats_range/", { params: { start, period: "day" } });
+        setWeek(data);
+      } catch {
+        toast.error("Error cargando estadísticas por día");
+      }
+    })();
   }, []);
 
   if (!stats)
@@ -72,6 +90,33 @@ export default function Dashboard() {
           </div>
         </div>
 
+        {/* Últimos 7 días */}
+        {week && (
+          <div className="bg-orange-100 rounded p-4 border border-orange-200 shadow-sm">
+            <h2 className="text-lg font-semibold text-orange-600 mb-2">Últimos 7 días</h2>
+            <p className="text-gray-700 text-sm mb-4">
+              <strong>Creadas:</strong> {week.totals.created} ·{" "}
+              <strong>Completadas:</strong> {week.totals.completed} ·{" "}
+              <strong>Fallidas:</strong> {week.totals.failed} ·{" "}
+              <strong>Expiradas:</strong> {week.totals.expired} ·{" "}
+              <strong>Tiempo de cierre p50/p90/p99:</strong>{" "}
+              {minutes(week.totals.ttc_p50)} / {minutes(week.totals.ttc_p90)} / {minutes(week.totals.ttc_p99)}
+            </p>
+            <ResponsiveContainer width="100%" height={250}>
+              <LineChart data={week.series.map((p) => ({ ...p, day: p.bucket.slice(0, 10) }))}>
+                <XAxis dataKey="day" />
+                <YAxis allowDecimals={false} />
+                <Tooltip />
+                <Legend />
+                <Line type="monotone" dataKey="created" name="Creadas" stroke="#f97316" />
+                <Line type="monotone" dataKey="completed" name="Completadas" stroke="#10b981" />
+                <Line type="monotone" dataKey="failed" name="Fallidas" stroke="#ef4444" />
+                <Line type="monotone" dataKey="expired" name="Expiradas" stroke="#9ca3af" />
+              </LineChart>
+            </ResponsiveContainer>
+          </div>
+        )}
+
         {/* Tabla por técnico */}
         <div className="bg-orange-100 rounded p-4 border border-orange-200 shadow-sm">
           <h2 className="text-lg font-semibold text-orange-600 mb-2">Órdenes por Técnico</h2>
@@ -9,10 +9,27 @@ export default function MyOrders() {
   const [searchId, setSearchId] = useState("");
 
   useEffect(() => {
-    api
-      .get("/orders/")
-      .then((res) => setOrders(res.data))
-      .catch(() => toast.error("Error cargando órdenes"));
+    // Los filtros son locales: se sigue el cursor (`next`) hasta la última
+    // página, mostrando cada una apenas llega
+    let cancelled = false;
+    async function loadAll() {
+      try {
+        let { data } = await api.get("/orders/", { params: { page_size: 500 } });
+        while (!cancelled) {
+          const page = data.results;
+          setOrders((prev) => [...prev, ...page]);
+          if (!data.next) break;
+          ({ data } = await api.get(data.next));
+        }
+      } catch {
+        if (!cancelled) toast.error("Error cargando órdenes");
+      }
+    }
+    setOrders([]);
+    loadAll();
+    return () => {
+      cancelled = true;
+    };
   }, []);
 
   const filtered = orders.filter((o) => {
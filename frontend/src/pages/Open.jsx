@@ -1,7 +1,7 @@
 import { useEffect, useState } from "react";
 import { useNavigate, useLocation } from "react-router-dom";
 import toast from "react-hot-toast";
-import api from "../api";
+import api, { orderActionPath } from "../api";
 
 export default function Open() {
   const [jwt, setJwt] = useState("");
@@ -15,7 +15,8 @@ export default function Open() {
   useEffect(() => {
     const hash = window.location.hash.replace(/^#/, "");
     const hp = new URLSearchParams(hash);
-    setJwt(hp.get("jwt") || "");
+    // QR clásico: #jwt=<JWT>; QR compacto: #c=<credencial de 24 caracteres>
+    setJwt(hp.get("jwt") || hp.get("c") || "");
   }, []);
 
   useEffect(() => {
@@ -26,7 +27,7 @@ export default function Open() {
       }
 
       try {
-        const res = await api.post(`/orders/${id}/validate_token/`, { jwt });
+        const res = await api.post(orderActionPath(id, "validate_token"), { jwt });
         setOrder(res.data.order);
       } catch (err) {
         const msg = err.response?.data?.detail || "Error desconocido";
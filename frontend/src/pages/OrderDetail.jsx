@@ -68,11 +68,14 @@ export default function OrderDetail() {
 
                   <div className="mt-2">
                     {ev.file.endsWith(".jpg") || ev.file.endsWith(".png") ? (
-                      <img
-                        src={ev.file}
-                        alt={`Evidencia ${ev.kind}`}
-                        className="max-w-full h-auto border rounded"
-                      />
+                      <a href={ev.file} target="_blank" rel="noreferrer">
+                        <img
+                          src={ev.thumbnail || ev.file}
+                          alt={`Evidencia ${ev.kind}`}
+                          loading="lazy"
+                          className="max-w-full h-auto border rounded"
+                        />
+                      </a>
                     ) : ev.file.endsWith(".pdf") ? (
                       <a
                         href={ev.file}
@@ -1,5 +1,5 @@
 import { useEffect, useState } from "react";
-import api from "../api";
+import api, { orderActionPath } from "../api";
 import { useLocation } from "react-router-dom";
 import toast from "react-hot-toast";
 
@@ -55,7 +55,7 @@ export default function OrderWizard() {
       form.append("justification", justification);
       form.append("photo_address", photoAddress);
       form.append("notes", notesNo || "");
-      await api.post(`/orders/${id}/fail/`, form);
+      await api.post(orderActionPath(id, "fail"), form);
       toast.success("Orden cerrada como fallida");
       setStep(0);
       resetForms();
@@ -78,7 +78,7 @@ export default function OrderWizard() {
       form.append("doc_signed", docSigned);
       form.append("doc_id", docId);
       form.append("notes", notesYes || "");
-      await api.post(`/orders/${id}/succeed/`, form);
+      await api.post(orderActionPath(id, "succeed"), form);
       toast.success("Orden cerrada como exitosa");
       setStep(0);
       resetForms();
@@ -20,7 +20,9 @@ export default function ScanQR() {
         try {
           const u = new URL(url);
           const id = u.searchParams.get("id");
-          const jwt = u.hash.replace("#jwt=", "");
+          // #jwt=<JWT> o, en el formato compacto, #c=<credencial>
+          const hp = new URLSearchParams(u.hash.replace(/^#/, ""));
+          const jwt = hp.get("jwt") || hp.get("c");
 
           if (id && jwt) {
             setScanning(false);
@@ -0,0 +1,173 @@
+import os, hashlib, tempfile, time
+from pathlib import Path
+from django.conf import settings
+
+from .background import run_in_background
+from .credentials import qr_format
+from .pdf import PDF_TEMPLATE_VERSION, render_order_pdf
+
+
+class PdfCache:
+    """
+    Caché en disco de PDFs renderizados, direccionada por contenido.
+
+    La clave es (id de la orden, jwt_hash, versión de plantilla): si cambia el
+    token o la plantilla cambia la clave, y la entrada vieja de esa orden se
+    borra al guardar la nueva. El tamaño total está acotado con desalojo LRU
+    (la última lectura se guarda en el atime del archivo; el mtime es el
+    momento en que se generó y sirve de Last-Modified). Al borrar el PDF de
+    una orden se apaga su artifacts_ready.
+    """
+
+    def __init__(self, root=None, max_bytes=None, version=PDF_TEMPLATE_VERSION):
+        self._root = root
+        self._max_bytes = max_bytes
+        self.version = version
+
+    # se leen de settings en cada uso para respetar override_settings
+    @property
+    def root(self):
+        return Path(self._root or getattr(
+            settings, "ORDER_PDF_CACHE_DIR", Path(settings.MEDIA_ROOT) / "cache" / "pdf"))
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return getattr(settings, "ORDER_PDF_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+
+    def key_for(self, order):
+        raw = f"{order.id}:{order.jwt_hash}:{self.version}:{qr_format()}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def path_for(self, order):
+        # Un directorio por orden: así invalidar es borrar los hermanos
+        return self.root / str(order.id) / f"{self.key_for(order)}.pdf"
+
+    def lookup(self, order):
+        """Devuelve (path, mtime) si el PDF ya está en caché, o None."""
+        path = self.path_for(order)
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        # marcar como usado recientemente (atime) sin tocar el Last-Modified
+        try:
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+        return path, st.st_mtime
+
+    def store(self, order, data):
+        """Guarda el PDF de forma atómica e invalida versiones viejas."""
+        path = self.path_for(order)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+        for old in path.parent.glob("*.pdf"):
+            if old != path:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+        self.evict(keep=path)
+        return path, path.stat().st_mtime
+
+    def get_or_render(self, order):
+        hit = self.lookup(order)
+        if hit is not None:
+            return hit
+        return self.store(order, render_order_pdf(order))
+
+    def invalidate(self, order):
+        folder = self.root / str(order.id)
+        for old in folder.glob("*.pdf"):
+            try:
+                old.unlink()
+            except OSError:
+                pass
+        _not_ready([order.id])
+
+    def evict(self, keep=None):
+        """
+        Borra los PDFs menos usados hasta quedar bajo max_bytes, salvo `keep`
+        (el que se acaba de guardar).
+        """
+        if not self.root.exists():
+            return 0
+        entries = []
+        total = 0
+        for p in self.root.glob("*/*.pdf"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_atime, st.st_size, p))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return 0
+
+        removed = []
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed.append(p.parent.name)
+        _not_ready(removed)
+        return len(removed)
+
+
+pdf_cache = PdfCache()
+
+
+def _not_ready(order_ids):
+    # Sin su PDF en caché la orden deja de estar lista; el próximo pre-render
+    # o descarga lo vuelve a generar
+    from .models import ServiceOrder
+
+    ids = [int(i) for i in order_ids if str(i).isdigit()]
+    if ids:
+        ServiceOrder.objects.filter(pk__in=ids, artifacts_ready=True).update(artifacts_ready=False)
+
+
+def prerender_order(order_id):
+    """
+    Pre-genera el PDF de la orden (con su QR) en la caché y marca la orden
+    como lista. Devuelve False si la orden ya no existe.
+    """
+    from .models import ServiceOrder
+
+    try:
+        order = ServiceOrder.objects.get(pk=order_id)
+    except ServiceOrder.DoesNotExist:
+        return False
+    pdf_cache.get_or_render(order)
+    # sólo si el token no cambió mientras renderizábamos
+    ServiceOrder.objects.filter(pk=order_id, jwt_hash=order.jwt_hash).update(artifacts_ready=True)
+    return True
+
+
+def schedule_prerender(order_id):
+    """
+    Encola el pre-render en Celery. Si no hay Celery/broker disponible (o
+    ORDER_PRERENDER_MODE = "sync", p.ej. en tests) lo hace en el momento.
+    """
+    run_in_background("prerender_order_artifacts", prerender_order, order_id,
+                      mode=getattr(settings, "ORDER_PRERENDER_MODE", "async"))
@@ -0,0 +1,165 @@
+"""
+Versiones async (ASGI) de los endpoints de cierre y validación.
+
+Bajo ASGI, Django lee el cuerpo de la petición sin bloquear antes de llamar
+a la vista, así que una subida lenta no ocupa ningún hilo mientras llega.
+Ya en la vista: ORM async para las lecturas, el parseo del multipart y la
+escritura de archivos en el pool de hilos (no en el event loop) y la
+transacción de cierre con sync_to_async (el ORM async no tiene transacciones).
+Responden igual que las acciones de ServiceOrderViewSet.
+"""
+import asyncio, functools, json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from accounts.models import User
+from . import closing, credentials, tokens
+from .expiration import expire_if_due
+from .models import ServiceOrder
+from .serializers import FailInstallationSerializer, SuccessInstallationSerializer, TokenBatchSerializer
+
+_jwt_auth = JWTAuthentication()
+
+
+async def aauthenticate(request):
+    # Como JWTAuthentication, pero la búsqueda del usuario con el ORM async
+    header = _jwt_auth.get_header(request)
+    raw = _jwt_auth.get_raw_token(header) if header is not None else None
+    if raw is None:
+        return None
+    try:
+        user_id = _jwt_auth.get_validated_token(raw)[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return None
+    try:
+        user = await User.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+    except User.DoesNotExist:
+        return None
+    return user if user.is_active else None
+
+
+def technician_endpoint(view):
+    """POST autenticado con JWT y rol TECNICO (lo que hace IsTechnician en DRF)."""
+    @csrf_exempt
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return JsonResponse({"detail": f'Método "{request.method}" no permitido.'}, status=405)
+        user = await aauthenticate(request)
+        if user is None:
+            return JsonResponse({"detail": "No autenticado."}, status=401)
+        if user.role != "TECNICO":
+            return JsonResponse({"detail": "No autorizado."}, status=403)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+
+def _validate_form(serializer_class, request):
+    # Corre en un hilo: parsea el multipart (handlers de subida) y valida (PIL)
+    data = {**request.POST.dict(), **request.FILES.dict()}
+    s = serializer_class(data=data)
+    return s.validated_data if s.is_valid() else None, s.errors
+
+
+async def _close(request, pk, serializer_class, closing_for, spec, done):
+    try:
+        order = await ServiceOrder.objects.aget(pk=pk)
+    except ServiceOrder.DoesNotExist:
+        return JsonResponse({"detail": "No encontrada"}, status=404)
+
+    if order.technician_id != request.user.id:
+        return JsonResponse({"detail": "No autorizado"}, status=403)
+
+    if await sync_to_async(expire_if_due)(order):
+        return JsonResponse({"detail": "Orden expirada"}, status=400)
+
+    if order.status not in [ServiceOrder.Status.PENDING, ServiceOrder.Status.IN_USE]:
+        return JsonResponse({"detail": f"No se puede cerrar en estado {order.status}"}, status=400)
+
+    data, errors = await sync_to_async(_validate_form, thread_sensitive=False)(serializer_class, request)
+    if data is None:
+        return JsonResponse(errors, status=400)
+
+    if not credentials.matches(order, data["jwt"]):
+        return JsonResponse({"detail": "JWT inválido"}, status=400)
+
+    # Los archivos se escriben en paralelo, fuera del event loop y antes de
+    # abrir la transacción; si el cierre no se hace (o algo falla, incluida
+    # otra de las escrituras) se descartan los que sí se guardaron.
+    uploads = closing.uploaded_evidences(data, spec)
+    store = sync_to_async(closing.store_upload, thread_sensitive=False)
+    discard = sync_to_async(closing.discard_stored)
+    stored = await asyncio.gather(*(store(f) for _, _, f, _ in uploads), return_exceptions=True)
+    names = [name for name in stored if not isinstance(name, BaseException)]
+    try:
+        for name in stored:
+            if isinstance(name, BaseException):
+                raise name
+        evidences = [(kind, action, name, digest) for (kind, action, _, digest), name in zip(uploads, stored)]
+        status_, fields = closing_for(data)
+        closed = await sync_to_async(closing.close_order)(
+            request.user, order, status_, fields, evidences, data["jwt"]
+        )
+    except BaseException:
+        # BaseException: también si el cliente se desconecta (CancelledError)
+        await discard(names)
+        raise
+    if not closed:
+        await discard(names)
+        return JsonResponse({"detail": "La orden cambió de estado, reintente"}, status=409)
+    return JsonResponse({"detail": done}, status=200)
+
+
+@technician_endpoint
+async def fail(request, pk):
+    """Camino NO (async): foto domicilio + justificación + JWT → 'failed'"""
+    return await _close(request, pk, FailInstallationSerializer, closing.fail_closing,
+                        closing.FAIL_EVIDENCES, "Orden cerrada como fallida")
+
+
+@technician_endpoint
+async def succeed(request, pk):
+    """Camino SÍ (async): documento firmado + doc identidad + JWT → 'completed'"""
+    return await _close(request, pk, SuccessInstallationSerializer, closing.success_closing,
+                        closing.SUCCESS_EVIDENCES, "Orden cerrada como exitosa")
+
+
+@technician_endpoint
+async def validate_token(request, pk):
+    body = _json_body(request)
+    jwt_token = body.get("jwt") if isinstance(body, dict) else None
+    if not jwt_token:
+        return JsonResponse({"detail": "Falta el JWT"}, status=400)
+
+    [(result, entry)] = await tokens.avalidate_tokens([jwt_token], request.user, pk)
+    if result != tokens.VALID:
+        detail, code = tokens.ERRORS[result]
+        return JsonResponse({"detail": detail}, status=code)
+    return JsonResponse({"valid": True, "order": entry.order})
+
+
+@technician_endpoint
+async def validate_tokens(request):
+    s = TokenBatchSerializer(data=_json_body(request))
+    if not s.is_valid():
+        return JsonResponse(s.errors, status=400)
+
+    results = []
+    for result, entry in await tokens.avalidate_tokens(s.validated_data["tokens"], request.user):
+        if result == tokens.VALID:
+            results.append({"valid": True, "order": entry.order})
+        else:
+            results.append({"valid": False, "detail": tokens.ERRORS[result][0]})
+    return JsonResponse({"results": results})
@@ -0,0 +1,605 @@
+import atexit, datetime, hashlib, itertools, json, logging, os, threading, time, uuid
+import jwt
+from types import SimpleNamespace
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import merkle
+from .jwt_audit import make_audit_root_token, make_audit_token
+from .models import AuditBatch, AuditLog, ServiceOrder
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock los segmentos se recuperan por antigüedad
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BATCH_ATTEMPTS = 5  # intentos de _write_batch ante lotes concurrentes
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def record(user, order, action, old=None, new=None, ot_token=None):
+    """
+    Registra un evento de auditoría. Con ORDER_AUDIT_MODE = "async" (por
+    defecto) la petición sólo agrega una línea al spool local, y eso recién
+    cuando la transacción en curso confirma. El hilo de spool la firma y la
+    inserta en AuditLog en lote. Con "sync" se inserta en el momento, dentro
+    de la transacción (como antes).
+
+    "async" es best-effort: si el proceso muere entre el COMMIT y el append
+    (o, sin ORDER_AUDIT_FSYNC, la máquina se apaga antes de que la línea
+    llegue al disco) el cambio queda confirmado y su evento se pierde. Lo
+    que ya está en el spool sí sobrevive a la caída del proceso. Cuando
+    cada cambio tiene que tener su evento, "sync".
+    """
+    entry = {
+        "jti": uuid.uuid4().hex,
+        "at": timezone.now().isoformat(),
+        "order_id": order.id,
+        "admin_id": user.id,
+        "role": getattr(user, "role", None),
+        "action": action,
+        "ot_token_copy": ot_token if ot_token is not None else order.ot_token,
+        "ot_jti": order.ot_token_jti,
+        "old": old,
+        "new": new,
+    }
+    if _setting("ORDER_AUDIT_MODE", "async") == "sync":
+        # la orden está en la transacción del llamador: no hace falta buscarla
+        write_entries([entry], live=True)
+    else:
+        transaction.on_commit(lambda: spool.append(entry))
+
+
+def signing_mode():
+    # "jwt": un JWT por fila (lo de siempre); "merkle": una firma por lote
+    return _setting("ORDER_AUDIT_SIGNING", "jwt")
+
+
+def leaf_for(row):
+    """Hoja de Merkle de una fila: sus campos en JSON canónico."""
+    payload = {
+        "jti": row.audit_jti,
+        "at": row.created_at.astimezone(datetime.timezone.utc).isoformat(),
+        "order_id": row.order_id,
+        "admin_id": row.admin_id,
+        "action": row.action,
+        "ot_jti": row.ot_jti,
+        "ot_token_hash": row.ot_token_hash,
+        "old": row.old_values,
+        "new": row.new_values,
+    }
+    return merkle.leaf(json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode())
+
+
+def write_entries(entries, live=False):
+    """
+    Firma e inserta los eventos en un solo INSERT masivo. Es idempotente
+    (audit_jti único): repetir un segmento tras una caída no duplica filas.
+    Los eventos de órdenes ya borradas se descartan, salvo con `live` (el
+    llamador sabe que existen). Devuelve cuántos se insertaron o ya estaban.
+    """
+    if not entries:
+        return 0
+    if signing_mode() == "merkle":
+        return _write_batch(entries, live)
+    rows = []
+    for e in (entries if live else _live(entries)):
+        row = _row(e)
+        row.ot_token_copy = e["ot_token_copy"]
+        row.audit_jwt, _ = make_audit_token(
+            SimpleNamespace(id=e["admin_id"], role=e["role"]), SimpleNamespace(id=e["order_id"]),
+            e["action"], e["old"], e["new"], jti=e["jti"], at=e["at"],
+        )
+        rows.append(row)
+    AuditLog.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+def _live(entries):
+    # Los eventos de órdenes ya borradas no se pueden insertar (FK)
+    existing = set(
+        ServiceOrder.objects.filter(pk__in={e["order_id"] for e in entries}).values_list("pk", flat=True)
+    )
+    for e in entries:
+        if e["order_id"] in existing:
+            yield e
+        else:
+            logger.warning("Auditoría %s descartada: la orden %s ya no existe", e["jti"], e["order_id"])
+
+
+def _row(e):
+    return AuditLog(
+        order_id=e["order_id"],
+        admin_id=e["admin_id"],
+        action=e["action"],
+        ot_token_hash=hashlib.sha256((e["ot_token_copy"] or "").encode()).hexdigest(),
+        ot_jti=e["ot_jti"],
+        audit_jti=e["jti"],
+        old_values=e["old"],
+        new_values=e["new"],
+        created_at=parse_datetime(e["at"]),
+    )
+
+
+def _write_batch(entries, live=False):
+    """
+    Modo "merkle": las filas guardan sólo su hoja y su prueba de inclusión;
+    el lote guarda la raíz encadenada con el lote anterior y una sola firma.
+    """
+    for attempt in range(BATCH_ATTEMPTS):
+        try:
+            return _insert_batch(entries, live)
+        except IntegrityError:
+            # Otro lote se encadenó antes al mismo anterior (OneToOne prev) o
+            # ya insertó alguno de estos eventos (audit_jti): se revirtió
+            # todo, y el próximo intento relee el anterior y lo ya escrito
+            if attempt == BATCH_ATTEMPTS - 1:
+                raise
+            logger.info("auditoría: lote en conflicto, reintento %s", attempt + 1)
+
+
+def _insert_batch(entries, live):
+    with transaction.atomic():
+        # primero una escritura: en SQLite toma el lock, así "el lote
+        # anterior" no cambia hasta el commit. En otros motores, dos lotes
+        # con el mismo anterior chocan en el OneToOne prev (ver _write_batch).
+        batch = AuditBatch.objects.create(root="", chain="", size=0, root_jwt="")
+        done = set(AuditLog.objects.filter(audit_jti__in=[e["jti"] for e in entries])
+                   .values_list("audit_jti", flat=True))
+        pending = [e for e in entries if e["jti"] not in done]
+        rows = [_row(e) for e in (pending if live else _live(pending))]
+        if not rows:
+            batch.delete()
+            return len(done)
+        batch.root, proofs = merkle.build([leaf_for(r) for r in rows])
+        batch.prev = AuditBatch.objects.filter(id__lt=batch.id).order_by("-id").first()
+        batch.chain = merkle.chain(batch.prev.chain if batch.prev else "", batch.root)
+        batch.size = len(rows)
+        batch.root_jwt = make_audit_root_token(batch)
+        batch.save()
+        for row, proof in zip(rows, proofs):
+            row.batch = batch
+            row.leaf_hash = leaf_for(row)
+            row.proof = proof
+        AuditLog.objects.bulk_create(rows)
+    return len(rows) + len(done)
+
+
+def _check_batch(batch, prev, failures):
+    # Firma del lote y su eslabón con el anterior
+    try:
+        claims = jwt.decode(batch.root_jwt, settings.SECRET_KEY, algorithms=["HS256"],
+                            options={"verify_exp": False})
+    except jwt.InvalidTokenError:
+        failures.append({"batch": batch.id, "reason": "firma del lote inválida"})
+        return False
+    expected = {"typ": "audit_root", "batch_id": batch.id, "prev_id": batch.prev_id,
+                "root": batch.root, "chain": batch.chain, "size": batch.size}
+    if any(claims.get(k) != v for k, v in expected.items()):
+        failures.append({"batch": batch.id, "reason": "el lote no coincide con su firma"})
+        return False
+    if batch.chain != merkle.chain(prev.chain if prev else "", batch.root):
+        failures.append({"batch": batch.id, "reason": "cadena rota con el lote anterior"})
+        return False
+    return True
+
+
+def _check_row(row, batches, failures):
+    if row.batch_id is None:
+        # modo "jwt": la firma propia tiene que cubrir lo que dice la fila
+        try:
+            claims = jwt.decode(row.audit_jwt, settings.SECRET_KEY, algorithms=["HS256"],
+                                options={"verify_exp": False, "verify_sub": False})
+        except jwt.InvalidTokenError:
+            failures.append({"audit": row.id, "reason": "audit_jwt inválido"})
+            return False
+        if (claims.get("jti") != row.audit_jti or claims.get("order_id") != row.order_id
+                or claims.get("action") != row.action or claims.get("new") != (row.new_values or {})
+                or claims.get("old") != (row.old_values or {})):
+            failures.append({"audit": row.id, "reason": "la fila no coincide con su audit_jwt"})
+            return False
+        return True
+    if batches.get(row.batch_id) is not True:
+        failures.append({"audit": row.id, "reason": "su lote no verifica"})
+        return False
+    leaf = leaf_for(row)
+    if leaf != row.leaf_hash or merkle.root_from_proof(leaf, row.proof or []) != row.batch.root:
+        failures.append({"audit": row.id, "reason": "la fila fue modificada (no llega a la raíz firmada)"})
+        return False
+    return True
+
+
+def _check_sizes(batch_ids, failures):
+    # Una fila borrada sigue verificando sola: el lote tiene que tener sus `size` filas
+    counts = dict(AuditLog.objects.filter(batch_id__in=batch_ids).order_by()
+                  .values_list("batch_id").annotate(n=Count("id")))
+    ok = True
+    for batch_id, size in AuditBatch.objects.filter(id__in=batch_ids).values_list("id", "size"):
+        if counts.get(batch_id, 0) != size:
+            failures.append({"batch": batch_id, "reason": f"faltan o sobran eventos ({counts.get(batch_id, 0)} de {size})"})
+            ok = False
+    return ok
+
+
+def verify(rows):
+    """
+    Verifica filas de AuditLog: las de modo "merkle" contra la raíz firmada
+    de su lote (y el lote contra el anterior, y que tenga todas sus filas);
+    las de modo "jwt" contra su propio audit_jwt.
+    Devuelve {"entries", "verified", "batches", "failures"}.
+    """
+    failures = []
+    batches = {}  # id -> ¿verifica?
+    entries = verified = 0
+    for row in rows.select_related("batch__prev").order_by("id").iterator(chunk_size=2000):
+        if row.batch_id is not None and row.batch_id not in batches:
+            batches[row.batch_id] = _check_batch(row.batch, row.batch.prev, failures)
+        entries += 1
+        verified += _check_row(row, batches, failures)
+    if batches:
+        _check_sizes(list(batches), failures)
+    return {"entries": entries, "verified": verified, "batches": len(batches), "failures": failures}
+
+
+def verify_chain():
+    """
+    Recorre todos los lotes en orden: firma, eslabones, que no falte ninguno
+    y que sus filas (en orden de id, como se armó el árbol) reconstruyan la
+    raíz, así una fila borrada o movida de lote no pasa.
+    """
+    failures = []
+    prev = None
+    count = 0
+    leaves = itertools.groupby(
+        AuditLog.objects.filter(batch__isnull=False).order_by("batch_id", "id")
+        .values_list("batch_id", "leaf_hash").iterator(chunk_size=5000),
+        key=lambda r: r[0],
+    )
+    pending = next(leaves, None)
+    for batch in AuditBatch.objects.order_by("id").iterator(chunk_size=1000):
+        count += 1
+        if batch.prev_id != (prev.id if prev else None):
+            failures.append({"batch": batch.id, "reason": "falta el lote anterior o está fuera de orden"})
+        if batch.prev_id is None or (prev is not None and batch.prev_id == prev.id):
+            _check_batch(batch, prev if batch.prev_id else None, failures)
+        else:
+            _check_batch(batch, batch.prev, failures)
+        prev = batch
+
+        while pending is not None and pending[0] < batch.id:
+            failures.append({"batch": pending[0], "reason": "hay eventos de un lote que no existe"})
+            pending = next(leaves, None)
+        own = []
+        if pending is not None and pending[0] == batch.id:
+            own = [h for _, h in pending[1]]
+            pending = next(leaves, None)
+        if len(own) != batch.size:
+            failures.append({"batch": batch.id, "reason": f"faltan o sobran eventos ({len(own)} de {batch.size})"})
+        elif not own or merkle.build(own)[0] != batch.root:
+            failures.append({"batch": batch.id, "reason": "sus eventos no reconstruyen la raíz firmada"})
+    while pending is not None:
+        failures.append({"batch": pending[0], "reason": "hay eventos de un lote que no existe"})
+        pending = next(leaves, None)
+    return {"batches": count, "failures": failures}
+
+
+class AuditSpool:
+    """
+    Cola durable de eventos de auditoría en disco (ORDER_AUDIT_SPOOL_DIR).
+
+    Cada proceso agrega líneas JSON a su segmento activo `<pid>-<azar>.<n>.log`
+    (open/append/close: un write por evento, fsync opcional). El hilo de
+    flush lo rota a `.ready` cada `flush_interval` segundos o al juntar
+    `batch` eventos, lo reclama renombrándolo a `.busy`, lo inserta y lo
+    borra. Lo que queda de un proceso caído vuelve a `.ready` y lo toma
+    cualquier flush, incluido manage.py flush_audit.
+
+    Quién está vivo lo dicen los flock, que el sistema suelta cuando el
+    proceso muere: cada proceso que escribe tiene tomado `<pid>-<azar>.owner`
+    mientras vive, y quien reclama un segmento lo bloquea antes de
+    renombrarlo y hasta borrarlo. Un `.log` cuyo `.owner` se puede tomar, o
+    un `.busy` sin bloquear, están abandonados. Sin flock (Windows) se usa
+    la antigüedad: más de `stale_after` segundos sin tocar.
+    """
+
+    def __init__(self, directory=None, flush_interval=None, batch=None, stale_after=None, fsync=None):
+        self._directory = directory
+        self.flush_interval = flush_interval or _setting("ORDER_AUDIT_FLUSH_INTERVAL", 1.0)
+        self.batch = batch or _setting("ORDER_AUDIT_FLUSH_BATCH", 500)
+        self.stale_after = stale_after or _setting("ORDER_AUDIT_STALE_AFTER", 60)
+        self.fsync = _setting("ORDER_AUDIT_FSYNC", False) if fsync is None else fsync
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pid = None
+        self._prefix = None
+        self._owner = None  # fd de <prefijo>.owner, bloqueado mientras el proceso viva
+        self._segment = 0
+        self._pending = 0
+        self._thread = None
+        self._stopping = False
+        self.flushed = 0
+
+    @property
+    def directory(self):
+        return str(self._directory or _setting("ORDER_AUDIT_SPOOL_DIR", settings.BASE_DIR / "audit_spool"))
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _active_path(self):
+        if self._pid != os.getpid():
+            # proceso nuevo (o hijo de un fork): prefijo propio, así un pid
+            # reciclado nunca pisa segmentos que quedaron de otra vida
+            self._pid = os.getpid()
+            self._prefix = f"{self._pid}-{uuid.uuid4().hex[:8]}"
+            self._segment = self._pending = 0
+            self._thread = None
+            if self._owner is not None:
+                # el del padre: cerrar esta copia no suelta su flock
+                os.close(self._owner)
+                self._owner = None
+        return os.path.join(self.directory, f"{self._prefix}.{self._segment}.log")
+
+    def _own(self):
+        # Marca de vida del proceso: se toma antes del primer segmento
+        if self._owner is None and fcntl is not None:
+            # se bloquea con otro nombre y recién entonces aparece: recover
+            # nunca ve un .owner creado y todavía libre
+            path = os.path.join(self.directory, self._prefix + ".owner")
+            fd = os.open(path + ".tmp", os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.replace(path + ".tmp", path)
+            self._owner = fd
+
+    def append(self, entry):
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._active_path()
+            self._own()
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            try:
+                os.write(fd, line)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._pending += 1
+            pending = self._pending
+        if not self.running:
+            self.start()
+        if pending >= self.batch:
+            with self._cond:
+                self._cond.notify()
+
+    def rotate(self):
+        # Cierra el segmento activo de este proceso: desde ahora es flusheable
+        with self._lock:
+            path = self._active_path()
+            self._segment += 1
+            self._pending = 0
+            if os.path.exists(path):
+                os.replace(path, path[:-len(".log")] + ".ready")
+
+    def recover(self, now=None):
+        # Segmentos abandonados por procesos caídos vuelven a la cola
+        now = now or time.time()
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return 0
+        owners = {}  # prefijo -> fd de su .owner ya tomado (None: vive)
+        recovered = 0
+        for name in names:
+            base, ext = os.path.splitext(name)
+            path = os.path.join(self.directory, name)
+            if fcntl is None:
+                if ext not in (".log", ".busy") or not self._stale(path, now):
+                    continue
+                held = None
+            elif ext == ".log":
+                prefix = base.rsplit(".", 1)[0]
+                if prefix not in owners:
+                    owners[prefix] = _lock_owner(os.path.join(self.directory, prefix + ".owner"))
+                if owners[prefix] is None:
+                    continue  # su proceso sigue escribiendo
+                held = None
+            elif ext == ".busy":
+                held = _lock_segment(path)
+                if held is None:
+                    continue  # otro flush lo está insertando
+            else:
+                continue
+            try:
+                os.replace(path, os.path.join(self.directory, base + ".ready"))
+                recovered += 1
+            except FileNotFoundError:
+                pass
+            finally:
+                if held is not None:
+                    os.close(held)
+        # los procesos muertos ya no tienen segmentos: se borra su marca
+        for name in names:
+            prefix, ext = os.path.splitext(name)
+            if ext != ".owner" or fcntl is None:
+                continue
+            path = os.path.join(self.directory, name)
+            fd = owners[prefix] if prefix in owners else _lock_owner(path)
+            if fd is not None and fd >= 0:
+                _unlink(path)
+                os.close(fd)
+        if recovered:
+            logger.warning("auditoría: %s segmentos abandonados vuelven a la cola", recovered)
+        return recovered
+
+    def _stale(self, path, now):
+        try:
+            return now - os.path.getmtime(path) >= self.stale_after
+        except FileNotFoundError:
+            return False
+
+    def _claim(self):
+        """
+        Reclama los `.ready`: [(ruta .busy, fd bloqueado o None)]. El flock
+        se toma antes de renombrar, así recover nunca ve un `.busy` libre
+        que alguien acaba de reclamar; renombrar es atómico: si dos procesos
+        van por el mismo segmento, gana uno.
+        """
+        claimed = []
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return claimed
+        for name in names:
+            if not name.endswith(".ready"):
+                continue
+            src = os.path.join(self.directory, name)
+            dst = src[:-len(".ready")] + ".busy"
+            held = None
+            if fcntl is not None:
+                held = _lock_segment(src)
+                if held is None:
+                    continue
+            try:
+                os.replace(src, dst)
+                if held is None:
+                    # sin flock: os.replace conserva el mtime viejo y recover
+                    # lo daría por abandonado enseguida
+                    os.utime(dst)
+            except FileNotFoundError:
+                if held is not None:
+                    os.close(held)
+                continue
+            claimed.append((dst, held))
+        return claimed
+
+    @staticmethod
+    def _read(path):
+        entries = []
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # última línea a medio escribir cuando el proceso murió
+                    logger.warning("auditoría: línea ilegible descartada en %s", path)
+        return entries
+
+    def flush(self):
+        """Rota, reclama lo que esté listo y lo inserta. Devuelve cuántos eventos."""
+        self.rotate()
+        self.recover()
+        total = 0
+        for path, held in self._claim():
+            try:
+                entries = self._read(path)
+                # sin transacción envolvente: en SQLite una transacción que
+                # lee antes de escribir no espera el lock, falla al instante.
+                # Si se corta a mitad, repetir el segmento es inocuo.
+                for i in range(0, len(entries), self.batch):
+                    total += write_entries(entries[i:i + self.batch])
+            except Exception:
+                # queda .busy: al soltar el flock, el próximo recover lo
+                # devuelve a la cola (sin flock, pasado stale_after)
+                logger.exception("auditoría: no se pudo insertar %s", path)
+                continue
+            else:
+                _unlink(path)
+            finally:
+                if held is not None:
+                    os.close(held)
+        self.flushed += total
+        return total
+
+    def run_forever(self):
+        while not self._stopping:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(timeout=self.flush_interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("Error en el flush de auditoría")
+
+    def start(self):
+        with self._cond:
+            if self.running:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self.run_forever, name="audit-spool", daemon=True)
+            self._thread.start()
+
+    def stop(self, flush=True):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if flush:
+            self.flush()
+
+
+def _lock_segment(path):
+    # fd de `path` con flock exclusivo, o None si otro lo tiene o ya no está
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # entre el open y el flock otro pudo reclamarlo y borrarlo
+        if os.fstat(fd).st_ino != os.stat(path).st_ino:
+            raise FileNotFoundError(path)
+    except (BlockingIOError, FileNotFoundError):
+        os.close(fd)
+        return None
+    return fd
+
+
+def _lock_owner(path):
+    """
+    El .owner de un proceso: None si sigue vivo (tiene el flock), su fd ya
+    bloqueado si murió, -1 si no existe (murió y otro ya lo recuperó).
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return -1
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _unlink(path):
+    # Otro proceso pudo haberlo borrado o movido entre medio
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+spool = AuditSpool()
+
+
+@atexit.register
+def _flush_on_exit():
+    # Salida ordenada: no dejar eventos esperando a que otro proceso los recupere
+    if spool.running:
+        try:
+            spool.stop()
+        except Exception:
+            logger.exception("auditoría: flush al salir falló; queda en el spool")
@@ -0,0 +1,21 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_background(task_name, fallback, *args, mode="async"):
+    """
+    Encola `orders.tasks.<task_name>` en Celery. Si no hay Celery/broker (o
+    mode="sync", p.ej. en tests) ejecuta `fallback(*args)` en el momento.
+    mode="off" no hace nada.
+    """
+    if mode == "off":
+        return
+    if mode == "async":
+        try:
+            from . import tasks
+            getattr(tasks, task_name).delay(*args)
+            return
+        except Exception as e:
+            logger.warning("No se pudo encolar %s%r (%s); se ejecuta en línea", task_name, args, e)
+    fallback(*args)
@@ -0,0 +1,8 @@
+"""
+Benchmark de la API de órdenes (manage.py bench_api).
+
+dataset.py siembra datos sintéticos en una BD de prueba temporal y
+runner.py recorre los endpoints reales (URLs, middleware, autenticación
+JWT, vistas) con clientes concurrentes dentro del proceso, midiendo
+latencia, throughput y consultas SQL por petición.
+"""
@@ -0,0 +1,100 @@
+import hashlib, io, os, random
+from dataclasses import dataclass, field
+from django.core.files.base import ContentFile
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from orders import closing, imports
+from orders.models import Evidence, ServiceOrder
+
+
+def noise_jpeg(size):
+    # Foto de ruido de ~size bytes: se comprime como una foto real
+    side = max(16, int((size / 1.2) ** 0.5))
+    buf = io.BytesIO()
+    Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+class Photos:
+    """
+    Fotos distintas del tamaño pedido sin comprimir una por cada una: unas
+    pocas bases de ruido con bytes al azar después del fin del JPEG (sigue
+    siendo una imagen válida y su sha256 cambia, así el storage no deduplica).
+    """
+
+    def __init__(self, size, bases=4):
+        self._bases = [noise_jpeg(size) for _ in range(bases)]
+
+    def next(self, name="foto.jpg"):
+        data = random.choice(self._bases) + os.urandom(16)
+        return ContentFile(data, name=name)
+
+
+@dataclass
+class Dataset:
+    admin: User
+    technicians: list
+    orders: list                  # todas las sembradas (ServiceOrder)
+    open_orders: list             # las que siguen pending: para validate_token/fail/succeed
+    evidences: int
+    photos: Photos
+    tokens: dict = field(default_factory=dict)  # user id -> access token
+
+    def auth(self, user):
+        if user.id not in self.tokens:
+            self.tokens[user.id] = str(AccessToken.for_user(user))
+        return f"Bearer {self.tokens[user.id]}"
+
+
+def seed(technicians=10, orders=2000, evidences=100, image_size=1024 * 1024, rng=None):
+    """
+    Siembra `technicians` técnicos, `orders` órdenes (alta masiva, repartidas
+    por técnico) y cierra las necesarias para tener `evidences` evidencias
+    de ~`image_size` bytes, por el mismo camino que fail/succeed.
+    """
+    rng = rng or random.Random(0)
+    admin = User.objects.create_user("bench_admin", password="bench", role="ADMIN")
+    techs = [
+        User.objects.create_user(f"bench_tec_{i}", password="bench", role="TECNICO")
+        for i in range(technicians)
+    ]
+    rows = [
+        {"technician_id": techs[i % technicians].id, "technician_name": f"Técnico {i % technicians}",
+         "hours": rng.randint(1, 48)}
+        for i in range(orders)
+    ]
+    ids = imports.create_orders(admin, rows)["created"]
+    seeded = list(ServiceOrder.objects.filter(pk__in=ids).order_by("id"))
+    photos = Photos(image_size)
+
+    # cierres: éxito (2 evidencias) y, si sobra una, un fallo (1 evidencia)
+    to_close, remaining = [], evidences
+    for order in seeded:
+        if remaining <= 0:
+            break
+        spec = closing.SUCCESS_EVIDENCES if remaining >= 2 else closing.FAIL_EVIDENCES
+        to_close.append((order, spec))
+        remaining -= len(spec)
+    by_id = {t.id: t for t in techs}
+    for order, spec in to_close:
+        stored = []
+        for _, kind, action in spec:
+            f = photos.next()
+            digest = hashlib.sha256(f.read()).hexdigest()
+            f.seek(0)
+            stored.append((kind, action, closing.store_upload(f), digest))
+        if spec is closing.SUCCESS_EVIDENCES:
+            status, fields = closing.success_closing({"titular_present": True})
+        else:
+            status, fields = closing.fail_closing({"justification": "ausencia_titular"})
+        closing.close_order(by_id[order.technician_id], order, status, fields, stored, order.jwt_token)
+
+    closed = {o.id for o, _ in to_close}
+    open_orders = [o for o in seeded if o.id not in closed]
+    rng.shuffle(open_orders)
+    return Dataset(
+        admin=admin, technicians=techs, orders=seeded, open_orders=open_orders,
+        evidences=Evidence.objects.count(), photos=photos,
+    )
@@ -0,0 +1,167 @@
+import json, random, threading, time
+from collections import Counter
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+def pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 2)
+
+
+class Scenario:
+    """
+    Un endpoint del benchmark. `build(ds, rng)` devuelve los argumentos de
+    la petición como (método, path, kwargs del Client) o None si se acabaron
+    las órdenes que consume (fail/succeed usan cada orden abierta una vez).
+    """
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+
+
+class _Pool:
+    # Órdenes abiertas compartidas entre hilos: cada una se usa una sola vez
+    def __init__(self, orders):
+        self._orders = list(orders)
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            return self._orders.pop() if self._orders else None
+
+
+def scenarios(ds):
+    consumable = _Pool(ds.open_orders)
+    techs = {t.id: t for t in ds.technicians}
+    admin = ds.admin
+
+    def as_user(user, **kwargs):
+        return {"HTTP_AUTHORIZATION": ds.auth(user), **kwargs}
+
+    def list_(rng):
+        return "get", "/api/orders/", as_user(admin, data={"page_size": 50})
+
+    def retrieve(rng):
+        return "get", f"/api/orders/{rng.choice(ds.orders).id}/", as_user(admin)
+
+    def create_order(rng):
+        tech = rng.choice(ds.technicians)
+        body = {"technician_id": tech.id, "technician_name": "Bench", "hours": 2}
+        return "post", "/api/orders/create_order/", as_user(
+            admin, data=json.dumps(body), content_type="application/json")
+
+    def validate_token(rng):
+        order = rng.choice(ds.open_orders)
+        return "post", f"/api/orders/{order.id}/validate_token/", as_user(
+            techs[order.technician_id], data=json.dumps({"jwt": order.jwt_token}),
+            content_type="application/json")
+
+    def fail(rng):
+        order = consumable.take()
+        if order is None:
+            return None
+        data = {"jwt": order.jwt_token, "justification": "ausencia_titular",
+                "photo_address": ds.photos.next("domicilio.jpg")}
+        return "post", f"/api/orders/{order.id}/fail/", as_user(techs[order.technician_id], data=data)
+
+    def succeed(rng):
+        order = consumable.take()
+        if order is None:
+            return None
+        data = {"jwt": order.jwt_token, "titular_present": "true",
+                "doc_signed": ds.photos.next("firmado.jpg"), "doc_id": ds.photos.next("dni.jpg")}
+        return "post", f"/api/orders/{order.id}/succeed/", as_user(techs[order.technician_id], data=data)
+
+    def download_pdf(rng):
+        return "get", f"/api/orders/{rng.choice(ds.orders).id}/download_pdf/", as_user(admin)
+
+    def stats(rng):
+        return "get", "/api/orders/stats/", as_user(admin)
+
+    return [Scenario(name, build) for name, build in (
+        ("list", list_), ("retrieve", retrieve), ("create_order", create_order),
+        ("validate_token", validate_token), ("fail", fail), ("succeed", succeed),
+        ("download_pdf", download_pdf), ("stats", stats),
+    )]
+
+
+def run_scenario(scenario, requests, concurrency, seed=0):
+    """
+    `requests` peticiones repartidas entre `concurrency` hilos, cada uno con
+    su Client y su conexión a la BD. Devuelve el resumen del endpoint.
+    """
+    samples = []  # (segundos, consultas, status)
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(n):
+        client = Client()
+        rng = random.Random(seed * 1000 + n)
+        try:
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                req = scenario.build(rng)
+                if req is None:
+                    return
+                method, path, kwargs = req
+                with CaptureQueriesContext(connection) as queries:
+                    t = time.perf_counter()
+                    response = getattr(client, method)(path, **kwargs)
+                    if getattr(response, "streaming", False):
+                        for _ in response.streaming_content:
+                            pass
+                    elapsed = time.perf_counter() - t
+                with lock:
+                    samples.append((elapsed, len(queries), response.status_code))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies = [s[0] for s in samples]
+    queries = [s[1] for s in samples]
+    statuses = Counter(str(s[2]) for s in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(n for code, n in statuses.items() if not code.startswith("2")),
+        "status": dict(statuses),
+        "throughput_rps": round(len(samples) / wall, 1) if wall else None,
+        "p50_ms": pct(latencies, 50),
+        "p95_ms": pct(latencies, 95),
+        "p99_ms": pct(latencies, 99),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else None,
+        "queries_mean": round(sum(queries) / len(queries), 2) if queries else None,
+        "queries_max": max(queries) if queries else None,
+    }
+
+
+def regressions(report, baseline, tolerance=0.2):
+    """
+    Compara con un reporte anterior: p95 más de `tolerance` peor o más
+    consultas por petición que antes. Devuelve una lista de textos.
+    """
+    found = []
+    for name, now in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before or not now["requests"]:
+            continue
+        if before.get("p95_ms") and now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        if before.get("queries_max") is not None and now["queries_max"] > before["queries_max"]:
+            found.append(f"{name}: consultas {before['queries_max']} -> {now['queries_max']}")
+        if now["errors"] > before.get("errors", 0):
+            found.append(f"{name}: errores {before.get('errors', 0)} -> {now['errors']}")
+    return found
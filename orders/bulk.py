@@ -0,0 +1,126 @@
+import multiprocessing, os, threading, zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from django.conf import settings
+
+from .artifacts import pdf_cache
+from .pdf import frontend_url, qr_value_for, render_order_pdf
+
+# Campos de la orden que necesita el PDF (se mandan al proceso hijo como dict)
+SNAPSHOT_FIELDS = ("id", "uuid_order", "technician_name", "jwt_token", "jwt_hash",
+                   "created_at", "expires_at")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_size():
+    return getattr(settings, "ORDER_BULK_PDF_WORKERS", None) or os.cpu_count() or 1
+
+
+def get_pool():
+    # Un único pool por proceso web, compartido entre peticiones
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=pool_size(), mp_context=_mp_context(),
+                initializer=_init_worker, initargs=(settings.SETTINGS_MODULE,),
+            )
+        return _pool
+
+
+def _mp_context():
+    # Nunca fork: el proceso web ya tiene hilos (spool de auditoría, métricas,
+    # cola de escrituras, perfilador) y el hijo de un fork puede quedar
+    # trabado en un lock que alguno de ellos tenía tomado en ese momento
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _init_worker(settings_module):
+    # Proceso nuevo (no heredado): Django desde cero, sin hilos de fondo
+    # (ni el volcado de métricas, que sólo arrancan wsgi.py/asgi.py)
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    django.setup()
+
+
+def _render_snapshot(snapshot, qr_value):
+    # Corre en el proceso hijo: no toca la BD ni los settings
+    return render_order_pdf(SimpleNamespace(**snapshot), qr_value=qr_value)
+
+
+class _ChunkBuffer:
+    """Archivo de sólo escritura que ZipFile va llenando y nosotros vaciando."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_order_pdfs(orders, window=None):
+    """
+    Devuelve (orden, pdf_bytes) en el mismo orden que `orders`.
+    Los aciertos de caché se leen del disco; el resto se renderiza en el pool
+    con a lo sumo `window` PDFs en vuelo, así la memoria no crece con el lote.
+    """
+    pool = get_pool()
+    url_base = frontend_url()
+    window = window or getattr(settings, "ORDER_BULK_PDF_WINDOW", None) or 2 * pool_size()
+    pending = deque()
+
+    def settle(order, fut):
+        if fut is None:
+            path, _ = pdf_cache.get_or_render(order)
+            with open(path, "rb") as f:
+                return order, f.read()
+        data = fut.result()
+        pdf_cache.store(order, data)
+        return order, data
+
+    try:
+        for order in orders:
+            if pdf_cache.lookup(order) is not None:
+                pending.append((order, None))
+            else:
+                snapshot = {f: getattr(order, f) for f in SNAPSHOT_FIELDS}
+                pending.append((order, pool.submit(_render_snapshot, snapshot, qr_value_for(order, url_base))))
+            if len(pending) >= window:
+                yield settle(*pending.popleft())
+
+        while pending:
+            yield settle(*pending.popleft())
+    finally:
+        # Cliente desconectado (el servidor cierra el generador) o error: lo
+        # que sigue en la cola del pool compartido no se renderiza para nadie
+        for _, fut in pending:
+            if fut is not None:
+                fut.cancel()
+
+
+def stream_orders_zip(orders):
+    """Genera el ZIP por pedazos, un PDF a la vez."""
+    buf = _ChunkBuffer()
+    pdfs = iter_order_pdfs(orders)
+    try:
+        with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for order, data in pdfs:
+                zf.writestr(f"orden_{order.uuid_order}.pdf", data)
+                yield buf.drain()
+        yield buf.drain()
+    finally:
+        pdfs.close()  # cancela los renders pendientes si se cortó a mitad
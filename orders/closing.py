@@ -0,0 +1,112 @@
+from django.db import transaction
+from django.utils import timezone
+
+from . import audit, counters, writequeue
+from .derivatives import schedule_derivatives
+from .models import ServiceOrder, Evidence
+from .storage import release_blob
+from .uploads import uploaded_sha256
+
+# Evidencias de cada camino: (campo del formulario, tipo, acción de auditoría)
+FAIL_EVIDENCES = [
+    ("photo_address", Evidence.Type.FOTO_DOMICILIO, "subida_foto_domicilio"),
+]
+SUCCESS_EVIDENCES = [
+    ("doc_signed", Evidence.Type.DOC_FIRMADO, "subida_doc_firmado"),  # imagen o PDF
+    ("doc_id", Evidence.Type.DOC_IDENTIDAD, "subida_doc_identidad"),
+]
+
+
+def fail_closing(data):
+    # Camino NO: estado y campos de cierre
+    return ServiceOrder.Status.FAILED, {
+        "closing_reason": data["justification"],
+        "closing_notes": data.get("notes", ""),
+        "closed_at": timezone.now(),
+    }
+
+
+def success_closing(data):
+    # Camino SÍ
+    return ServiceOrder.Status.COMPLETED, {
+        "closing_reason": "titular_presente" if data["titular_present"] else "familiar_autorizado",
+        "closing_notes": data.get("notes", ""),
+        "closed_at": timezone.now(),
+    }
+
+
+def log_evidence_audit(user, order, action, evidencia, jwt):
+    """Registrar en auditoría cuando se sube evidencia."""
+    payload = {
+        "evidence_id": evidencia.id,
+        "evidence_kind": evidencia.kind,
+        "filename": evidencia.file.name
+    }
+    # o puede ser técnico si lo permites; se escribe al confirmar (orders/audit.py)
+    audit.record(user, order, action, None, payload, ot_token=jwt)
+
+
+def store_upload(f):
+    """
+    Guarda un archivo subido en el storage de evidencias fuera de la
+    transacción (la vista async lo hace en un hilo). Devuelve el nombre.
+    """
+    field = Evidence._meta.get_field("file")
+    return field.storage.save(field.generate_filename(None, f.name), f)
+
+
+def discard_stored(names):
+    # Si el cierre no se hizo, suelta la referencia de cada blob guardado
+    for name in names:
+        release_blob(name)
+
+
+def close_order(user, order, status, fields, evidences, jwt):
+    """
+    Crea las evidencias, su auditoría y cierra la orden en una sola
+    transacción (con los contadores). `evidences`: [(tipo, acción, archivo,
+    sha256)], donde archivo es el subido o el nombre ya guardado.
+    Devuelve False si otra petición cambió el estado antes (no queda nada).
+    """
+    # Los archivos se guardan antes de la transacción: con la cola de
+    # escrituras el hilo que tiene el lock de SQLite no hace I/O de blobs, y
+    # si el cierre no se hace (o falla) se suelta cada uno, en los dos caminos
+    stored = []
+    named = []
+    try:
+        for kind, action, file, file_hash in evidences:
+            if not isinstance(file, str):
+                file = store_upload(file)
+                stored.append(file)
+            named.append((kind, action, file, file_hash))
+        if writequeue.active():
+            closed = writequeue.writes.run(_close_order, user, order, status, fields, named, jwt)
+        else:
+            closed = _close_order(user, order, status, fields, named, jwt)
+    except Exception:
+        discard_stored(stored)
+        raise
+    if not closed:
+        discard_stored(stored)
+    return closed
+
+
+def _close_order(user, order, status, fields, evidences, jwt):
+    with transaction.atomic():
+        created = []
+        for kind, action, file, file_hash in evidences:
+            ev = Evidence.objects.create(order=order, kind=kind, file=file, file_hash=file_hash)
+            log_evidence_audit(user, order, action, ev, jwt)
+            created.append(ev.id)
+        # robust: con Celery caído corre en línea, y la orden ya está cerrada
+        transaction.on_commit(lambda: schedule_derivatives(created), robust=True)
+
+        if not counters.transition(order, status, {(counters.EVIDENCES, ""): len(created)}, **fields):
+            transaction.set_rollback(True)
+            return False
+    return True
+
+
+def uploaded_evidences(data, spec):
+    # [(tipo, acción, archivo subido, sha256)] a partir del formulario validado
+    return [(kind, action, data[field], uploaded_sha256(data[field])) for field, kind, action in spec]
@@ -0,0 +1,149 @@
+from collections import Counter
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+
+from .models import OrderCounter, ServiceOrder, Evidence
+from . import tokens
+
+# Alcances de OrderCounter
+TOTAL = "orders"
+STATUS = "status"
+TECHNICIAN = "technician"
+EVIDENCES = "evidences"
+
+
+def bump(deltas):
+    """
+    Suma `deltas` ({(scope, key): n}) a los contadores. Hay que llamarlo
+    dentro de la misma transacción que el cambio que cuenta: si ésta se
+    revierte, los contadores también.
+    """
+    rows = [(scope, key, delta) for (scope, key), delta in deltas.items() if delta]
+    if not rows:
+        return
+    if connection.vendor in ("sqlite", "postgresql"):
+        # Un solo upsert para todas las claves: crea la que falte (técnico
+        # nuevo, estado nuevo) y suma a las demás, sin carrera entre medio
+        qn = connection.ops.quote_name
+        table = qn(OrderCounter._meta.db_table)
+        values = ", ".join(["(%s, %s, %s)"] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({qn('scope')}, {qn('key')}, {qn('value')}) VALUES {values} "
+                f"ON CONFLICT ({qn('scope')}, {qn('key')}) "
+                f"DO UPDATE SET {qn('value')} = {table}.{qn('value')} + excluded.{qn('value')}",
+                [v for row in rows for v in row],
+            )
+        return
+    for scope, key, delta in rows:
+        counter = OrderCounter.objects.filter(scope=scope, key=key)
+        if counter.update(value=F("value") + delta):
+            continue
+        try:
+            # primera vez que aparece esta clave (técnico nuevo, estado nuevo)
+            with transaction.atomic():
+                OrderCounter.objects.create(scope=scope, key=key, value=delta)
+        except IntegrityError:
+            # otra transacción la creó entre medio
+            counter.update(value=F("value") + delta)
+
+
+def order_created(order, n=1):
+    bump({
+        (TOTAL, ""): n,
+        (STATUS, order.status): n,
+        (TECHNICIAN, order.technician_name): n,
+    })
+
+
+def orders_created(orders):
+    # Alta masiva (orders/imports.py): un solo bump para todo el lote
+    deltas = Counter()
+    for order in orders:
+        deltas[(TOTAL, "")] += 1
+        deltas[(STATUS, order.status)] += 1
+        deltas[(TECHNICIAN, order.technician_name)] += 1
+    bump(deltas)
+
+
+def status_changed(old, new, n=1):
+    if old != new and n:
+        bump({(STATUS, old): -n, (STATUS, new): n})
+
+
+def evidences_added(n=1):
+    bump({(EVIDENCES, ""): n})
+
+
+def transition(order, new_status, deltas=None, **fields):
+    """
+    Cambia el estado de `order` sólo si sigue en el estado leído (compare and
+    set) y ajusta los contadores en la misma transacción, junto con `deltas`
+    (p.ej. las evidencias del cierre) en el mismo bump. Devuelve False si
+    otra petición la cambió antes; en ese caso no se toca nada.
+    """
+    old = order.status
+    with transaction.atomic():
+        changed = ServiceOrder.objects.filter(pk=order.pk, status=old).update(
+            status=new_status, **fields
+        )
+        if not changed:
+            return False
+        counts = Counter(deltas or {})
+        if old != new_status:
+            counts[(STATUS, old)] -= 1
+            counts[(STATUS, new_status)] += 1
+        bump(counts)
+    # el estado cacheado de los tokens de esta orden ya no vale (al confirmar,
+    # así nadie vuelve a cachear lo de antes del commit)
+    pk = order.pk
+    transaction.on_commit(lambda: tokens.order_changed([pk]))
+    order.status = new_status
+    for name, value in fields.items():
+        setattr(order, name, value)
+    return True
+
+
+def compute_counts():
+    """Los mismos contadores calculados desde las tablas reales (lo caro)."""
+    orders = ServiceOrder.objects.order_by()
+    counts = Counter({(TOTAL, ""): orders.count(), (EVIDENCES, ""): Evidence.objects.count()})
+    for row in orders.values("status").annotate(total=Count("id")):
+        counts[(STATUS, row["status"])] = row["total"]
+    for row in orders.values("technician_name").annotate(total=Count("id")):
+        counts[(TECHNICIAN, row["technician_name"])] = row["total"]
+    return counts
+
+
+def reconcile(dry_run=False):
+    """
+    Compara los contadores con las tablas y, salvo dry_run, los reescribe.
+    Devuelve {(scope, key): (guardado, real)} con las diferencias encontradas.
+    """
+    with transaction.atomic():
+        real = compute_counts()
+        stored = {(c.scope, c.key): c.value for c in OrderCounter.objects.all()}
+        diff = {
+            k: (stored.get(k, 0), real.get(k, 0))
+            for k in set(real) | set(stored)
+            if stored.get(k, 0) != real.get(k, 0)
+        }
+        if diff and not dry_run:
+            OrderCounter.objects.all().delete()
+            OrderCounter.objects.bulk_create(
+                OrderCounter(scope=s, key=k, value=v) for (s, k), v in real.items() if v
+            )
+    return diff
+
+
+def snapshot():
+    """Estadísticas para stats: una sola lectura de la tabla de contadores."""
+    data = {"total_orders": 0, "by_status": {}, "by_technician": {}, "total_evidences": 0}
+    for scope, key, value in OrderCounter.objects.values_list("scope", "key", "value"):
+        if scope == TOTAL:
+            data["total_orders"] = value
+        elif scope == EVIDENCES:
+            data["total_evidences"] = value
+        elif value:
+            data["by_status" if scope == STATUS else "by_technician"][key] = value
+    return data
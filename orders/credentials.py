@@ -0,0 +1,60 @@
+import base64, binascii, hashlib, hmac, struct
+from django.conf import settings
+
+# Credencial compacta de la OT (alternativa al JWT completo dentro del QR):
+#   versión (1 byte) | order_id (uint32) | tag HMAC-SHA256 truncado (10 bytes)
+# codificada en base32: 15 bytes son justo 24 caracteres [A-Z2-7], sin
+# relleno. Son caracteres del modo alfanumérico del QR (5,5 bits/carácter en
+# vez de 8) y no hay que escaparlos en la URL. El tag se calcula sobre el jwt_hash vigente de la
+# orden, así que verificarla es la misma comprobación contra jwt_hash que
+# se hace con el JWT: si el JWT se re-emite, la credencial vieja deja de valer.
+COMPACT_VERSION = 1
+COMPACT_LAYOUT = struct.Struct(">BI")
+TAG_BYTES = 10
+COMPACT_LEN = 24  # base32 de 15 bytes
+
+
+def qr_format():
+    # "jwt" (URL + JWT completo, lo de siempre) o "compact"
+    return getattr(settings, "ORDER_QR_FORMAT", "jwt")
+
+
+def _tag(order_id, jwt_hash):
+    msg = COMPACT_LAYOUT.pack(COMPACT_VERSION, order_id) + jwt_hash.encode()
+    key = ("orders.credentials:" + settings.SECRET_KEY).encode()
+    return hmac.new(key, msg, hashlib.sha256).digest()[:TAG_BYTES]
+
+
+def compact_for(order):
+    raw = COMPACT_LAYOUT.pack(COMPACT_VERSION, order.id) + _tag(order.id, order.jwt_hash)
+    return base64.b32encode(raw).decode()
+
+
+def parse_compact(value):
+    """Devuelve el order_id de una credencial compacta bien formada, o None."""
+    value = (value or "").strip().upper()
+    if len(value) != COMPACT_LEN:
+        return None
+    try:
+        raw = base64.b32decode(value)
+    except (binascii.Error, ValueError):
+        return None
+    version, order_id = COMPACT_LAYOUT.unpack_from(raw)
+    if version != COMPACT_VERSION:
+        return None
+    return order_id
+
+
+def is_compact(value):
+    return parse_compact(value) is not None
+
+
+def matches(order, value):
+    """
+    ¿`value` (JWT completo o credencial compacta) es la credencial vigente
+    de `order`? Comparaciones en tiempo constante.
+    """
+    if is_compact(value):
+        return hmac.compare_digest(compact_for(order), value.strip().upper())
+    digest = hashlib.sha256(value.encode()).hexdigest()
+    return hmac.compare_digest(digest, order.jwt_hash)
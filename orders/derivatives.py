@@ -0,0 +1,83 @@
+import io, logging
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .background import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Lado mayor en píxeles. 1600 px a 500 pt de ancho ≈ 230 dpi impreso.
+PRINT_MAX_PX = 1600
+THUMB_MAX_PX = 320
+
+
+def is_image(name):
+    return not (name or "").lower().endswith(".pdf")
+
+
+def make_derivative(source, max_px, quality):
+    """
+    Reduce la imagen a max_px de lado mayor y la re-codifica como JPEG sin
+    EXIF (la orientación se aplica antes, para no perderla).
+    """
+    with Image.open(source) as im:
+        # JPEG: el decodificador ya reduce 1/2, 1/4, 1/8 sin leer todos los píxeles
+        im.draft("RGB", (max_px, max_px))
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        im.thumbnail((max_px, max_px), Image.LANCZOS)
+        out = io.BytesIO()
+        im.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def build_derivatives(evidence):
+    """
+    Genera la versión para impresión y la miniatura de una evidencia de
+    imagen. Los nombres salen del blob original (evidences/ab/cd/<sha>...),
+    así evidencias con el mismo contenido comparten derivados.
+    Devuelve False si no aplica (PDF o sin archivo).
+    """
+    name = evidence.file.name
+    if not name or not is_image(name):
+        return False
+    storage = evidence.file.storage
+    base = name.rsplit(".", 1)[0].replace("evidences/", "derivatives/", 1)
+
+    sizes = {
+        "print_file": (f"{base}_print.jpg",
+                       getattr(settings, "ORDER_EVIDENCE_PRINT_MAX_PX", PRINT_MAX_PX), 85),
+        "thumbnail": (f"{base}_thumb.jpg",
+                      getattr(settings, "ORDER_EVIDENCE_THUMB_MAX_PX", THUMB_MAX_PX), 75),
+    }
+    for field, (target, max_px, quality) in sizes.items():
+        if not storage.exists(target):
+            with storage.open(name, "rb") as src:
+                storage.save_as(target, ContentFile(make_derivative(src, max_px, quality)))
+        getattr(evidence, field).name = target
+    evidence.save(update_fields=list(sizes))
+    return True
+
+
+def process_evidence(evidence_id):
+    from .models import Evidence
+
+    try:
+        evidence = Evidence.objects.get(pk=evidence_id)
+    except Evidence.DoesNotExist:
+        return False
+    try:
+        return build_derivatives(evidence)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # archivo que PIL no abre (UnidentifiedImageError es un OSError):
+        # la evidencia queda sin derivados y se sigue usando el original
+        logger.warning("Evidencia %s: no se pudieron generar los derivados", evidence_id, exc_info=True)
+        return False
+
+
+def schedule_derivatives(evidence_ids):
+    mode = getattr(settings, "ORDER_DERIVATIVES_MODE", "async")
+    for evidence_id in evidence_ids:
+        run_in_background("build_evidence_derivatives", process_evidence, evidence_id, mode=mode)
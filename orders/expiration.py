@@ -0,0 +1,202 @@
+import datetime, heapq, logging, threading, time
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import counters, writequeue
+from .models import OPEN_STATUSES, ServiceOrder
+from . import tokens
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def expire_ids(ids, now=None):
+    """Marca como expiradas las órdenes `ids` que sigan abiertas y vencidas."""
+    now = now or timezone.now()
+    if not ids:
+        return 0
+    # transacción corta: con SQLite va por la cola de escrituras (orders/writequeue.py)
+    total = writequeue.writes.run(_expire, ids, now)
+    ids = list(ids)
+    transaction.on_commit(lambda: tokens.order_changed(ids))
+    return total
+
+
+def _expire(ids, now):
+    expired = ServiceOrder.Status.EXPIRED
+    total = 0
+    with transaction.atomic():
+        # un UPDATE por estado de origen, para saber qué contador descontar
+        for st in OPEN_STATUSES:
+            n = ServiceOrder.objects.filter(pk__in=ids, status=st).expirable(now).update(status=expired)
+            counters.status_changed(st, expired, n)
+            total += n
+    return total
+
+
+def expire_due(now=None, chunk_size=None):
+    """
+    Respaldo por lotes: expira todo lo vencido en trozos de `chunk_size` filas,
+    cada uno en su propia transacción corta para no retener el lock de
+    escritura de SQLite. Usa el índice parcial order_open_expiry_idx.
+    Devuelve {"expired", "chunks", "elapsed_ms"}.
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or _setting("ORDER_EXPIRY_CHUNK_SIZE", 500)
+    started = time.perf_counter()
+    total = chunks = 0
+    while True:
+        ids = list(
+            ServiceOrder.objects.expirable(now).order_by().values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        total += expire_ids(ids, now)
+        chunks += 1
+        if len(ids) < chunk_size:
+            break
+    stats = {
+        "expired": total,
+        "chunks": chunks,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info("expire_due: %(expired)s órdenes en %(chunks)s lotes (%(elapsed_ms)s ms)", stats)
+    return stats
+
+
+def expire_if_due(order, now=None):
+    """
+    Expiración perezosa al leer: si la orden ya venció devuelve True y, si
+    seguía abierta, la marca como expirada (en BD y en memoria).
+    """
+    now = now or timezone.now()
+    if not (order.expires_at and order.expires_at < now):
+        return False
+    if order.status in (ServiceOrder.Status.PENDING, ServiceOrder.Status.IN_USE):
+        expire_ids([order.pk], now)
+        order.status = ServiceOrder.Status.EXPIRED
+    return True
+
+
+class ExpiryScheduler:
+    """
+    Expira cada orden en su deadline exacto sin recorrer la tabla.
+
+    Mantiene un heap (expires_at, id) con las órdenes que vencen dentro de
+    `horizon` segundos. Se alimenta de dos fuentes: create_order (push en el
+    mismo proceso) y un refill periódico que lee del índice parcial sólo las
+    órdenes abiertas que vencen dentro del horizonte. El hilo duerme hasta el
+    próximo deadline y entonces expira esas órdenes por id.
+    """
+
+    def __init__(self, horizon=None, refill_interval=None, batch=None):
+        self.horizon = horizon or _setting("ORDER_EXPIRY_HORIZON", 60)
+        self.refill_interval = refill_interval or _setting("ORDER_EXPIRY_REFILL_INTERVAL", 1.0)
+        self.batch = batch or _setting("ORDER_EXPIRY_CHUNK_SIZE", 500)
+        self._heap = []
+        self._queued = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.expired = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def push(self, order_id, expires_at):
+        if expires_at is None:
+            return
+        with self._cond:
+            if order_id in self._queued:
+                return
+            heapq.heappush(self._heap, (expires_at.timestamp(), order_id))
+            self._queued.add(order_id)
+            self._cond.notify()
+
+    def refill(self, now=None):
+        now = now or timezone.now()
+        until = now + datetime.timedelta(seconds=self.horizon)
+        rows = (
+            ServiceOrder.objects.open()
+            .filter(expires_at__lte=until)
+            .order_by("expires_at")
+            .values_list("id", "expires_at")[:self.batch]
+        )
+        for order_id, expires_at in rows:
+            self.push(order_id, expires_at)
+
+    def run_pending(self):
+        """Expira lo que ya venció en el heap. Devuelve cuántas se marcaron."""
+        due = []
+        now_ts = time.time()
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now_ts:
+                _, order_id = heapq.heappop(self._heap)
+                self._queued.discard(order_id)
+                due.append(order_id)
+        if not due:
+            return 0
+        started = time.perf_counter()
+        n = expire_ids(due)
+        self.expired += n
+        logger.info("expiry: %s órdenes expiradas en su deadline (%.2f ms)",
+                    n, (time.perf_counter() - started) * 1000)
+        return n
+
+    def _next_wakeup(self, next_refill):
+        with self._cond:
+            head = self._heap[0][0] if self._heap else next_refill
+        return max(0.0, min(head, next_refill) - time.time())
+
+    def run_forever(self):
+        # Al arrancar se pone al día con el respaldo por lotes
+        expire_due()
+        next_refill = 0.0
+        while not self._stopping:
+            try:
+                if time.time() >= next_refill:
+                    close_old_connections()
+                    self.refill()
+                    next_refill = time.time() + self.refill_interval
+                self.run_pending()
+            except Exception:
+                logger.exception("Error en el scheduler de expiración")
+                next_refill = time.time() + self.refill_interval
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(timeout=self._next_wakeup(next_refill))
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run_forever, name="order-expiry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+scheduler = ExpiryScheduler()
+
+
+def schedule_expiry(order):
+    """
+    Llamado desde create_order. Si el scheduler corre en este proceso le pasa
+    el deadline; con ORDER_EXPIRY_SCHEDULER_IN_PROCESS se arranca aquí mismo.
+    Si corre aparte (manage.py run_expiry_scheduler) lo toma en su refill.
+    """
+    if not scheduler.running and _setting("ORDER_EXPIRY_SCHEDULER_IN_PROCESS", False):
+        scheduler.start()
+    if scheduler.running:
+        scheduler.push(order.id, order.expires_at)
@@ -0,0 +1,184 @@
+import csv, datetime, hashlib, io, json, logging, uuid
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from accounts.models import User
+from . import counters
+from .artifacts import schedule_prerender
+from .expiration import schedule_expiry
+from .jwt_audit import make_ot_token
+from .models import ServiceOrder
+from .serializers import ServiceOrderCreateSerializer
+
+logger = logging.getLogger(__name__)
+
+# Columnas que se aceptan (las mismas que create_order)
+FIELDS = ("technician_id", "technician_name", "seconds", "minutes", "hours", "days")
+
+
+def expires_at_for(data, now=None):
+    # Expiración pedida (segundos/minutos/horas/días); por defecto una hora
+    delta = datetime.timedelta(
+        seconds=data.get("seconds", 0),
+        minutes=data.get("minutes", 0),
+        hours=data.get("hours", 0),
+        days=data.get("days", 0),
+    )
+    now = now or timezone.now()
+    return now + (delta if delta.total_seconds() > 0 else datetime.timedelta(hours=1))
+
+
+def read_rows(content, fmt):
+    """
+    Filas (dicts) de un CSV con encabezado o de un JSON (lista de objetos, o
+    {"orders": [...]}). `content`: bytes o str. Lanza ValueError si no se
+    puede leer.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8-sig")
+    if fmt == "json":
+        data = json.loads(content)
+        rows = data.get("orders") if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise ValueError("Se esperaba una lista de órdenes")
+        return rows
+    reader = csv.DictReader(io.StringIO(content))
+    if not reader.fieldnames or "technician_id" not in reader.fieldnames:
+        raise ValueError("El CSV necesita encabezado con technician_id y technician_name")
+    # celdas vacías = campo ausente (p.ej. sólo una de las columnas de expiración)
+    return [{k: v for k, v in row.items() if k in FIELDS and v not in ("", None)} for row in reader]
+
+
+def validate_rows(rows):
+    """
+    Valida cada fila con el serializer de create_order y los técnicos con una
+    sola consulta. Devuelve (válidas [(nº fila, datos, técnico)], errores).
+    Las filas se numeran desde 1.
+    """
+    parsed, errors = [], []
+    for n, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({"row": n, "errors": {"detail": "Se esperaba un objeto"}})
+            continue
+        s = ServiceOrderCreateSerializer(data=row)
+        if s.is_valid():
+            parsed.append((n, s.validated_data))
+        else:
+            errors.append({"row": n, "errors": s.errors})
+
+    ids = {data["technician_id"] for _, data in parsed}
+    techs = User.objects.filter(role="TECNICO").in_bulk(ids) if ids else {}
+    valid = []
+    for n, data in parsed:
+        tech = techs.get(data["technician_id"])
+        if tech is None:
+            errors.append({"row": n, "errors": {"technician_id": ["Técnico no válido."]}})
+        else:
+            valid.append((n, data, tech))
+    errors.sort(key=lambda e: e["row"])
+    return valid, errors
+
+
+def _reserve_ids(n):
+    """
+    n ids nuevos de ServiceOrder, para firmar los JWT antes del INSERT, o
+    None si el motor no lo permite. En SQLite hay que llamarlo con el lock
+    de escritura ya tomado (dentro de la transacción y después de escribir
+    algo): hasta el commit nadie más inserta, así que sqlite_sequence (la
+    tabla usa AUTOINCREMENT) no se mueve.
+    """
+    table = ServiceOrder._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            start = (row[0] if row else 0) + 1
+            return list(range(start, start + n))
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, n]
+            )
+            return [r[0] for r in cursor.fetchall()]
+    return None
+
+
+def _sign(created_by, order):
+    order.jwt_token, order.ot_token_jti = make_ot_token(created_by, order)
+    order.ot_token = order.jwt_token
+    order.jwt_hash = hashlib.sha256(order.jwt_token.encode()).hexdigest()
+
+
+def _insert_chunk(created_by, chunk, now):
+    """
+    Un lote en su propia transacción: contadores, ids reservados, JWT
+    firmados y un único INSERT masivo. Sin reserva de ids (otros motores) se
+    firma después del INSERT y se guarda con un UPDATE masivo.
+    """
+    orders = [
+        ServiceOrder(
+            uuid_order=uuid.uuid4(),
+            technician=tech,
+            technician_name=data["technician_name"],
+            expires_at=expires_at_for(data, now),
+            status=ServiceOrder.Status.PENDING,
+        )
+        for _, data, tech in chunk
+    ]
+    with transaction.atomic():
+        # primera escritura del lote: en SQLite toma el lock antes de reservar
+        counters.orders_created(orders)
+        ids = _reserve_ids(len(orders))
+        if ids is not None:
+            for order, pk in zip(orders, ids):
+                order.id = pk
+                _sign(created_by, order)
+            ServiceOrder.objects.bulk_create(orders)
+        else:
+            ServiceOrder.objects.bulk_create(orders)
+            for order in orders:
+                _sign(created_by, order)
+            ServiceOrder.objects.bulk_update(orders, ["jwt_token", "jwt_hash", "ot_token", "ot_token_jti"])
+        created = [o.id for o in orders]
+
+        def prerender():
+            for order_id in created:
+                schedule_prerender(order_id)
+
+        transaction.on_commit(prerender)
+    return orders
+
+
+def create_order(created_by, data, tech):
+    """
+    Una sola orden (endpoint create_order) por el mismo camino que un lote:
+    el JWT se firma con el id reservado y la fila entra con un único INSERT.
+    """
+    return _insert_chunk(created_by, [(None, data, tech)], timezone.now())[0]
+
+
+def create_orders(created_by, rows, chunk_size=None):
+    """
+    Alta masiva de órdenes (endpoint bulk_create_orders y manage.py
+    import_orders). Las filas válidas se insertan en lotes de `chunk_size`,
+    cada uno en una transacción corta; las inválidas se informan por fila.
+    Devuelve {"created": [ids], "errors": [{"row", "errors"}], "chunks"}.
+    """
+    chunk_size = chunk_size or getattr(settings, "ORDER_IMPORT_CHUNK_SIZE", 500)
+    valid, errors = validate_rows(rows)
+    now = timezone.now()
+    created, chunks = [], 0
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            orders = _insert_chunk(created_by, chunk, now)
+        except DatabaseError as e:
+            logger.exception("Falló el lote de filas %s-%s", chunk[0][0], chunk[-1][0])
+            errors.extend({"row": n, "errors": {"detail": f"Error de base de datos: {e}"}} for n, _, _ in chunk)
+            continue
+        chunks += 1
+        for order in orders:
+            schedule_expiry(order)
+            created.append(order.id)
+    errors.sort(key=lambda e: e["row"])
+    return {"created": created, "errors": errors, "chunks": chunks}
@@ -1,6 +1,9 @@
 from rest_framework_simplejwt.tokens import AccessToken
 from django.utils import timezone
 
+from .metrics import JWT_SECONDS, timed
+
+@timed(JWT_SECONDS, "order")
 def make_ot_token(created_by_user, order):
     """
     Genera el JWT principal de la orden de trabajo (OT).
@@ -14,11 +17,15 @@ def make_ot_token(created_by_user, order):
     return str(t), t["jti"]
 
 
-def make_audit_token(admin_user, order, action, old=None, new=None):
+@timed(JWT_SECONDS, "audit")
+def make_audit_token(admin_user, order, action, old=None, new=None, jti=None, at=None):
     """
     Genera un JWT de auditoría para cambios hechos por administrativos.
+    `jti` y `at` (ISO) permiten firmar después un evento ya registrado.
     """
     t = AccessToken()
+    if jti:
+        t["jti"] = jti
     t["typ"] = "audit"
     t["sub"] = admin_user.id
     t["role"] = getattr(admin_user, "role", None)
@@ -26,5 +33,22 @@ def make_audit_token(admin_user, order, action, old=None, new=None):
     t["action"] = action
     t["old"] = old or {}
     t["new"] = new or {}
-    t["iat_human"] = timezone.now().isoformat()
+    t["iat_human"] = at or timezone.now().isoformat()
     return str(t), t["jti"]
+
+
+@timed(JWT_SECONDS, "audit_root")
+def make_audit_root_token(batch):
+    """
+    Firma de un lote de auditoría (modo "merkle"): una por lote en vez de
+    una por fila. Cubre la raíz, el encadenamiento y el tamaño.
+    """
+    t = AccessToken()
+    t["typ"] = "audit_root"
+    t["batch_id"] = batch.id
+    t["prev_id"] = batch.prev_id
+    t["root"] = batch.root
+    t["chain"] = batch.chain
+    t["size"] = batch.size
+    t["iat_human"] = timezone.now().isoformat()
+    return str(t)
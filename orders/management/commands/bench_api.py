@@ -0,0 +1,100 @@
+import json, os, random, shutil, tempfile, time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from orders.audit import spool
+from orders.benchmarks import dataset, runner
+from orders.tokens import token_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark de la API de órdenes sobre una BD de prueba temporal: siembra datos "
+        "sintéticos, recorre los endpoints con clientes concurrentes y reporta throughput, "
+        "p50/p95/p99 y consultas SQL por endpoint en JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--technicians", type=int, default=10)
+        parser.add_argument("--orders", type=int, default=2000)
+        parser.add_argument("--evidences", type=int, default=100)
+        parser.add_argument("--image-kb", type=int, default=1024, help="Tamaño de cada foto sembrada/subida")
+        parser.add_argument("--requests", type=int, default=200, help="Peticiones por endpoint")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--endpoints", help="Lista separada por comas (por defecto, todos)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Guardar el reporte JSON en este archivo")
+        parser.add_argument("--baseline", help="Reporte anterior: falla si hay regresiones")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Margen de p95 contra el baseline")
+
+    def handle(self, *args, **opts):
+        baseline = None
+        if opts["baseline"]:
+            with open(opts["baseline"]) as f:
+                baseline = json.load(f)
+
+        tmp = tempfile.mkdtemp(prefix="bench_api_")
+        # BD en archivo (no en memoria) para que los hilos del benchmark compartan la misma
+        test_settings = connection.settings_dict.setdefault("TEST", {})
+        old_test_name = test_settings.get("NAME")
+        test_settings["NAME"] = os.path.join(tmp, "bench.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=["testserver"],
+                MEDIA_ROOT=os.path.join(tmp, "media"),
+                ORDER_PDF_CACHE_DIR=os.path.join(tmp, "media", "cache", "pdf"),
+                ORDER_AUDIT_SPOOL_DIR=os.path.join(tmp, "audit_spool"),
+                # sólo el camino de la petición: sin pre-render ni derivados en línea
+                ORDER_PRERENDER_MODE="off",
+                ORDER_DERIVATIVES_MODE="off",
+            ):
+                report = self.run(opts)
+                spool.stop()
+        finally:
+            token_cache.clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings["NAME"] = old_test_name
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        text = json.dumps(report, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w") as f:
+                f.write(text)
+        self.stdout.write(text)
+
+        if baseline is not None:
+            found = runner.regressions(report, baseline, opts["tolerance"])
+            if found:
+                raise CommandError("Regresiones contra el baseline:\n" + "\n".join(found))
+            self.stdout.write(self.style.SUCCESS("Sin regresiones contra el baseline"))
+
+    def run(self, opts):
+        random.seed(opts["seed"])
+        started = time.perf_counter()
+        ds = dataset.seed(
+            technicians=opts["technicians"], orders=opts["orders"], evidences=opts["evidences"],
+            image_size=opts["image_kb"] * 1024, rng=random.Random(opts["seed"]),
+        )
+        seed_s = time.perf_counter() - started
+
+        wanted = set(opts["endpoints"].split(",")) if opts["endpoints"] else None
+        endpoints = {}
+        for scenario in runner.scenarios(ds):
+            if wanted and scenario.name not in wanted:
+                continue
+            endpoints[scenario.name] = runner.run_scenario(
+                scenario, opts["requests"], opts["concurrency"], seed=opts["seed"]
+            )
+            self.stderr.write(f"{scenario.name}: {endpoints[scenario.name]['p50_ms']} ms p50")
+
+        return {
+            "dataset": {
+                "technicians": opts["technicians"], "orders": len(ds.orders),
+                "evidences": ds.evidences, "image_kb": opts["image_kb"], "seed_s": round(seed_s, 2),
+            },
+            "config": {"requests": opts["requests"], "concurrency": opts["concurrency"],
+                       "database": connection.vendor},
+            "endpoints": endpoints,
+        }
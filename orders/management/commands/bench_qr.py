@@ -0,0 +1,59 @@
+import hashlib, io, time, uuid
+from types import SimpleNamespace
+import qrcode
+from django.core.management.base import BaseCommand
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from orders.jwt_audit import make_ot_token
+from orders.pdf import draw_qr, qr_matrix, qr_value_for
+
+
+class Command(BaseCommand):
+    help = "Compara versión, módulos y tiempo de render del QR: JWT completo vs. credencial compacta"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument("--order-id", type=int, default=123456)
+
+    def handle(self, *args, **opts):
+        admin = SimpleNamespace(id=1)
+        orders = []
+        for i in range(opts["orders"]):
+            order = SimpleNamespace(id=opts["order_id"] + i, uuid_order=uuid.uuid4())
+            order.jwt_token, _ = make_ot_token(admin, order)
+            order.jwt_hash = hashlib.sha256(order.jwt_token.encode()).hexdigest()
+            orders.append(order)
+
+        self.stdout.write(f"{len(orders)} órdenes, id desde {opts['order_id']}")
+        self.stdout.write(f"{'formato':<8} {'chars':>6} {'versión':>8} {'módulos':>9} "
+                          f"{'matriz ms':>10} {'dibujo ms':>10}")
+        for fmt in ("jwt", "compact"):
+            values = [qr_value_for(o, fmt=fmt) for o in orders]
+
+            # matriz sin la caché de qr_matrix: lo que cuesta el primer render
+            t = time.perf_counter()
+            versions = []
+            for v in values:
+                qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+                qr.add_data(v)
+                qr.make(fit=True)
+                versions.append(qr.version)
+            matrix_ms = (time.perf_counter() - t) * 1000 / len(values)
+
+            qr_matrix.cache_clear()
+            for v in values:
+                qr_matrix(v)
+            c = canvas.Canvas(io.BytesIO(), pagesize=A4)
+            t = time.perf_counter()
+            for v in values:
+                draw_qr(c, v, 50, 50, 160)
+            draw_ms = (time.perf_counter() - t) * 1000 / len(values)
+
+            version = max(versions)
+            side = 17 + 4 * version  # sin zona de silencio
+            self.stdout.write(
+                f"{fmt:<8} {max(len(v) for v in values):>6} {version:>8} "
+                f"{f'{side}x{side}':>9} {matrix_ms:>10.2f} {draw_ms:>10.2f}"
+            )
+        qr_matrix.cache_clear()
@@ -0,0 +1,76 @@
+import io, os, shutil, tempfile, time, uuid
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from PIL import Image
+
+from orders.derivatives import make_derivative, PRINT_MAX_PX
+from orders.pdf import render_full_report
+
+
+class Command(BaseCommand):
+    help = "Compara tiempo y tamaño de download_full_pdf con fotos originales vs. derivados"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", type=int, default=4)
+        parser.add_argument("--megapixels", type=float, default=12)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        tmp = tempfile.mkdtemp(prefix="bench_report_")
+        w = int((opts["megapixels"] * 1e6 * 4 / 3) ** 0.5)
+        h = int(w * 3 / 4)
+
+        originals, prints = [], []
+        for i in range(opts["images"]):
+            # ruido: se comprime como una foto real, no como un color plano
+            im = Image.frombytes("RGB", (w, h), os.urandom(w * h * 3))
+            path = os.path.join(tmp, f"foto_{i}.jpg")
+            im.save(path, format="JPEG", quality=90)
+            originals.append(path)
+
+        started = time.perf_counter()
+        for path in originals:
+            out = path.replace(".jpg", "_print.jpg")
+            with open(path, "rb") as src, open(out, "wb") as dst:
+                dst.write(make_derivative(src, PRINT_MAX_PX, 85))
+            prints.append(out)
+        derive_ms = (time.perf_counter() - started) * 1000 / len(originals)
+
+        order = SimpleNamespace(
+            id=1, uuid_order=uuid.uuid4(), technician_name="Bench", status="completed",
+            jwt_token="x" * 400, created_at=timezone.now(), expires_at=None,
+        )
+
+        def evidences(paths):
+            return [
+                SimpleNamespace(
+                    kind="foto_domicilio", created_at=timezone.now(), print_file=None,
+                    file=SimpleNamespace(name=p, path=p),
+                )
+                for p in paths
+            ]
+
+        def run(paths):
+            times, size = [], 0
+            for _ in range(opts["repeat"]):
+                buf = io.BytesIO()
+                t = time.perf_counter()
+                render_full_report(order, evidences(paths), buf)
+                times.append((time.perf_counter() - t) * 1000)
+                size = buf.tell()
+            return min(times), size
+
+        try:
+            before_ms, before_size = run(originals)
+            after_ms, after_size = run(prints)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.stdout.write(f"{opts['images']} fotos de {w}x{h} px ({opts['megapixels']} MP)")
+        self.stdout.write(f"derivado por foto:  {derive_ms:8.1f} ms (se hace una vez, en segundo plano)")
+        self.stdout.write(f"originales: {before_ms:8.1f} ms  {before_size / 1e6:8.2f} MB")
+        self.stdout.write(f"derivados:  {after_ms:8.1f} ms  {after_size / 1e6:8.2f} MB")
+        self.stdout.write(self.style.SUCCESS(
+            f"x{before_ms / after_ms:.1f} más rápido, x{before_size / after_size:.1f} más chico"
+        ))
@@ -0,0 +1,174 @@
+import asyncio, datetime, hashlib, json, time, uuid
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+from orders import counters
+from orders.benchmarks.dataset import noise_jpeg
+from orders.benchmarks.runner import pct
+from orders.jwt_audit import make_ot_token
+from orders.models import ServiceOrder
+
+BENCH_USER = "bench_tecnico"
+PATHS = {
+    "sync": "/api/orders/{id}/{action}/",
+    "async": "/api/async/orders/{id}/{action}/",
+}
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return f"multipart/form-data; boundary={boundary}", b"".join(parts)
+
+
+async def http_post(host, port, path, token, content_type, body, rate=None):
+    """
+    POST crudo sobre asyncio. Con `rate` (bytes/s) el cuerpo se manda de a
+    poco, como un celular con mala señal. Devuelve (status, segundos).
+    """
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = (
+            f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\nAuthorization: Bearer {token}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        )
+        writer.write(head.encode())
+        if rate:
+            step = max(1, rate // 10)
+            for i in range(0, len(body), step):
+                writer.write(body[i:i + step])
+                await writer.drain()
+                await asyncio.sleep(0.1)
+        else:
+            writer.write(body)
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1]), time.perf_counter() - started
+    finally:
+        writer.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga con clientes lentos: N subidas de fail/ a baja velocidad "
+        "y, en paralelo, la latencia de validate_token. Correr contra un servidor "
+        "WSGI (gunicorn) y uno ASGI (uvicorn) que usen la misma BD que este comando."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--endpoint", choices=list(PATHS), default="async")
+        parser.add_argument("--clients", type=int, default=100, help="Subidas lentas simultáneas")
+        parser.add_argument("--size", type=int, default=64 * 1024, help="Bytes de la foto")
+        parser.add_argument("--rate", type=int, default=8 * 1024, help="Bytes/s por cliente lento")
+        parser.add_argument("--probe-interval", type=float, default=0.2)
+        parser.add_argument("--timeout", type=float, default=60)
+        parser.add_argument("--keep", action="store_true",
+                            help="No borrar las órdenes, evidencias ni el usuario de prueba")
+
+    def seed(self, n):
+        tech, created = User.objects.get_or_create(username=BENCH_USER, defaults={"role": "TECNICO"})
+        orders = []
+        expires_at = timezone.now() + datetime.timedelta(hours=2)
+        with transaction.atomic():
+            for _ in range(n):
+                order = ServiceOrder.objects.create(
+                    technician=tech, technician_name="Bench", jwt_token="", jwt_hash="", expires_at=expires_at,
+                )
+                order.jwt_token, order.ot_token_jti = make_ot_token(tech, order)
+                order.ot_token = order.jwt_token
+                order.jwt_hash = hashlib.sha256(order.jwt_token.encode()).hexdigest()
+                order.save(update_fields=["jwt_token", "jwt_hash", "ot_token", "ot_token_jti"])
+                counters.order_created(order)
+                orders.append(order)
+        return tech, created, orders
+
+    def cleanup(self, tech, created, orders):
+        # Corre contra la BD y el storage reales: se borra todo lo sembrado.
+        # Las evidencias caen en cascada con su orden y sus blobs se liberan
+        # al confirmar (release_blob); el usuario sólo si lo creó este comando
+        with transaction.atomic():
+            ServiceOrder.objects.filter(pk__in=[o.pk for o in orders]).delete()
+            if created:
+                tech.delete()
+
+    def handle(self, *args, **opts):
+        url = urlsplit(opts["url"])
+        host, port = url.hostname, url.port or 80
+        tech, created, orders = self.seed(opts["clients"] + 1)
+        probe_order, slow_orders = orders[0], orders[1:]
+        token = str(AccessToken.for_user(tech))
+        photo = noise_jpeg(opts["size"])
+        path = PATHS[opts["endpoint"]]
+
+        async def slow(order):
+            ctype, body = multipart(
+                {"jwt": order.jwt_token, "justification": "ausencia_titular"},
+                {"photo_address": ("casa.jpg", photo)},
+            )
+            return await http_post(host, port, path.format(id=order.id, action="fail"),
+                                   token, ctype, body, rate=opts["rate"])
+
+        async def probes(done):
+            latencies, failures = [], 0
+            body = json.dumps({"jwt": probe_order.jwt_token}).encode()
+            while not done.is_set():
+                try:
+                    status, secs = await asyncio.wait_for(http_post(
+                        host, port, path.format(id=probe_order.id, action="validate_token"),
+                        token, "application/json", body), opts["timeout"])
+                    latencies.append(secs)
+                    failures += status != 200
+                except Exception:
+                    failures += 1
+                await asyncio.sleep(opts["probe_interval"])
+            return latencies, failures
+
+        async def run():
+            done = asyncio.Event()
+            probe_task = asyncio.create_task(probes(done))
+            started = time.perf_counter()
+            results = await asyncio.gather(
+                *(asyncio.wait_for(slow(o), opts["timeout"]) for o in slow_orders), return_exceptions=True
+            )
+            elapsed = time.perf_counter() - started
+            done.set()
+            return results, elapsed, await probe_task
+
+        try:
+            results, elapsed, (latencies, probe_failures) = asyncio.run(run())
+        finally:
+            if not opts["keep"]:
+                self.cleanup(tech, created, orders)
+
+        ok = [r[1] for r in results if not isinstance(r, Exception) and r[0] == 200]
+        report = {
+            "endpoint": opts["endpoint"],
+            "clients": opts["clients"],
+            "upload_bytes": len(photo),
+            "rate_bytes_s": opts["rate"],
+            "uploads_ok": len(ok),
+            "uploads_failed": len(results) - len(ok),
+            "elapsed_s": round(elapsed, 2),
+            "upload_p50_ms": pct(ok, 50),
+            "probe_count": len(latencies),
+            "probe_failures": probe_failures,
+            "probe_p50_ms": pct(latencies, 50),
+            "probe_p95_ms": pct(latencies, 95),
+            "probe_max_ms": round(max(latencies) * 1000, 1) if latencies else None,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
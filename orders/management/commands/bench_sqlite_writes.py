@@ -0,0 +1,215 @@
+import json, multiprocessing, os, random, shutil, tempfile, threading, time
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from accounts.models import User
+from orders import audit, closing, counters, expiration, imports, writequeue
+from orders.benchmarks.runner import pct
+from orders.models import Evidence, ServiceOrder
+
+# "default": SQLite como viene (journal de rollback, BEGIN diferido, timeout
+# de 5 s, sin cola). "wal": el perfil de backend/settings.py (WAL, pragmas,
+# BEGIN IMMEDIATE, conexiones persistentes) sin la cola. "tuned": además la
+# cola de escrituras.
+MODES = {
+    "default": ({}, 0, False),
+    "wal": (settings.DATABASES["default"].get("OPTIONS", {}), 600, False),
+    "tuned": (settings.DATABASES["default"].get("OPTIONS", {}), 600, True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrencia de escrituras en SQLite: cierres fail concurrentes desde varios procesos "
+        "+ expiración periódica + lecturas, con SQLite por defecto y con el perfil de producción. "
+        "Reporta cierres/s, tasa de 'database is locked' y latencias"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4, help="Procesos (como workers de gunicorn)")
+        parser.add_argument("--threads", type=int, default=16, help="Hilos que cierran órdenes, en total")
+        parser.add_argument("--readers", type=int, default=2, help="Hilos que listan órdenes, en total")
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument("--orders", type=int, default=20000)
+        parser.add_argument("--expiry-every", type=float, default=0.5,
+                            help="Segundos entre corridas de expire_due (el cron lo hace por minuto)")
+        parser.add_argument("--modes", default="default,wal,tuned")
+        parser.add_argument("--output", help="Guardar el reporte JSON en este archivo")
+
+    def handle(self, *args, **opts):
+        db = connection.settings_dict
+        saved = {k: db.get(k) for k in ("NAME", "OPTIONS", "CONN_MAX_AGE")}
+        test_settings = db.setdefault("TEST", {})
+        old_test_name = test_settings.get("NAME")
+        tmp = tempfile.mkdtemp(prefix="bench_sqlite_")
+        test_settings["NAME"] = os.path.join(tmp, "seed.sqlite3")
+        db["OPTIONS"], db["CONN_MAX_AGE"] = {}, 0
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        report = {"config": {k: opts[k] for k in ("processes", "threads", "readers", "seconds", "orders", "expiry_every")},
+                  "modes": {}}
+        try:
+            with override_settings(
+                MEDIA_ROOT=os.path.join(tmp, "media"), ORDER_AUDIT_SPOOL_DIR=os.path.join(tmp, "spool"),
+                ORDER_DERIVATIVES_MODE="off", ORDER_PRERENDER_MODE="off",
+            ):
+                seed_path = connection.settings_dict["NAME"]
+                self.seed(opts)
+                connection.close()
+                for mode in opts["modes"].split(","):
+                    path = os.path.join(tmp, f"{mode}.sqlite3")
+                    shutil.copyfile(seed_path, path)
+                    options, max_age, use_queue = MODES[mode]
+                    db["NAME"], db["OPTIONS"], db["CONN_MAX_AGE"] = path, dict(options), max_age
+                    with override_settings(ORDER_WRITE_QUEUE=use_queue):
+                        report["modes"][mode] = self.run(opts)
+                    # sus hilos tienen conexiones abiertas a la base de este modo
+                    writequeue.writes.stop()
+                    audit.spool.stop()
+                    connection.close()
+                    self.stderr.write(f"{mode}: {json.dumps(report['modes'][mode])}")
+                db["NAME"] = seed_path
+        finally:
+            db["OPTIONS"], db["CONN_MAX_AGE"] = {}, 0
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            db.update(saved)
+            test_settings["NAME"] = old_test_name
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        text = json.dumps(report, indent=2)
+        if opts["output"]:
+            with open(opts["output"], "w") as f:
+                f.write(text)
+        self.stdout.write(text)
+
+    def seed(self, opts):
+        admin = User.objects.create_user("bench_admin", password="x", role="ADMIN")
+        tech = User.objects.create_user("bench_tec", password="x", role="TECNICO")
+        rng = random.Random(0)
+        # las que se cierran no vencen durante la corrida; las otras vencen de
+        # a poco, así la expiración siempre tiene algo que hacer
+        rows = [{"technician_id": tech.id, "technician_name": "Bench", "hours": 2}
+                for _ in range(opts["orders"])]
+        rows += [{"technician_id": tech.id, "technician_name": "Expira",
+                  "seconds": rng.randint(5, 5 + int(opts["seconds"] * 2))} for _ in range(opts["orders"] // 2)]
+        result = imports.create_orders(admin, rows)
+        if result["errors"]:
+            raise RuntimeError(result["errors"][:3])
+
+    def run(self, opts):
+        # Procesos como los workers de gunicorn: el lock de SQLite se disputa
+        # entre procesos (y la cola sólo ordena lo de cada uno)
+        ids = list(ServiceOrder.objects.filter(technician_name="Bench").order_by("?").values_list("id", flat=True))
+        n = max(1, opts["processes"])
+        connection.close()
+        ctx = multiprocessing.get_context("fork")
+        results = ctx.SimpleQueue()
+        start_at = time.time() + 1.0
+        procs = [ctx.Process(target=_process, args=(results, i, n, ids[i::n], opts, start_at)) for i in range(n)]
+        for p in procs:
+            p.start()
+        parts = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+
+        outcome, closes, expiry, reads = Counter(), [], [], 0
+        for part in parts:
+            outcome.update(part["outcome"])
+            closes += part["closes"]
+            expiry += part["expiry"]
+            reads += part["reads"]
+        wall = opts["seconds"]
+        attempts = sum(outcome[k] for k in ("closed", "conflicts", "locked", "errors"))
+        return {
+            **{k: outcome[k] for k in ("closed", "conflicts", "locked", "errors", "read_locked", "expiry_locked")},
+            "closes_per_s": round(outcome["closed"] / wall, 1),
+            "lock_error_rate": round(outcome["locked"] / attempts, 4) if attempts else None,
+            "close_p50_ms": pct(closes, 50), "close_p95_ms": pct(closes, 95),
+            "close_p99_ms": pct(closes, 99), "close_max_ms": pct(closes, 100),
+            "expiry_runs": len(expiry), "expired": sum(x for _, x in expiry),
+            "expired_per_s": round(sum(x for _, x in expiry) / wall, 1),
+            "expiry_p99_ms": pct([t for t, _ in expiry], 99),
+            "reads_per_s": round(reads / wall, 1),
+        }
+
+
+def _share(total, i, n):
+    # hilos que le tocan al proceso i de n
+    return total // n + (1 if i < total % n else 0)
+
+
+def _process(results, index, n, ids, opts, start_at):
+    tech = User.objects.get(username="bench_tec")
+    pool = list(ServiceOrder.objects.filter(id__in=ids).only("id", "status", "jwt_token", "technician_id"))
+    connection.close()
+    pool_lock = threading.Lock()
+    stats_lock = threading.Lock()
+    closes, expiry, reads = [], [], [0]
+    outcome = Counter()
+    deadline = start_at + opts["seconds"]
+    evidence = [(Evidence.Type.FOTO_DOMICILIO, "subida_foto_domicilio", "evidences/bench.jpg", "0" * 64)]
+
+    def note(key, seconds=None):
+        with stats_lock:
+            outcome[key] += 1
+            if seconds is not None:
+                closes.append(seconds)
+
+    def closer():
+        while time.time() < deadline:
+            with pool_lock:
+                order = pool.pop() if pool else None
+            if order is None:
+                return
+            status, fields = closing.fail_closing({"justification": "ausencia_titular"})
+            started = time.perf_counter()
+            try:
+                ok = closing.close_order(tech, order, status, fields, evidence, order.jwt_token)
+            except OperationalError as e:
+                note("locked" if "locked" in str(e) else "errors")
+                continue
+            note("closed" if ok else "conflicts", time.perf_counter() - started)
+
+    def reader():
+        while time.time() < deadline:
+            try:
+                list(ServiceOrder.objects.filter(status="pending").order_by("-id")[:50])
+                counters.snapshot()
+            except OperationalError:
+                note("read_locked")
+                continue
+            with stats_lock:
+                reads[0] += 1
+
+    def expirer():
+        while time.time() + opts["expiry_every"] < deadline:
+            time.sleep(opts["expiry_every"])
+            started = time.perf_counter()
+            try:
+                done = expiration.expire_due()["expired"]
+            except OperationalError:
+                note("expiry_locked")
+                continue
+            expiry.append((time.perf_counter() - started, done))
+
+    def thread(target):
+        def body():
+            time.sleep(max(0.0, start_at - time.time()))
+            try:
+                target()
+            finally:
+                connection.close()
+        return threading.Thread(target=body)
+
+    threads = ([thread(closer) for _ in range(_share(opts["threads"], index, n))]
+               + [thread(reader) for _ in range(_share(opts["readers"], index, n))]
+               + ([thread(expirer)] if index == 0 else []))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writequeue.writes.stop()
+    audit.spool.stop(flush=False)
+    results.put({"outcome": dict(outcome), "closes": closes, "expiry": expiry, "reads": reads[0]})
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from orders.models import Evidence
+from orders.storage import release_blob
+
+class Command(BaseCommand):
+    help = "Mueve las evidencias antiguas (evidences/ plano) al almacenamiento por contenido"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Sólo contar, no mover nada")
+
+    def handle(self, *args, **kwargs):
+        moved = missing = freed = 0
+        for ev in Evidence.objects.order_by("id").iterator(chunk_size=200):
+            storage = ev.file.storage
+            old_name = ev.file.name
+            if not old_name or storage.is_content_name(old_name):
+                continue
+            if not storage.exists(old_name):
+                missing += 1
+                continue
+            if kwargs["dry_run"]:
+                moved += 1
+                continue
+
+            with transaction.atomic():
+                with storage.open(old_name, "rb") as f:
+                    new_name = storage.save(old_name, f)  # suma su referencia
+                ev.file.name = new_name
+                # el nombre nuevo es el propio sha256
+                ev.file_hash = new_name.rsplit("/", 1)[-1].split(".")[0]
+                ev.save(update_fields=["file", "file_hash"])
+                # al confirmar, collect_blob lo borra si era la última referencia
+                release_blob(old_name)
+            moved += 1
+            if not storage.exists(old_name):
+                freed += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{moved} evidencias movidas, {freed} archivos viejos borrados, {missing} sin archivo"
+        ))
@@ -1,14 +1,16 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from orders.models import ServiceOrder
+from orders.expiration import expire_due
 
 class Command(BaseCommand):
     help = "Marca como expiradas todas las órdenes cuyo expires_at ya pasó"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=None,
+                            help="Filas por lote/transacción (ORDER_EXPIRY_CHUNK_SIZE)")
+
     def handle(self, *args, **kwargs):
-        now = timezone.now()
-        expiradas = ServiceOrder.objects.filter(
-            expires_at__lt=now, status__in=["pending", "in_use"]
-        )
-        total = expiradas.update(status="expired")
-        self.stdout.write(self.style.SUCCESS(f"{total} órdenes expiradas"))
+        stats = expire_due(chunk_size=kwargs["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['expired']} órdenes expiradas "
+            f"({stats['chunks']} lotes, {stats['elapsed_ms']} ms)"
+        ))
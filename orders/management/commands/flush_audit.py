@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from orders.audit import spool
+
+class Command(BaseCommand):
+    help = "Inserta en AuditLog los eventos pendientes del spool de auditoría (incluidos los de procesos caídos)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stale-after", type=float, help="Sin flock (Windows): segundos sin tocar para dar por abandonado un segmento")
+
+    def handle(self, *args, **kwargs):
+        if kwargs["stale_after"] is not None:
+            spool.stale_after = kwargs["stale_after"]
+        n = spool.flush()
+        self.stdout.write(self.style.SUCCESS(f"{n} eventos de auditoría insertados desde {spool.directory}"))
@@ -0,0 +1,41 @@
+import json, time
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from orders import imports
+
+
+class Command(BaseCommand):
+    help = (
+        "Alta masiva de órdenes desde un CSV (encabezado: technician_id, technician_name "
+        "y opcionalmente seconds/minutes/hours/days) o un JSON con la misma forma"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--admin", required=True, help="Usuario ADMIN que firma las órdenes")
+        parser.add_argument("--format", choices=["csv", "json"], help="Por defecto, según la extensión")
+        parser.add_argument("--chunk-size", type=int, help="Filas por transacción (ORDER_IMPORT_CHUNK_SIZE)")
+
+    def handle(self, *args, **opts):
+        try:
+            admin = User.objects.get(username=opts["admin"], role="ADMIN")
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el administrador {opts['admin']}")
+
+        fmt = opts["format"] or ("json" if opts["path"].lower().endswith(".json") else "csv")
+        try:
+            with open(opts["path"], "rb") as f:
+                rows = imports.read_rows(f.read(), fmt)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            raise CommandError(f"No se pudo leer {opts['path']}: {e}")
+
+        started = time.perf_counter()
+        result = imports.create_orders(admin, rows, chunk_size=opts["chunk_size"])
+        elapsed = time.perf_counter() - started
+
+        for err in result["errors"]:
+            self.stdout.write(f"fila {err['row']}: {json.dumps(err['errors'], ensure_ascii=False)}")
+        msg = (f"{len(result['created'])} órdenes creadas en {result['chunks']} lotes "
+               f"({elapsed:.2f} s), {len(result['errors'])} filas con error")
+        self.stdout.write(self.style.SUCCESS(msg) if not result["errors"] else self.style.WARNING(msg))
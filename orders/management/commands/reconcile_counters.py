@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from orders import counters
+
+class Command(BaseCommand):
+    help = "Recalcula los contadores de stats desde las tablas y corrige las diferencias"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Sólo mostrar diferencias, no corregir")
+
+    def handle(self, *args, **kwargs):
+        diff = counters.reconcile(dry_run=kwargs["dry_run"])
+        for (scope, key), (stored, real) in sorted(diff.items()):
+            self.stdout.write(f"{scope}:{key or '-'} guardado={stored} real={real}")
+        if not diff:
+            self.stdout.write(self.style.SUCCESS("Contadores al día"))
+        elif kwargs["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"{len(diff)} contadores desfasados (sin corregir)"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(diff)} contadores corregidos"))
@@ -0,0 +1,34 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from orders import rollups
+
+def parse_moment(value):
+    dt = parse_datetime(value)
+    if dt is None:
+        d = parse_date(value)
+        if d is None:
+            raise CommandError(f"Fecha inválida: {value}")
+        dt = datetime.datetime.combine(d, datetime.time.min)
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+class Command(BaseCommand):
+    help = "Recalcula los rollups por hora/día (por defecto, las últimas ORDER_ROLLUP_LOOKBACK horas)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Rehacer desde esta fecha (backfill), p.ej. 2025-01-01")
+        parser.add_argument("--until", help="Hasta esta fecha (por defecto, ahora)")
+
+    def handle(self, *args, **kwargs):
+        if not kwargs["since"]:
+            stats = rollups.rollup_recent()
+            self.stdout.write(self.style.SUCCESS(
+                f"{stats['buckets']} tramos, {stats['pruned']} filas viejas borradas ({stats['elapsed_ms']} ms)"
+            ))
+            return
+        start = parse_moment(kwargs["since"])
+        end = parse_moment(kwargs["until"]) if kwargs["until"] else timezone.now()
+        n = rollups.rebuild(start, end)
+        pruned = rollups.prune()
+        self.stdout.write(self.style.SUCCESS(f"{n} tramos recalculados, {pruned} filas viejas borradas"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from orders.expiration import ExpiryScheduler
+
+class Command(BaseCommand):
+    help = "Proceso dedicado que expira cada orden en su deadline exacto"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--horizon", type=float, default=None,
+                            help="Segundos hacia adelante que se cargan en el heap")
+        parser.add_argument("--refill-interval", type=float, default=None,
+                            help="Cada cuántos segundos se relee el índice")
+
+    def handle(self, *args, **kwargs):
+        scheduler = ExpiryScheduler(horizon=kwargs["horizon"], refill_interval=kwargs["refill_interval"])
+        self.stdout.write("Scheduler de expiración en marcha (Ctrl+C para salir)")
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"{scheduler.expired} órdenes expiradas"))
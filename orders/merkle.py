@@ -0,0 +1,50 @@
+import hashlib
+
+# Árbol de Merkle SHA-256 con separación de dominio (0x00 hoja, 0x01 nodo):
+# una hoja no puede hacerse pasar por un nodo interno. Un nodo sin pareja
+# sube tal cual (no se duplica), así dos listas distintas nunca dan la misma raíz.
+
+
+def leaf(data: bytes) -> str:
+    return hashlib.sha256(b"\x00" + data).hexdigest()
+
+
+def _node(left: str, right: str) -> str:
+    return hashlib.sha256(b"\x01" + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def build(leaves):
+    """
+    Devuelve (raíz, pruebas): una prueba por hoja, lista de [lado, hash]
+    con lado "L" si el hermano va a la izquierda y "R" si va a la derecha.
+    """
+    if not leaves:
+        raise ValueError("Árbol vacío")
+    proofs = [[] for _ in leaves]
+    # en cada nivel: (hash, índices de las hojas que cuelgan de ese nodo)
+    level = [(h, [i]) for i, h in enumerate(leaves)]
+    while len(level) > 1:
+        nxt = []
+        for j in range(0, len(level) - 1, 2):
+            (lh, li), (rh, ri) = level[j], level[j + 1]
+            for i in li:
+                proofs[i].append(["R", rh])
+            for i in ri:
+                proofs[i].append(["L", lh])
+            nxt.append((_node(lh, rh), li + ri))
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0][0], proofs
+
+
+def root_from_proof(leaf_hash, proof):
+    h = leaf_hash
+    for side, sibling in proof:
+        h = _node(sibling, h) if side == "L" else _node(h, sibling)
+    return h
+
+
+def chain(prev_chain, root):
+    # Encadena cada lote con el anterior: borrar o cambiar un lote rompe los siguientes
+    return hashlib.sha256(((prev_chain or "") + root).encode()).hexdigest()
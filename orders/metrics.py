@@ -0,0 +1,381 @@
+import atexit, bisect, functools, json, logging, os, re, tempfile, threading, time, uuid
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends.signals import connection_created
+
+try:
+    import fcntl
+except ImportError:  # Windows: no se compactan las fotos
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Métricas en formato de texto de Prometheus, sin dependencias.
+# Cada proceso acumula en memoria (un lock por métrica, ~1 µs por
+# observación). Los que atienden HTTP (backend/wsgi.py, backend/asgi.py
+# llaman a start()) vuelcan cada ORDER_METRICS_FLUSH_INTERVAL segundos una
+# foto a ORDER_METRICS_DIR/<pid>-<azar>.json; manage.py, cron y celery no.
+# /metrics suma las fotos de todos los procesos (la propia, en vivo). Las de
+# procesos que ya terminaron se suman a AGGREGATE_FILE y se borran, así los
+# contadores nunca bajan y el directorio no crece con cada reinicio. Los
+# pids se miran en el host: un directorio por máquina o contenedor.
+
+AGGREGATE_FILE = "dead.json"
+SNAPSHOT_NAME = re.compile(r"^(\d+)-[0-9a-f]+\.json$")
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}  # (valores de las etiquetas) -> total
+
+    def inc(self, *labels, n=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + n
+        registry.dirty = True
+
+    def _empty(self):
+        return 0
+
+    def _merge(self, a, b):
+        return a + b
+
+    def _lines(self, labels, value):
+        return [f"{self.name}_total{_fmt(self.labelnames, labels)} {_num(value)}"]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (etiquetas) -> [cuenta por bucket (no acumulada) ..., +Inf, suma]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = self._empty()
+            s[i] += 1
+            s[-1] += value
+        registry.dirty = True
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def _empty(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def _merge(self, a, b):
+        if len(a) != len(b):  # buckets distintos (otra versión del código): se ignora
+            return a
+        return [x + y for x, y in zip(a, b)]
+
+    def _lines(self, labels, values):
+        names = self.labelnames + ("le",)
+        out, acc = [], 0
+        for le, n in zip(self.buckets + ("+Inf",), values):
+            acc += n
+            out.append(f"{self.name}_bucket{_fmt(names, labels + (_num(le),))} {acc}")
+        base = _fmt(self.labelnames, labels)
+        out.append(f"{self.name}_sum{base} {_num(values[-1])}")
+        out.append(f"{self.name}_count{base} {acc}")
+        return out
+
+
+class _Timer:
+    __slots__ = ("metric", "labels", "start")
+
+    def __init__(self, metric, labels):
+        self.metric, self.labels = metric, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def timed(metric, *labels):
+    """Decorador: observa en `metric` la duración de cada llamada."""
+    observe, clock = metric.observe, time.perf_counter
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(clock() - start, *labels)
+        return wrapper
+    return decorator
+
+
+def _num(v):
+    if isinstance(v, str):
+        return v
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def _fmt(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in zip(names, values)) + "}"
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._writer = None
+        self._stop = threading.Event()
+        self._file = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        snap = {}
+        for name, m in self.metrics.items():
+            with m._lock:
+                series = [[list(k), list(v) if isinstance(v, list) else v] for k, v in m._series.items()]
+            if series:
+                snap[name] = series
+        return snap
+
+    # --- multiproceso -------------------------------------------------------
+
+    def directory(self):
+        return _setting("ORDER_METRICS_DIR", None)
+
+    def start(self):
+        # Hilo que vuelca la foto del proceso (sólo procesos que atienden HTTP)
+        d = self.directory()
+        if not d or not _setting("ORDER_METRICS_ENABLED", True):
+            return
+        with self._lock:
+            if self._writer is not None:
+                return
+            os.makedirs(d, exist_ok=True)
+            self._file = os.path.join(d, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+            self._stop.clear()
+            self._writer = threading.Thread(target=self._loop, name="metrics-writer", daemon=True)
+            self._writer.start()
+
+    def _loop(self):
+        interval = _setting("ORDER_METRICS_FLUSH_INTERVAL", 5.0)
+        while not self._stop.wait(interval):
+            self.write()
+            try:
+                self.compact()
+            except OSError:
+                logger.exception("métricas: no se pudieron compactar las fotos")
+
+    def write(self):
+        if not self._file or not self.dirty:
+            return
+        self.dirty = False
+        try:
+            _dump(self._file, self.snapshot())
+        except OSError:
+            self.dirty = True
+            logger.exception("métricas: no se pudo escribir %s", self._file)
+
+    def _after_fork(self):
+        # El hijo no hereda el hilo ni debe volver a contar lo del padre.
+        # Sólo exporta si el padre exportaba (gunicorn --preload), no un
+        # proceso auxiliar cualquiera
+        exporting = self._writer is not None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = self._file = None
+        for m in self.metrics.values():
+            m._lock = threading.Lock()
+            m._series = {}
+        if exporting:
+            self.start()
+
+    def compact(self):
+        """
+        Suma a AGGREGATE_FILE las fotos de procesos que ya no existen y las
+        borra. "_merged" lista las que ya se sumaron, por si el proceso muere
+        entre escribir el agregado y borrarlas.
+        """
+        d = self.directory()
+        if not d or fcntl is None or not os.path.isdir(d):
+            return
+        dead = [e for e in os.scandir(d) if _dead_snapshot(e.name)]
+        if not dead:
+            return
+        with open(os.path.join(d, ".compact.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            path = os.path.join(d, AGGREGATE_FILE)
+            aggregate = _load(path) or {}
+            done = set(aggregate.pop("_merged", ()))
+            merged = self._merge({}, aggregate)
+            now = []
+            for entry in dead:
+                if entry.name not in done:
+                    other = _load(entry.path)
+                    if other is None:
+                        continue  # otro proceso la compactó entre medio
+                    self._merge(merged, other)
+                now.append(entry.name)
+            out = {name: [[list(k), v] for k, v in series.items()] for name, series in merged.items()}
+            out["_merged"] = now
+            _dump(path, out)
+            for name in now:
+                try:
+                    os.remove(os.path.join(d, name))
+                except FileNotFoundError:
+                    pass
+
+    def _merge(self, into, other):
+        for name, series in other.items():
+            m = self.metrics.get(name)
+            if m is None:
+                continue  # "_merged" o una métrica que ya no existe
+            target = into.setdefault(name, {})
+            for k, v in series:
+                k = tuple(k)
+                target[k] = m._merge(target[k], v) if k in target else v
+        return into
+
+    def collect(self):
+        """Foto propia en vivo + las de los demás procesos, sumadas."""
+        merged = {name: {tuple(k): v for k, v in series} for name, series in self.snapshot().items()}
+        d = self.directory()
+        if not d or not os.path.isdir(d):
+            return merged
+        aggregate = _load(os.path.join(d, AGGREGATE_FILE)) or {}
+        skip = set(aggregate.get("_merged", ())) | {AGGREGATE_FILE}
+        self._merge(merged, aggregate)
+        for entry in os.scandir(d):
+            if not entry.name.endswith(".json") or entry.name in skip or entry.path == self._file:
+                continue
+            other = _load(entry.path)
+            if other is not None:  # None: a medio escribir o compactada entre medio
+                self._merge(merged, other)
+        return merged
+
+    def exposition(self):
+        merged = self.collect()
+        lines = []
+        for name, m in self.metrics.items():
+            lines.append(f"# HELP {name} {m.help}")
+            lines.append(f"# TYPE {name} {m.kind}")
+            for labels, values in sorted(merged.get(name, {}).items()):
+                lines.extend(m._lines(labels, values))
+        return "\n".join(lines) + "\n"
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _dump(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _dead_snapshot(name):
+    # ¿Es la foto de un proceso que ya terminó?
+    match = SNAPSHOT_NAME.match(name)
+    if match is None:
+        return False
+    pid = int(match.group(1))
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False  # existe, de otro usuario
+    return False
+
+
+registry = Registry()
+if hasattr(os, "register_at_fork"):  # no existe en Windows
+    os.register_at_fork(after_in_child=registry._after_fork)
+atexit.register(registry.write)
+
+
+def counter(name, help, labelnames=()):
+    return registry.register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    return registry.register(Histogram(name, help, labelnames, buckets))
+
+
+# --- métricas de la app -------------------------------------------------------
+
+API_SECONDS = histogram("orders_api_request_seconds", "Duración de las acciones de ServiceOrderViewSet", ["action"])
+API_RESPONSES = counter("orders_api_responses", "Respuestas de ServiceOrderViewSet por acción y status", ["action", "status"])
+PDF_SECONDS = histogram("orders_pdf_render_seconds", "Render ReportLab por tipo de documento", ["kind"])
+QR_SECONDS = histogram("orders_qr_encode_seconds", "Codificación QR (sólo las que no estaban en la caché)")
+JWT_SECONDS = histogram("orders_jwt_sign_seconds", "Firma de JWT de orden/auditoría", ["kind"])
+SHA256_SECONDS = histogram("orders_sha256_file_seconds", "SHA-256 de archivos de evidencia")
+DB_WRITE_SECONDS = histogram("orders_db_write_seconds", "Sentencias de escritura, incluida la espera del lock de SQLite", ["op"])
+DB_LOCKED = counter("orders_db_locked", "Escrituras que fallaron con 'database is locked'")
+
+_WRITE_OPS = {"INSERT": "insert", "UPDATE": "update", "DELETE": "delete", "BEGIN": "begin", "BEGIN ": "begin"}
+
+
+def _time_writes(execute, sql, params, many, context):
+    op = _WRITE_OPS.get(sql[:6].upper())
+    if op is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError as e:
+        if "locked" in str(e):
+            DB_LOCKED.inc()
+        raise
+    finally:
+        DB_WRITE_SECONDS.observe(time.perf_counter() - start, op)
+
+
+def _instrument_connection(sender, connection, **kwargs):
+    if _time_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_writes)
+
+
+def install():
+    # Desde OrdersConfig.ready(): escrituras de cada conexión nueva. El hilo
+    # de volcado lo arrancan sólo los servidores (start_exporter)
+    if not _setting("ORDER_METRICS_ENABLED", True):
+        return
+    connection_created.connect(_instrument_connection, dispatch_uid="orders.metrics")
+
+
+def start_exporter():
+    # Desde backend/wsgi.py y backend/asgi.py
+    registry.start()
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_serviceorder_ot_token_serviceorder_ot_token_jti_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceorder',
+            name='artifacts_ready',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_serviceorder_artifacts_ready'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='audits', to='orders.serviceorder'),
+        ),
+        migrations.AlterField(
+            model_name='serviceorder',
+            name='technician',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='service_orders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['order', '-created_at'], name='audit_order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'in_use'])), fields=['status', 'expires_at'], name='order_open_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['technician', '-id'], name='order_tech_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['technician_name'], name='order_tech_name_idx'),
+        ),
+    ]
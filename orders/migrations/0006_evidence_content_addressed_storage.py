@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:55
+
+import orders.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='evidence',
+            name='file',
+            field=models.FileField(storage=orders.storage.evidence_storage, upload_to='evidences/'),
+        ),
+        migrations.AddIndex(
+            model_name='evidence',
+            index=models.Index(fields=['file'], name='evidence_file_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:56
+
+import orders.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_evidence_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidence',
+            name='print_file',
+            field=models.FileField(blank=True, storage=orders.storage.evidence_storage, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='evidence',
+            name='thumbnail',
+            field=models.FileField(blank=True, storage=orders.storage.evidence_storage, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:13
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    # Carga inicial de los contadores desde las tablas existentes
+    ServiceOrder = apps.get_model("orders", "ServiceOrder")
+    Evidence = apps.get_model("orders", "Evidence")
+    OrderCounter = apps.get_model("orders", "OrderCounter")
+    orders = ServiceOrder.objects.order_by()
+    rows = [
+        OrderCounter(scope="orders", key="", value=orders.count()),
+        OrderCounter(scope="evidences", key="", value=Evidence.objects.count()),
+    ]
+    for row in orders.values("status").annotate(total=Count("id")):
+        rows.append(OrderCounter(scope="status", key=row["status"], value=row["total"]))
+    for row in orders.values("technician_name").annotate(total=Count("id")):
+        rows.append(OrderCounter(scope="technician", key=row["technician_name"], value=row["total"]))
+    OrderCounter.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_evidence_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=16)),
+                ('key', models.CharField(blank=True, max_length=150)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='order_counter_scope_key_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hora'), ('day', 'Día')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('technician_name', models.CharField(blank=True, max_length=150)),
+                ('created', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('expired', models.PositiveIntegerField(default=0)),
+                ('ttc_p50', models.FloatField(blank=True, null=True)),
+                ('ttc_p90', models.FloatField(blank=True, null=True)),
+                ('ttc_p99', models.FloatField(blank=True, null=True)),
+                ('ttc_hist', models.JSONField(blank=True, default=dict)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['closed_at'], name='order_closed_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['expires_at'], name='order_expires_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'technician_name'), name='order_rollup_uniq'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:37
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='auditlog',
+            constraint=models.UniqueConstraint(fields=('audit_jti',), name='audit_jti_uniq'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:40
+
+import django.db.models.deletion
+import hashlib
+from django.db import migrations, models
+
+
+def fill_ot_token_hash(apps, schema_editor):
+    # Filas previas: el hash de la copia del JWT que ya guardaban
+    AuditLog = apps.get_model("orders", "AuditLog")
+    rows = list(AuditLog.objects.exclude(ot_token_copy="").only("id", "ot_token_copy"))
+    for row in rows:
+        row.ot_token_hash = hashlib.sha256(row.ot_token_copy.encode()).hexdigest()
+    AuditLog.objects.bulk_update(rows, ["ot_token_hash"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_audit_spool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='leaf_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='ot_token_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='proof',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='audit_jwt',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='ot_token_copy',
+            field=models.TextField(blank=True),
+        ),
+        migrations.CreateModel(
+            name='AuditBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('root', models.CharField(max_length=64)),
+                ('chain', models.CharField(max_length=64)),
+                ('size', models.PositiveIntegerField()),
+                ('root_jwt', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('prev', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='next', to='orders.auditbatch')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='orders.auditbatch'),
+        ),
+        migrations.RunPython(fill_ot_token_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_blobs(apps, schema_editor):
+    # Una referencia por cada evidencia que ya usa el blob
+    Evidence = apps.get_model("orders", "Evidence")
+    EvidenceBlob = apps.get_model("orders", "EvidenceBlob")
+    rows = Evidence.objects.exclude(file="").values("file").annotate(total=Count("id")).order_by()
+    EvidenceBlob.objects.bulk_create(
+        [EvidenceBlob(name=row["file"], refs=row["total"]) for row in rows], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_audit_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvidenceBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refs', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_blobs, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,16 @@
 import uuid
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.db.models.expressions import RawSQL
 from django.conf import settings
+from django.utils import timezone
 import hashlib
 
+from . import metrics
+from .storage import evidence_storage, release_blob
+
+@metrics.timed(metrics.SHA256_SECONDS)
 def sha256_file(django_file_field):
     # Devuelve el SHA256 (hex) de un FileField ya guardado en disco.
     h = hashlib.sha256()
@@ -10,6 +18,25 @@ def sha256_file(django_file_field):
         h.update(chunk)
     return h.hexdigest()
 
+# Estados en los que una orden todavía puede expirar
+OPEN_STATUSES = ("pending", "in_use")
+
+
+class ServiceOrderQuerySet(models.QuerySet):
+    def open(self):
+        # La condición va literal (sin parámetros) a propósito: SQLite sólo usa
+        # el índice parcial order_open_expiry_idx si el WHERE repite su condición.
+        literal = ", ".join(f"'{st}'" for st in OPEN_STATUSES)
+        return self.filter(RawSQL(
+            f'"{self.model._meta.db_table}"."status" IN ({literal})', [],
+            output_field=models.BooleanField(),
+        ))
+
+    def expirable(self, now):
+        # Órdenes abiertas cuyo expires_at ya pasó (lo que marca expire_orders)
+        return self.open().filter(expires_at__lt=now)
+
+
 class ServiceOrder(models.Model):
     class Status(models.TextChoices):
         PENDING = "pending", "Pendiente"
@@ -19,8 +46,11 @@ class ServiceOrder(models.Model):
         EXPIRED = "expired", "Expirada"
         USED = "used", "Usada"
 
+    objects = ServiceOrderQuerySet.as_manager()
+
     uuid_order = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
-    technician = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="service_orders")
+    # db_index=False: lo cubre el índice compuesto (technician, -id) de Meta
+    technician = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="service_orders", db_index=False)
     technician_name = models.CharField(max_length=150)
     jwt_token = models.TextField()
     jwt_hash = models.CharField(max_length=64)
@@ -33,6 +63,24 @@ class ServiceOrder(models.Model):
     closed_at = models.DateTimeField(null=True, blank=True)
     ot_token = models.TextField(blank=True)           # JWT de la OT (generado al crear)
     ot_token_jti = models.CharField(max_length=64, blank=True)  # ID único del token
+    artifacts_ready = models.BooleanField(default=False)  # PDF/QR ya pre-generados en caché
+
+    class Meta:
+        indexes = [
+            # expire_orders: status IN (pending, in_use) AND expires_at < now
+            models.Index(
+                fields=["status", "expires_at"], name="order_open_expiry_idx",
+                condition=models.Q(status__in=list(OPEN_STATUSES)),
+            ),
+            # list del técnico: WHERE technician = ? ORDER BY id DESC
+            models.Index(fields=["technician", "-id"], name="order_tech_id_idx"),
+            # stats: GROUP BY technician_name
+            models.Index(fields=["technician_name"], name="order_tech_name_idx"),
+            # rollups (orders/rollups.py): rangos por creación, cierre y vencimiento
+            models.Index(fields=["created_at"], name="order_created_at_idx"),
+            models.Index(fields=["closed_at"], name="order_closed_at_idx"),
+            models.Index(fields=["expires_at"], name="order_expires_at_idx"),
+        ]
     
 
 
@@ -47,22 +95,156 @@ class Evidence(models.Model):
 
     order = models.ForeignKey("ServiceOrder", on_delete=models.CASCADE, related_name="evidences")
     kind = models.CharField(max_length=32, choices=Type.choices)
-    file = models.FileField(upload_to="evidences/")
+    # direccionado por contenido: evidences/ab/cd/<sha256>.ext, sin duplicados
+    file = models.FileField(upload_to="evidences/", storage=evidence_storage)
     file_hash = models.CharField(max_length=64, blank=True)
+    # derivados de imágenes (orders/derivatives.py): sin EXIF y reducidos
+    print_file = models.FileField(storage=evidence_storage, blank=True)
+    thumbnail = models.FileField(storage=evidence_storage, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # conteo de referencias al borrar (mismo blob, varias evidencias)
+            models.Index(fields=["file"], name="evidence_file_idx"),
+        ]
+
     def compute_and_set_hash(self):
         self.file_hash = sha256_file(self.file)
         self.save(update_fields=["file_hash"])
 
+
+@receiver(post_delete, sender=Evidence)
+def release_evidence_file(sender, instance, **kwargs):
+    # El blob (y sus derivados, que se comparten igual) se borra cuando su
+    # conteo de referencias llega a cero; ver orders/storage.py
+    name = instance.file.name
+    if not name:
+        return
+    release_blob(name, [f.name for f in (instance.print_file, instance.thumbnail) if f.name])
+
+
+class EvidenceBlob(models.Model):
+    """
+    Referencias a cada blob del storage de evidencias: una por cada vez que
+    se guardó (aunque el contenido ya estuviera) menos las evidencias
+    borradas y las subidas descartadas. Se actualiza en la misma transacción
+    que la evidencia; el archivo se borra recién con cero.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refs = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.refs})"
+
+
+@receiver(post_delete, sender=Evidence)
+def discount_evidence(sender, instance, **kwargs):
+    from . import counters
+    counters.evidences_added(-1)
+
+
+@receiver(post_delete, sender=ServiceOrder)
+def discount_order(sender, instance, **kwargs):
+    # Borrados desde el admin: corre dentro de la transacción del delete
+    from . import counters
+    counters.order_created(instance, -1)
+
+class OrderCounter(models.Model):
+    """
+    Contadores mantenidos por orders/counters.py en la misma transacción que
+    cada cambio de estado; stats los lee en vez de recorrer las tablas.
+    scope: "orders" (total), "status", "technician" o "evidences".
+    """
+    scope = models.CharField(max_length=16)
+    key = models.CharField(max_length=150, blank=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "key"], name="order_counter_scope_key_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} = {self.value}"
+
+class OrderRollup(models.Model):
+    """
+    Agregados por hora o por día (hora local) que llena la tarea
+    rollup_orders. Una fila por técnico y una con technician_name="" para
+    todos. El tiempo de cierre (closed_at - created_at, en segundos) se
+    guarda como percentiles exactos del tramo y como histograma logarítmico
+    para poder combinar tramos en consultas por rango.
+    """
+    class Period(models.TextChoices):
+        HOUR = "hour", "Hora"
+        DAY = "day", "Día"
+
+    period = models.CharField(max_length=4, choices=Period.choices)
+    bucket = models.DateTimeField()  # inicio del tramo
+    technician_name = models.CharField(max_length=150, blank=True)
+    created = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    expired = models.PositiveIntegerField(default=0)
+    ttc_p50 = models.FloatField(null=True, blank=True)
+    ttc_p90 = models.FloatField(null=True, blank=True)
+    ttc_p99 = models.FloatField(null=True, blank=True)
+    ttc_hist = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            # también es el índice de las consultas por rango (period, bucket)
+            models.UniqueConstraint(fields=["period", "bucket", "technician_name"], name="order_rollup_uniq"),
+        ]
+
+class AuditBatch(models.Model):
+    """
+    Lote de auditoría firmado una sola vez (ORDER_AUDIT_SIGNING = "merkle"):
+    raíz de Merkle de las hojas de sus filas, encadenada con el lote
+    anterior (chain = sha256(chain anterior + raíz)) y firmada en root_jwt.
+    """
+    prev = models.OneToOneField("self", null=True, blank=True, on_delete=models.PROTECT, related_name="next")
+    root = models.CharField(max_length=64)
+    chain = models.CharField(max_length=64)
+    size = models.PositiveIntegerField()
+    root_jwt = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Lote {self.id} ({self.size} eventos) {self.root[:12]}"
+
 class AuditLog(models.Model):
-    order = models.ForeignKey(ServiceOrder, on_delete=models.CASCADE, related_name="audits")
-    admin = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT)
+    order = models.ForeignKey(ServiceOrder, on_delete=models.CASCADE, related_name="audits", db_index=False)
+    # db_index=False: lo cubre el índice compuesto (admin, -created_at) de Meta
+    admin = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, db_index=False)
     action = models.CharField(max_length=50)
-    ot_token_copy = models.TextField()
+    # copia completa del JWT de la OT sólo en modo "jwt"; siempre su sha256
+    ot_token_copy = models.TextField(blank=True)
+    ot_token_hash = models.CharField(max_length=64, blank=True)
     ot_jti = models.CharField(max_length=64)
-    audit_jwt = models.TextField()
+    # firma por fila (modo "jwt"); en modo "merkle" queda vacío y firma el lote
+    audit_jwt = models.TextField(blank=True)
+    # único: el flush del spool (orders/audit.py) puede repetir un segmento
     audit_jti = models.CharField(max_length=64)
     old_values = models.JSONField(null=True, blank=True)
     new_values = models.JSONField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    # momento del evento (no del INSERT, que con el spool llega después)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # modo "merkle": hoja, prueba de inclusión ([lado, hash] hasta la raíz) y lote
+    batch = models.ForeignKey(AuditBatch, null=True, blank=True, on_delete=models.PROTECT, related_name="entries")
+    leaf_hash = models.CharField(max_length=64, blank=True)
+    proof = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # historial de una orden: WHERE order = ? ORDER BY created_at DESC
+            models.Index(fields=["order", "-created_at"], name="audit_order_created_idx"),
+            # audit_feed: sin filtro, por acción o por actor, siempre ORDER BY created_at DESC
+            models.Index(fields=["-created_at"], name="audit_created_idx"),
+            models.Index(fields=["action", "-created_at"], name="audit_action_created_idx"),
+            models.Index(fields=["admin", "-created_at"], name="audit_admin_created_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["audit_jti"], name="audit_jti_uniq"),
+        ]
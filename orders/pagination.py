@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Paginación por cursor (keyset) sobre -id: cada página es un
+    WHERE id < cursor ORDER BY id DESC LIMIT n, sin OFFSET, así que cuesta
+    lo mismo en la página 1 que en la 10.000. El cursor es opaco (base64).
+    """
+    ordering = "-id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class AuditCursorPagination(CursorPagination):
+    """
+    Historial de auditoría, del más nuevo al más viejo. Cada página es un
+    WHERE created_at < cursor ... LIMIT n sobre los índices (order, -created_at)
+    o (action|admin, -created_at) según el filtro.
+    """
+    ordering = "-created_at"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
@@ -0,0 +1,209 @@
+import io, math, functools, qrcode
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+
+from .credentials import compact_for, qr_format
+from .metrics import PDF_SECONDS, QR_SECONDS, timed
+
+# Subir este número cada vez que cambie el diseño del PDF de la orden:
+# invalida automáticamente todo lo que haya en la caché de PDFs.
+PDF_TEMPLATE_VERSION = 2
+
+
+def frontend_url():
+    return getattr(settings, "FRONTEND_URL", "http://localhost:5173/open")
+
+
+def qr_value_for(order, url_base=None, fmt=None):
+    # Contenido del QR: link al frontend + JWT de la orden (o la credencial
+    # compacta de orders/credentials.py con ORDER_QR_FORMAT="compact")
+    url_base = url_base or frontend_url()
+    if (fmt or qr_format()) == "compact":
+        return f"{url_base}?id={order.id}#c={compact_for(order)}"
+    return f"{url_base}?id={order.id}#jwt={order.jwt_token}"
+
+
+@functools.lru_cache(maxsize=512)
+@timed(QR_SECONDS)
+def qr_matrix(value):
+    # Matriz de módulos (con zona de silencio incluida), sin generar imagen.
+    # La elección de máscara es lo caro: se memoriza por contenido.
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(value)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def draw_qr(c, value, x, y, size):
+    """
+    Dibuja el QR como vectores: un rectángulo por cada tramo horizontal de
+    módulos negros. Nada de PNG intermedio ni ImageReader.
+    """
+    matrix = qr_matrix(value)
+    n = len(matrix)
+    mod = size / n
+    path = c.beginPath()
+    for r, row in enumerate(matrix):
+        top = y + size - (r + 1) * mod
+        col = 0
+        while col < n:
+            if not row[col]:
+                col += 1
+                continue
+            start = col
+            while col < n and row[col]:
+                col += 1
+            path.rect(x + start * mod, top, (col - start) * mod, mod)
+    c.saveState()
+    c.setFillColorRGB(0, 0, 0)
+    c.drawPath(path, stroke=0, fill=1)
+    c.restoreState()
+
+
+@timed(PDF_SECONDS, "order")
+def render_order_pdf(order, url_base=None, qr_value=None):
+    """
+    Genera el PDF (bytes) con datos de la orden y el QR (link + JWT).
+    Sólo depende de campos inmutables de la orden y de su jwt_token.
+    Pasando qr_value no se tocan los settings (útil en procesos hijos).
+    """
+    pdf_buffer = io.BytesIO()
+    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+    w, h = A4
+
+    # Título
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, h - 60, "Solicitud de Servicio")
+
+    # Datos de la orden
+    c.setFont("Helvetica", 11)
+    c.drawString(50, h - 90, f"Orden UUID: {order.uuid_order}")
+    c.drawString(50, h - 110, f"Técnico asignado: {order.technician_name}")
+    c.drawString(50, h - 130, f"Creada: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
+    if order.expires_at:
+        c.drawString(50, h - 150, f"Expira: {order.expires_at.strftime('%Y-%m-%d %H:%M')}")
+
+    # QR en la esquina derecha
+    qr_size = 160
+    draw_qr(c, qr_value or qr_value_for(order, url_base), w - qr_size - 50, h - qr_size - 60, qr_size)
+
+    # Nota al pie
+    c.setFont("Helvetica-Oblique", 10)
+    c.drawString(50, 50, "Escanee el QR para abrir la página y copiar el JWT.")
+
+    # Cerrar PDF
+    c.showPage()
+    c.save()
+    return pdf_buffer.getvalue()
+
+
+def label_grid(per_page, page_size=A4):
+    # Columnas/filas para repartir per_page etiquetas respetando la proporción de la hoja
+    w, h = page_size
+    cols = max(1, math.ceil(math.sqrt(per_page * w / h)))
+    rows = max(1, math.ceil(per_page / cols))
+    return cols, rows
+
+
+@timed(PDF_SECONDS, "labels")
+def render_label_sheet(orders, out, per_page=12, url_base=None):
+    """
+    Escribe en `out` un PDF con N etiquetas QR por hoja A4 (impresión masiva).
+    `orders` puede ser un iterador: se consume de a una orden.
+    """
+    url_base = url_base or frontend_url()
+    c = canvas.Canvas(out, pagesize=A4)
+    w, h = A4
+    margin = 20
+    cols, rows = label_grid(per_page)
+    cell_w = (w - 2 * margin) / cols
+    cell_h = (h - 2 * margin) / rows
+    text_h = 22
+    qr_size = min(cell_w, cell_h - text_h) - 6
+
+    slot = 0
+    for order in orders:
+        if slot == cols * rows:
+            c.showPage()
+            slot = 0
+        col, row = slot % cols, slot // cols
+        x0 = margin + col * cell_w
+        y0 = h - margin - (row + 1) * cell_h
+
+        draw_qr(c, qr_value_for(order, url_base),
+                x0 + (cell_w - qr_size) / 2, y0 + text_h, qr_size)
+        c.setFont("Helvetica-Bold", 8)
+        c.drawCentredString(x0 + cell_w / 2, y0 + 12, f"OT #{order.id} - {order.technician_name}"[:48])
+        c.setFont("Helvetica", 6)
+        c.drawCentredString(x0 + cell_w / 2, y0 + 4, str(order.uuid_order))
+        slot += 1
+
+    c.showPage()
+    c.save()
+    return out
+
+
+def draw_report_cover(c, order, w, h):
+    # Página 1 del reporte completo: info + QR
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, h - 60, "Orden de Servicio - Detalles")
+
+    c.setFont("Helvetica", 11)
+    c.drawString(50, h - 90, f"UUID: {order.uuid_order}")
+    c.drawString(50, h - 110, f"Técnico: {order.technician_name}")
+    c.drawString(50, h - 130, f"Creada: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
+    c.drawString(50, h - 150, f"Estado: {order.status}")
+    if order.expires_at:
+        c.drawString(50, h - 170, f"Expira: {order.expires_at.strftime('%Y-%m-%d %H:%M')}")
+
+    # QR
+    qr_size = 150
+    draw_qr(c, qr_value_for(order), w - qr_size - 50, h - qr_size - 70, qr_size)
+
+    c.setFont("Helvetica-Oblique", 10)
+    c.drawString(50, 50, "Escanee el QR para ver esta orden en línea.")
+
+
+def draw_evidence_page(c, ev, w, h, note=None):
+    # Encabezado de la evidencia + la imagen (o sólo `note` si no hay imagen)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, h - 60, f"Evidencia: {ev.kind}")
+    c.setFont("Helvetica", 10)
+    c.drawString(50, h - 80, f"Subido el: {ev.created_at.strftime('%Y-%m-%d %H:%M')}")
+    if note:
+        c.drawString(50, h - 100, note)
+        return
+    try:
+        # versión para impresión si ya existe; si no, el original
+        source = ev.print_file if getattr(ev, "print_file", None) else ev.file
+        img_reader = ImageReader(source.path)
+        c.drawImage(img_reader, 50, 150, width=500, height=h - 270,
+                    preserveAspectRatio=True, mask="auto")
+    except Exception as e:
+        c.drawString(50, h - 100, f"Error al cargar la imagen: {str(e)}")
+
+
+@timed(PDF_SECONDS, "full_report")
+def render_full_report(order, evidences, out):
+    """
+    PDF completo en un solo canvas (en memoria). Es el respaldo de
+    orders/report.py cuando pypdf no está instalado: los PDF adjuntos
+    no se pueden incluir.
+    """
+    c = canvas.Canvas(out, pagesize=A4)
+    w, h = A4
+    draw_report_cover(c, order, w, h)
+    c.showPage()
+
+    # Páginas siguientes: evidencias
+    for ev in evidences:
+        if ev.file.name.lower().endswith(".pdf"):
+            draw_evidence_page(c, ev, w, h, "(PDF adjunto no renderizado)")
+        else:
+            draw_evidence_page(c, ev, w, h)
+        c.showPage()
+
+    c.save()
+    return out
@@ -0,0 +1,265 @@
+import itertools, json, os, re, sys, threading, time, uuid
+from collections import Counter
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import FileResponse
+from django.utils import timezone
+
+# Perfilado por muestreo de peticiones lentas (opt-in, ORDER_PROFILE_ENABLED).
+# Un único hilo toma cada ORDER_PROFILE_INTERVAL segundos la pila de los
+# hilos que están atendiendo una petición (sys._current_frames) y la suma a
+# la petición. Al terminar, si tardó más de ORDER_PROFILE_THRESHOLD_MS (o
+# tocó el 1-en-N de ORDER_PROFILE_SAMPLE_RATE) se guardan en ORDER_PROFILE_DIR:
+#   <id>.folded  pilas colapsadas ("a;b;c 12"), para flamegraph.pl/speedscope
+#   <id>.json    petición, duración, status y tiempos de cada consulta SQL
+# Si no, se descarta. Se conservan los ORDER_PROFILE_MAX_FILES más nuevos.
+
+PROFILE_ID = re.compile(r"^[0-9A-Za-z_.-]+$")
+MAX_DEPTH = 128
+MAX_QUERIES = 1000
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def profile_dir():
+    return str(_setting("ORDER_PROFILE_DIR", settings.BASE_DIR / "profiles"))
+
+
+class Sampler:
+    # Un hilo para todo el proceso; duerme mientras no haya peticiones activas
+    def __init__(self):
+        self._active = {}  # ident del hilo -> Counter de pilas
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._labels = {}  # code -> "archivo:función"
+
+    def add(self, ident, stacks):
+        with self._lock:
+            self._active[ident] = stacks
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, ident):
+        with self._lock:
+            self._active.pop(ident, None)
+            if not self._active:
+                self._wake.clear()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def _collapse(self, frame):
+        parts = []
+        while frame is not None and len(parts) < MAX_DEPTH:
+            parts.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(_setting("ORDER_PROFILE_INTERVAL", 0.005))
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in active:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[self._collapse(frame)] += 1
+
+
+sampler = Sampler()
+
+
+class RequestProfile:
+    """
+    Pilas y consultas de una petición. `segment()` la activa en el hilo
+    actual; una respuesta en streaming abre otro segmento al consumirse.
+    """
+
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.get_full_path()
+        self.started_at = timezone.now()
+        self.start = time.perf_counter()
+        self.stacks = Counter()
+        self.queries = []  # (inicio relativo ms, duración ms, sql)
+        self.query_count = 0
+        self.sql_ms = 0.0
+
+    def _time_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self.query_count += 1
+            self.sql_ms += ms
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append((round((start - self.start) * 1000, 2), round(ms, 3), sql))
+
+    def segment(self):
+        return _Segment(self)
+
+    def finish(self, status, forced):
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        if not forced and elapsed_ms < _setting("ORDER_PROFILE_THRESHOLD_MS", 2000):
+            return None
+        return store(self, status, elapsed_ms)
+
+
+class _Segment:
+    def __init__(self, profile):
+        self.profile = profile
+        self._wrapper = connection.execute_wrapper(profile._time_query)
+
+    def __enter__(self):
+        self._ident = threading.get_ident()
+        self._wrapper.__enter__()
+        sampler.add(self._ident, self.profile.stacks)
+
+    def __exit__(self, *exc):
+        sampler.remove(self._ident)
+        self._wrapper.__exit__(*exc)
+
+
+def store(profile, status, elapsed_ms):
+    d = profile_dir()
+    os.makedirs(d, exist_ok=True)
+    slug = re.sub(r"[^0-9A-Za-z]+", "_", profile.path.split("?")[0]).strip("_")[:60]
+    t0 = profile.started_at
+    pid = f"{t0:%Y%m%dT%H%M%S}{t0.microsecond // 1000:03d}-{int(elapsed_ms)}ms-{slug}-{uuid.uuid4().hex[:6]}"
+
+    with open(os.path.join(d, pid + ".folded"), "w") as f:
+        for stack, n in profile.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+    meta = {
+        "id": pid,
+        "method": profile.method,
+        "path": profile.path,
+        "status": status,
+        "started_at": profile.started_at.isoformat(),
+        "duration_ms": round(elapsed_ms, 2),
+        "samples": sum(profile.stacks.values()),
+        "interval_ms": _setting("ORDER_PROFILE_INTERVAL", 0.005) * 1000,
+        "sql": {
+            "count": profile.query_count,
+            "total_ms": round(profile.sql_ms, 2),
+            "queries": [{"at_ms": at, "ms": ms, "sql": sql} for at, ms, sql in profile.queries],
+        },
+    }
+    # el .json va último: es el que marca el perfil como completo
+    tmp = os.path.join(d, pid + ".json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(d, pid + ".json"))
+    prune(d)
+    return pid
+
+
+def prune(d=None):
+    # Sólo quedan los ORDER_PROFILE_MAX_FILES perfiles más nuevos (el id empieza por la fecha)
+    d = d or profile_dir()
+    keep = _setting("ORDER_PROFILE_MAX_FILES", 200)
+    ids = sorted(n[:-5] for n in os.listdir(d) if n.endswith(".json"))
+    for old in ids[:max(0, len(ids) - keep)]:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(d, old + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    d = profile_dir()
+    if not os.path.isdir(d):
+        return []
+    out = []
+    for name in sorted(os.listdir(d), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(d, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue  # borrado por prune entre medio
+        meta["sql"] = {k: v for k, v in meta["sql"].items() if k != "queries"}
+        out.append(meta)
+    return out
+
+
+def profile_path(pid, ext):
+    # None si el id no es válido o el perfil ya no existe
+    if not PROFILE_ID.match(pid or ""):
+        return None
+    path = os.path.join(profile_dir(), pid + ext)
+    return path if os.path.isfile(path) else None
+
+
+class SlowRequestProfilerMiddleware:
+    """
+    Con ORDER_PROFILE_ENABLED muestrea todas las peticiones y guarda el
+    perfil de las que superan el umbral, más una de cada
+    ORDER_PROFILE_SAMPLE_RATE (0 = ninguna) aunque sean rápidas.
+
+    Apagado no agrega nada, tampoco un salto de hilo bajo ASGI. Encendido
+    bajo ASGI se perfila el hilo de la petición (thread_sensitive): ahí
+    corren el ORM async y los sync_to_async de la vista.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._counter = itertools.count(1)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not _setting("ORDER_PROFILE_ENABLED", False):
+            return self.get_response(request)
+        return self._profile(request, self.get_response)
+
+    async def __acall__(self, request):
+        if not _setting("ORDER_PROFILE_ENABLED", False):
+            return await self.get_response(request)
+        return await sync_to_async(self._profile)(request, async_to_sync(self.get_response))
+
+    def _profile(self, request, get_response):
+        rate = _setting("ORDER_PROFILE_SAMPLE_RATE", 0)
+        forced = bool(rate) and next(self._counter) % rate == 0
+        profile = RequestProfile(request)
+        with profile.segment():
+            response = get_response(request)
+
+        if response.streaming and not response.is_async and not isinstance(response, FileResponse):
+            # el trabajo de verdad (p.ej. download_full_pdf) ocurre al consumir el cuerpo
+            response.streaming_content = self._profiled(response.streaming_content, profile, response, forced)
+        else:
+            profile.finish(response.status_code, forced)
+        return response
+
+    def _profiled(self, content, profile, response, forced):
+        try:
+            it = iter(content)
+            while True:
+                with profile.segment():
+                    chunk = next(it, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            profile.finish(response.status_code, forced)
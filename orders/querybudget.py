@@ -0,0 +1,94 @@
+import logging
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Tope de consultas SQL por petición, declarado en cada viewset como
+# `query_budgets = {"acción": n}`. Cuenta todo lo que la petición ejecuta
+# mientras la vista corre (incluida la autenticación JWT). Lo que se lee
+# después, al consumir una respuesta en streaming, no entra.
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class QueryCounter:
+    # Para connection.execute_wrapper: cuenta sin necesitar DEBUG
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _mode():
+    return getattr(settings, "ORDER_QUERY_BUDGET_MODE", "off")
+
+
+def budget_for(view_func, method):
+    """
+    (acción, tope) de la vista resuelta, o (None, None) si no declara uno.
+    `view_func` es lo que devuelve ViewSet.as_view() (lleva .cls y .actions).
+    """
+    actions = getattr(view_func, "actions", None)
+    if not actions:
+        return None, None
+    name = actions.get(method.lower())
+    budgets = getattr(view_func.cls, "query_budgets", {})
+    return name, budgets.get(name)
+
+
+class QueryBudgetMiddleware:
+    """
+    ORDER_QUERY_BUDGET_MODE: "off" no mide nada; "log" agrega X-Query-Count
+    y avisa en el log si una acción se pasa de su tope; "raise" además
+    lanza QueryBudgetExceeded (para tests y CI).
+
+    Sirve en WSGI y en ASGI sin adaptar la cadena: apagado, la petición
+    async no pasa por ningún hilo. Encendido bajo ASGI se mide desde el hilo
+    de la petición (thread_sensitive), donde corre el ORM async.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if _mode() == "off":
+            return self.get_response(request)
+        return self._measure(request, self.get_response)
+
+    async def __acall__(self, request):
+        if _mode() == "off":
+            return await self.get_response(request)
+        return await sync_to_async(self._measure)(request, async_to_sync(self.get_response))
+
+    def _measure(self, request, get_response):
+        mode = _mode()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = get_response(request)
+        response["X-Query-Count"] = str(counter.count)
+
+        name, budget = getattr(request, "_query_budget", (None, None))
+        if budget is not None:
+            response["X-Query-Budget"] = str(budget)
+            if counter.count > budget:
+                msg = (f"{request.method} {request.path} ({name}): "
+                       f"{counter.count} consultas, tope {budget}")
+                if mode == "raise":
+                    raise QueryBudgetExceeded(msg)
+                logger.warning("Presupuesto de consultas excedido: %s", msg)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = budget_for(view_func, request.method)
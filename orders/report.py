@@ -0,0 +1,213 @@
+import io
+from collections import deque
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from .metrics import PDF_SECONDS, timed
+from .pdf import draw_evidence_page, draw_report_cover
+
+try:
+    from pypdf import PdfReader
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject
+except ImportError:  # sin pypdf se usa render_full_report (todo en memoria)
+    PdfReader = None
+
+# Números de objeto fijos del documento de salida
+CATALOG_ID = 1
+PAGES_ID = 2
+
+
+class StreamingPdfWriter:
+    """
+    Escribe un PDF objeto por objeto y entrega los bytes a medida que salen.
+
+    Cada parte (una página de ReportLab o un PDF subido) se lee con pypdf,
+    sus objetos se renumeran y se escriben de inmediato; al final sólo quedan
+    en memoria los offsets del xref y la lista de páginas. Así la memoria
+    depende de la evidencia más grande, no de cuántas haya.
+    """
+
+    def __init__(self):
+        self._buf = io.BytesIO()
+        self._offset = 0
+        self._offsets = {}
+        self._next_id = PAGES_ID + 1
+        self._kids = []
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self._buf.write(data)
+        self._offset += len(data)
+
+    def drain(self):
+        data = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+    def _alloc(self):
+        n = self._next_id
+        self._next_id += 1
+        return n
+
+    def add_pdf(self, stream):
+        """Copia todas las páginas del PDF `stream` (sin rasterizar)."""
+        return self.add_pages(open_pdf(stream))
+
+    def add_pages(self, pages):
+        """
+        Copia `pages` a la salida. Si un objeto no se puede leer a mitad de
+        camino (PDF dañado o cifrado) deshace lo escrito y relanza: el
+        documento queda como antes de la llamada.
+        """
+        state = self.mark()
+        try:
+            return self._add_pages(pages)
+        except Exception:
+            self.rollback(state)
+            raise
+
+    def mark(self):
+        # Estado actual, para volver a él con rollback() (sin drain() entre medio)
+        return self._buf.tell(), self._offset, dict(self._offsets), self._next_id, len(self._kids)
+
+    def rollback(self, state):
+        pos, self._offset, self._offsets, self._next_id, kids = state
+        self._buf.seek(pos)
+        self._buf.truncate()
+        del self._kids[kids:]
+
+    def _add_pages(self, pages):
+        mapping = {}
+        queue = deque()
+        pages_ref = IndirectObject(PAGES_ID, 0, None)
+
+        def ref(ind):
+            key = (ind.idnum, ind.generation)
+            if key not in mapping:
+                target = ind.get_object()
+                if isinstance(target, DictionaryObject) and target.get("/Type") in ("/Pages", "/Catalog"):
+                    # nunca arrastrar el árbol de páginas del documento original
+                    return pages_ref if target.get("/Type") == "/Pages" else NullObject()
+                mapping[key] = self._alloc()
+                queue.append((mapping[key], target))
+            return IndirectObject(mapping[key], 0, None)
+
+        def fix(obj):
+            if isinstance(obj, IndirectObject):
+                return ref(obj)
+            if isinstance(obj, DictionaryObject):
+                for k, v in list(dict.items(obj)):
+                    dict.__setitem__(obj, k, fix(v))
+            elif isinstance(obj, ArrayObject):
+                for i, v in enumerate(list.__iter__(obj)):
+                    list.__setitem__(obj, i, fix(v))
+            return obj
+
+        # las páginas se numeran antes, para que los enlaces entre ellas no se dupliquen
+        page_ids = []
+        for page in pages:
+            num = self._alloc()
+            if page.indirect_reference is not None:
+                ir = page.indirect_reference
+                mapping[(ir.idnum, ir.generation)] = num
+            page_ids.append(num)
+
+        for num, page in zip(page_ids, pages):
+            if "/Parent" in page:
+                del page["/Parent"]
+            fix(page)
+            dict.__setitem__(page, NameObject("/Parent"), pages_ref)
+            self._emit(num, page)
+            self._kids.append(num)
+            while queue:
+                obj_num, obj = queue.popleft()
+                self._emit(obj_num, fix(obj))
+        return len(pages)
+
+    def _emit(self, num, obj):
+        self._offsets[num] = self._offset
+        self._write(f"{num} 0 obj\n".encode())
+        tmp = io.BytesIO()
+        obj.write_to_stream(tmp)
+        self._write(tmp.getvalue())
+        self._write(b"\nendobj\n")
+
+    def close(self):
+        kids = " ".join(f"{k} 0 R" for k in self._kids)
+        self._offsets[PAGES_ID] = self._offset
+        self._write(f"{PAGES_ID} 0 obj\n<< /Type /Pages /Kids [ {kids} ] /Count {len(self._kids)} >>\nendobj\n".encode())
+        self._offsets[CATALOG_ID] = self._offset
+        self._write(f"{CATALOG_ID} 0 obj\n<< /Type /Catalog /Pages {PAGES_ID} 0 R >>\nendobj\n".encode())
+
+        size = self._next_id
+        xref_at = self._offset
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for num in range(1, size):
+            off = self._offsets.get(num)
+            lines.append(f"{off:010d} 00000 n \n" if off is not None else "0000000000 65535 f \n")
+        self._write("".join(lines).encode())
+        self._write(f"trailer\n<< /Size {size} /Root {CATALOG_ID} 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode())
+
+
+def open_pdf(stream):
+    # Lee y valida el PDF antes de escribir nada de él en la salida
+    reader = PdfReader(stream)
+    if reader.is_encrypted and not reader.decrypt(""):
+        raise ValueError("el PDF está protegido con contraseña")
+    return list(reader.pages)
+
+
+@timed(PDF_SECONDS, "report_page")
+def _single_page(draw, *args):
+    # Una página de ReportLab como PDF independiente
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    draw(c, *args, *A4)
+    c.showPage()
+    c.save()
+    buf.seek(0)
+    return buf
+
+
+def _evidence_page(ev, note=None):
+    return _single_page(lambda c, w, h: draw_evidence_page(c, ev, w, h, note))
+
+
+def _add_evidence_pdf(writer, ev):
+    # Portada de la evidencia y sus páginas; si algo falla no queda nada escrito
+    with ev.file.open("rb") as f:
+        pages = open_pdf(f)
+        note = f"Documento PDF adjunto: {len(pages)} página(s) a continuación."
+        state = writer.mark()
+        writer.add_pdf(_evidence_page(ev, note))
+        try:
+            writer.add_pages(pages)
+        except Exception:
+            writer.rollback(state)
+            raise
+
+
+def stream_full_report(order, evidences):
+    """
+    Generador con los bytes del reporte completo, página a página.
+    Las evidencias PDF se insertan tal cual (sus páginas, sin rasterizar).
+    Cuando esto corre la respuesta ya salió con 200: un PDF que no se puede
+    abrir o copiar se reemplaza por su página con el error, nunca se corta.
+    """
+    writer = StreamingPdfWriter()
+    writer.add_pdf(_single_page(draw_report_cover, order))
+    yield writer.drain()
+
+    for ev in evidences:
+        if ev.file.name.lower().endswith(".pdf"):
+            try:
+                _add_evidence_pdf(writer, ev)
+            except Exception as e:
+                writer.add_pdf(_evidence_page(ev, f"Error al incluir el PDF: {str(e)}"))
+        else:
+            writer.add_pdf(_evidence_page(ev))
+        yield writer.drain()
+
+    writer.close()
+    yield writer.drain()
@@ -0,0 +1,207 @@
+import datetime, logging, math, time
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import OrderRollup, ServiceOrder
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {
+    OrderRollup.Period.HOUR: datetime.timedelta(hours=1),
+    OrderRollup.Period.DAY: datetime.timedelta(days=1),
+}
+ALL = ""  # technician_name de la fila con el total de todos los técnicos
+COUNTS = ("created", "completed", "failed", "expired")
+
+# Histograma logarítmico del tiempo de cierre: cada casilla cubre un 10 % más
+# que la anterior, así el percentil combinado tiene ~5 % de error relativo.
+HIST_RATIO = 1.1
+DEFAULT_RETENTION_DAYS = {OrderRollup.Period.HOUR: 14, OrderRollup.Period.DAY: 730}
+
+
+class WindowTooLarge(ValueError):
+    pass
+
+
+def bucket_start(dt, period):
+    # Inicio del tramo en hora local (los días del Dashboard son días locales)
+    local = timezone.localtime(dt)
+    if period == OrderRollup.Period.DAY:
+        return local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return local.replace(minute=0, second=0, microsecond=0)
+
+
+def iter_buckets(start, end, period):
+    bucket = bucket_start(start, period)
+    while bucket < end:
+        yield bucket
+        bucket = bucket_start(bucket + PERIODS[period], period)
+
+
+def hist_index(seconds):
+    return int(math.log(max(seconds, 1.0), HIST_RATIO))
+
+
+def percentile(sorted_values, p):
+    # nearest-rank
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return round(sorted_values[rank - 1], 1)
+
+
+def hist_percentile(hist, p):
+    """Percentil aproximado de un histograma {índice: cantidad} (centro de la casilla)."""
+    total = sum(hist.values())
+    if not total:
+        return None
+    rank = max(1, math.ceil(p / 100 * total))
+    seen = 0
+    for idx in sorted(hist, key=int):
+        seen += hist[idx]
+        if seen >= rank:
+            return round(HIST_RATIO ** (int(idx) + 0.5), 1)
+
+
+def compute_bucket(period, bucket):
+    """Filas de OrderRollup (sin guardar) para el tramo que empieza en `bucket`."""
+    end = bucket + PERIODS[period]
+    orders = ServiceOrder.objects.order_by()
+    rows = defaultdict(Counter)
+
+    created = orders.filter(created_at__gte=bucket, created_at__lt=end)
+    for name, n in created.values_list("technician_name").annotate(n=Count("id")):
+        rows[name]["created"] += n
+
+    expired = orders.filter(status=ServiceOrder.Status.EXPIRED, expires_at__gte=bucket, expires_at__lt=end)
+    for name, n in expired.values_list("technician_name").annotate(n=Count("id")):
+        rows[name]["expired"] += n
+
+    # cierres: cuentan en el tramo de closed_at
+    durations = defaultdict(list)
+    closed = orders.filter(
+        closed_at__gte=bucket, closed_at__lt=end,
+        status__in=[ServiceOrder.Status.COMPLETED, ServiceOrder.Status.FAILED],
+    ).values_list("technician_name", "status", "created_at", "closed_at")
+    for name, st, created_at, closed_at in closed:
+        rows[name][st] += 1
+        durations[name].append((closed_at - created_at).total_seconds())
+
+    result = []
+    for name in list(rows):
+        rows[ALL].update(rows[name])
+        durations[ALL].extend(durations[name])
+    for name, counts in rows.items():
+        values = sorted(durations[name])
+        result.append(OrderRollup(
+            period=period, bucket=bucket, technician_name=name,
+            **{c: counts[c] for c in COUNTS},
+            ttc_p50=percentile(values, 50),
+            ttc_p90=percentile(values, 90),
+            ttc_p99=percentile(values, 99),
+            ttc_hist={str(k): v for k, v in Counter(hist_index(s) for s in values).items()},
+        ))
+    return result
+
+
+def rebuild(start, end, periods=None):
+    """
+    Recalcula todos los tramos que tocan [start, end). Es idempotente:
+    cada tramo se reemplaza completo en su propia transacción.
+    """
+    n = 0
+    for period in periods or PERIODS:
+        for bucket in iter_buckets(start, end, period):
+            rows = compute_bucket(period, bucket)
+            with transaction.atomic():
+                OrderRollup.objects.filter(period=period, bucket=bucket).delete()
+                OrderRollup.objects.bulk_create(rows)
+            n += 1
+    return n
+
+
+def prune(now=None):
+    now = now or timezone.now()
+    retention = {**DEFAULT_RETENTION_DAYS, **getattr(settings, "ORDER_ROLLUP_RETENTION_DAYS", {})}
+    deleted = 0
+    for period, days in retention.items():
+        cutoff = now - datetime.timedelta(days=days)
+        deleted += OrderRollup.objects.filter(period=period, bucket__lt=cutoff).delete()[0]
+    return deleted
+
+
+def rollup_recent(now=None):
+    """
+    Lo que corre la tarea periódica: rehace los tramos de las últimas
+    ORDER_ROLLUP_LOOKBACK horas (cierres y expiraciones tardías caen ahí)
+    y borra lo que pasó la retención.
+    """
+    now = now or timezone.now()
+    started = time.perf_counter()
+    lookback = datetime.timedelta(hours=getattr(settings, "ORDER_ROLLUP_LOOKBACK", 2))
+    buckets = rebuild(now - lookback, now + datetime.timedelta(microseconds=1))
+    stats = {
+        "buckets": buckets,
+        "pruned": prune(now),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    logger.info("rollup_orders: %(buckets)s tramos, %(pruned)s filas viejas borradas (%(elapsed_ms)s ms)", stats)
+    return stats
+
+
+def pick_period(start, end):
+    # Ventanas cortas por hora, el resto por día
+    return OrderRollup.Period.HOUR if end - start <= datetime.timedelta(days=2) else OrderRollup.Period.DAY
+
+
+def query(start, end, period=None, technician=None):
+    """
+    Serie temporal + totales de [start, end) leyendo sólo OrderRollup.
+    Los percentiles de los totales salen de combinar histogramas.
+    Lanza WindowTooLarge si la serie pasa de ORDER_ROLLUP_MAX_POINTS tramos.
+    """
+    period = period or pick_period(start, end)
+    start = bucket_start(start, period)
+    # antes de leer nada: por hora, años de ventana son decenas de miles de puntos
+    max_points = getattr(settings, "ORDER_ROLLUP_MAX_POINTS", 1000)
+    if (end - start) / PERIODS[period] > max_points:
+        raise WindowTooLarge(f"Máximo {max_points} tramos por consulta; use period=day o una ventana menor")
+    rows = OrderRollup.objects.filter(period=period, bucket__gte=start, bucket__lt=end).order_by("bucket")
+    if technician is not None:
+        rows = rows.filter(technician_name=technician)
+
+    points, totals, by_technician = {}, Counter(), defaultdict(Counter)
+    hist = Counter()
+    for row in rows.values("bucket", "technician_name", *COUNTS, "ttc_p50", "ttc_p90", "ttc_p99", "ttc_hist"):
+        name = row["technician_name"]
+        if technician is None and name != ALL:
+            by_technician[name].update({c: row[c] for c in COUNTS})
+            continue
+        points[row["bucket"]] = {
+            **{c: row[c] for c in COUNTS},
+            "ttc_p50": row["ttc_p50"], "ttc_p90": row["ttc_p90"], "ttc_p99": row["ttc_p99"],
+        }
+        totals.update({c: row[c] for c in COUNTS})
+        hist.update(row["ttc_hist"])
+
+    # tramos sin actividad van en cero, para que la serie no tenga huecos
+    empty = {**{c: 0 for c in COUNTS}, "ttc_p50": None, "ttc_p90": None, "ttc_p99": None}
+    series = [{"bucket": b, **points.get(b, empty)} for b in iter_buckets(start, end, period)]
+
+    return {
+        "period": period,
+        "start": start,
+        "end": end,
+        "technician": technician,
+        "totals": {
+            **{c: totals[c] for c in COUNTS},
+            "ttc_p50": hist_percentile(hist, 50),
+            "ttc_p90": hist_percentile(hist, 90),
+            "ttc_p99": hist_percentile(hist, 99),
+        },
+        "series": series,
+        "by_technician": {name: {c: counts[c] for c in COUNTS} for name, counts in by_technician.items()},
+    }
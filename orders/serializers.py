@@ -12,10 +12,61 @@ class ServiceOrderCreateSerializer(serializers.Serializer):
     hours = serializers.IntegerField(required=False)
     days = serializers.IntegerField(required=False)
 
+class OrderImportSerializer(serializers.Serializer):
+    # bulk_create_orders: lista JSON de filas como las de create_order, o un archivo CSV/JSON
+    orders = serializers.ListField(child=serializers.DictField(), required=False, allow_empty=False)
+    file = serializers.FileField(required=False)
+
+    def validate(self, data):
+        if ("orders" in data) == ("file" in data):
+            raise serializers.ValidationError("Enviar orders o file (uno de los dos).")
+        return data
+
 class ServiceOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = ServiceOrder
-        fields = ["id","uuid_order","technician","technician_name","status","created_at","expires_at"]
+        fields = ["id","uuid_order","technician","technician_name","status","created_at","expires_at","artifacts_ready"]
+class OrderListFilterSerializer(serializers.Serializer):
+    # Filtros opcionales de ServiceOrderViewSet.list (query params)
+    status = serializers.MultipleChoiceField(choices=ServiceOrder.Status.choices, required=False)
+    technician = serializers.IntegerField(required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    expires_after = serializers.DateTimeField(required=False)
+    expires_before = serializers.DateTimeField(required=False)
+
+class RollupQuerySerializer(serializers.Serializer):
+    # Ventana de stats_range; por defecto las últimas 24 horas
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    period = serializers.ChoiceField(choices=["hour", "day"], required=False)
+    technician = serializers.CharField(max_length=150, required=False)
+
+    def validate(self, data):
+        if data.get("start") and data.get("end") and data["start"] >= data["end"]:
+            raise serializers.ValidationError("start debe ser anterior a end.")
+        return data
+
+class TokenBatchSerializer(serializers.Serializer):
+    # JWTs escaneados (validate_tokens); el tope evita lotes gigantes
+    tokens = serializers.ListField(child=serializers.CharField(), allow_empty=False, max_length=200)
+
+class AuditFeedFilterSerializer(serializers.Serializer):
+    # Filtros opcionales de audit_feed (query params)
+    action = serializers.CharField(max_length=50, required=False)
+    actor = serializers.IntegerField(required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+class BulkPdfSerializer(serializers.Serializer):
+    # Lista explícita de ids, o bien filtros (si no hay ids)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    status = serializers.ChoiceField(choices=ServiceOrder.Status.choices, required=False)
+    technician_id = serializers.IntegerField(required=False)
+    # sheets: ZIP con un PDF por orden / labels: hojas A4 con N QRs
+    mode = serializers.ChoiceField(choices=["sheets", "labels"], default="sheets")
+    per_page = serializers.IntegerField(min_value=1, max_value=80, default=12)
+
 class FailInstallationSerializer(serializers.Serializer):
     jwt = serializers.CharField()  # JWT pegado por el técnico
     justification = serializers.ChoiceField(choices=[
@@ -36,7 +87,7 @@ class SuccessInstallationSerializer(serializers.Serializer):
 class EvidenceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Evidence
-        fields = ["id", "kind", "file", "file_hash", "created_at"]
+        fields = ["id", "kind", "file", "file_hash", "print_file", "thumbnail", "created_at"]
 
 class ServiceOrderDetailSerializer(serializers.ModelSerializer):
     evidences = EvidenceSerializer(many=True, read_only=True)
@@ -55,6 +106,7 @@ class AuditLogSerializer(serializers.ModelSerializer):
         model = AuditLog
         fields = [
             "id",
+            "order",
             "action",
             "admin_username",
             "ot_jti",
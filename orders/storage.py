@@ -0,0 +1,87 @@
+import os, re
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from .uploads import uploaded_sha256
+
+# evidences/ab/cd/<sha256>.ext
+CONTENT_NAME_RE = re.compile(r"/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[\w]+)?$")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Guarda cada archivo bajo su SHA-256, repartido en subdirectorios
+    (evidences/ab/cd/<sha256>.jpg) para que ningún directorio crezca sin
+    límite. Un contenido idéntico se guarda una sola vez; el borrado se hace
+    por conteo de referencias (EvidenceBlob, ver pin_blob/release_blob).
+    """
+
+    def __init__(self, **kwargs):
+        # mismo nombre => mismo contenido, así que sobrescribir es inofensivo
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(**kwargs)
+
+    def content_name(self, name, digest):
+        dir_name, file_name = os.path.split(str(name).replace("\\", "/"))
+        ext = os.path.splitext(file_name)[1].lower()[:10]
+        return "/".join(p for p in (dir_name, digest[:2], digest[2:4], digest + ext) if p)
+
+    def is_content_name(self, name):
+        return bool(CONTENT_NAME_RE.search(name or ""))
+
+    def _save(self, name, content):
+        target = self.content_name(name, uploaded_sha256(content))
+        # la referencia va antes de mirar si existe: así collect_blob no puede
+        # borrarlo entre este exists() y el INSERT de la evidencia
+        pin_blob(target)
+        if self.exists(target):
+            return target  # ya lo teníamos: no se escribe nada
+        return super()._save(target, content)
+
+    def save_as(self, name, content):
+        # Para derivados (miniaturas, etc.): nombre fijo elegido por quien llama
+        return super()._save(name, content)
+
+
+def evidence_storage():
+    return ContentAddressedStorage()
+
+
+def pin_blob(name):
+    """Suma una referencia al blob `name` (en la transacción en curso, si hay)."""
+    from .models import EvidenceBlob
+
+    # sin savepoint: dentro del cierre son dos consultas más, no cuatro
+    with transaction.atomic(savepoint=False):
+        EvidenceBlob.objects.bulk_create([EvidenceBlob(name=name, refs=0)], ignore_conflicts=True)
+        EvidenceBlob.objects.filter(name=name).update(refs=F("refs") + 1)
+
+
+def release_blob(name, derived=()):
+    """
+    Resta una referencia (evidencia borrada o subida descartada). Al
+    confirmar, collect_blob borra el blob y sus derivados si quedó en cero.
+    """
+    from .models import EvidenceBlob
+
+    EvidenceBlob.objects.filter(name=name).update(refs=F("refs") - 1)
+    transaction.on_commit(lambda: collect_blob(name, derived))
+
+
+def collect_blob(name, derived=()):
+    # Borra el blob si nadie lo referencia. Devuelve True si lo borró.
+    from .models import Evidence, EvidenceBlob
+
+    with transaction.atomic():
+        # El DELETE toma el lock de escritura (SQLite) o el de la fila antes
+        # de decidir: un pin_blob concurrente espera a que termine y, como el
+        # archivo ya no está, _save lo vuelve a escribir
+        EvidenceBlob.objects.filter(name=name, refs__lte=0).delete()
+        if (EvidenceBlob.objects.filter(name=name).exists()
+                or Evidence.objects.filter(file=name).exists()):
+            return False
+        storage = evidence_storage()
+        for n in (name, *derived):
+            storage.delete(n)
+    return True
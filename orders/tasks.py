@@ -1,11 +1,33 @@
-from django.utils import timezone
-from orders.models import ServiceOrder
+from orders.artifacts import prerender_order
+from orders.audit import spool
+from orders.expiration import expire_due
+from orders.derivatives import process_evidence
+from orders.rollups import rollup_recent
 from celery import shared_task
 
 @shared_task
 def expire_orders():
-    now = timezone.now()
-    expiradas = ServiceOrder.objects.filter(
-        expires_at__lt=now, status__in=["pending","in_use"]
-    )
-    return expiradas.update(status="expired")
+    # Respaldo del scheduler: lotes cortos, devuelve conteo y latencia
+    return expire_due()
+
+
+@shared_task(ignore_result=True)
+def prerender_order_artifacts(order_id):
+    return prerender_order(order_id)
+
+
+@shared_task(ignore_result=True)
+def build_evidence_derivatives(evidence_id):
+    return process_evidence(evidence_id)
+
+
+@shared_task
+def rollup_orders():
+    # Rehace los tramos recientes de OrderRollup y aplica la retención
+    return rollup_recent()
+
+
+@shared_task
+def flush_audit_spool():
+    # Los procesos web flushean solos; esto levanta lo que dejó uno caído
+    return spool.flush()
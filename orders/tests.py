@@ -1,3 +1,1582 @@
-from django.test import TestCase
+import collections, concurrent.futures, datetime, hashlib, io, json, os, shutil, subprocess, sys, tempfile, threading, time, zipfile
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.handlers.asgi import ASGIHandler
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pypdf import PdfReader, PdfWriter
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from accounts.models import User
+from . import (
+    artifacts, audit, bulk, closing, counters, credentials, expiration, imports, metrics, pdf, profiling,
+    report, rollups, tokens, writequeue,
+)
+from .jwt_audit import make_ot_token
+from .benchmarks import dataset, runner
+from .benchmarks.dataset import noise_jpeg
+from .closing import discard_stored, store_upload
+from .uploads import uploaded_sha256
+from .models import ServiceOrder, AuditBatch, AuditLog, Evidence, EvidenceBlob, OrderCounter, OrderRollup
+from .querybudget import QueryBudgetExceeded
+from .views import ServiceOrderViewSet
+
+
+class HotQueryIndexTests(TestCase):
+    """
+    Las consultas calientes deben resolverse con su índice (EXPLAIN QUERY PLAN en SQLite).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        now = timezone.now()
+        for i in range(20):
+            ServiceOrder.objects.create(
+                technician=cls.tech, technician_name=f"Tec {i % 3}",
+                jwt_token="t", jwt_hash="h" * 64,
+                expires_at=now + datetime.timedelta(minutes=i + 1),
+            )
+        cls.order = ServiceOrder.objects.first()
+        AuditLog.objects.create(
+            order=cls.order, admin=cls.admin, action="x",
+            ot_token_copy="t", ot_jti="j", audit_jwt="a", audit_jti="k",
+        )
+
+    def assertUsesIndex(self, qs, index_name):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN es propio de SQLite")
+        plan = qs.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_expire_orders_uses_partial_expiry_index(self):
+        qs = ServiceOrder.objects.expirable(timezone.now())
+        self.assertUsesIndex(qs, "order_open_expiry_idx")
+        self.assertEqual(qs.count(), 0)
+
+    def test_technician_list_uses_technician_id_index(self):
+        qs = ServiceOrder.objects.filter(technician=self.tech).order_by("-id")
+        self.assertUsesIndex(qs, "order_tech_id_idx")
+        self.assertNotIn("TEMP B-TREE", qs.explain())
+
+    def test_audits_by_order_use_order_created_index(self):
+        qs = AuditLog.objects.filter(order=self.order).order_by("-created_at")
+        self.assertUsesIndex(qs, "audit_order_created_idx")
+        self.assertNotIn("TEMP B-TREE", qs.explain())
+
+    def test_stats_group_by_technician_name_uses_index(self):
+        qs = ServiceOrder.objects.values("technician_name").annotate(total=Count("id")).order_by()
+        self.assertUsesIndex(qs, "order_tech_name_idx")
+
+    def test_audit_feed_filters_use_their_index(self):
+        qs = AuditLog.objects.filter(action="x").order_by("-created_at")
+        self.assertUsesIndex(qs, "audit_action_created_idx")
+        self.assertNotIn("TEMP B-TREE", qs.explain())
+        qs = AuditLog.objects.filter(admin=self.admin).order_by("-created_at")
+        self.assertUsesIndex(qs, "audit_admin_created_idx")
+        self.assertNotIn("TEMP B-TREE", qs.explain())
+
+
+class EvidenceBlobTests(TestCase):
+    """
+    Evidencias con el mismo contenido comparten blob; el archivo se borra
+    recién cuando no queda ninguna referencia.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        cls.order = ServiceOrder.objects.create(technician=cls.tech, technician_name="Tec", jwt_token="t", jwt_hash="h" * 64)
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    def evidence(self, content=b"misma foto"):
+        return Evidence.objects.create(order=self.order, kind="foto_domicilio", file=ContentFile(content, name="a.jpg"))
+
+    def delete(self, evidence):
+        with self.captureOnCommitCallbacks(execute=True):
+            evidence.delete()
+
+    def test_same_content_is_stored_once(self):
+        a, b = self.evidence(), self.evidence()
+        self.assertEqual(a.file.name, b.file.name)
+        self.assertEqual(EvidenceBlob.objects.get(name=a.file.name).refs, 2)
+        self.assertNotEqual(self.evidence(b"otra").file.name, a.file.name)
+
+    def test_deleting_one_of_two_keeps_the_file(self):
+        a, b = self.evidence(), self.evidence()
+        storage = a.file.storage
+        self.delete(a)
+        self.assertTrue(storage.exists(b.file.name))
+        self.delete(b)
+        self.assertFalse(storage.exists(b.file.name))
+        self.assertFalse(EvidenceBlob.objects.filter(name=b.file.name).exists())
+
+    def test_pending_upload_keeps_the_file_alive(self):
+        # una subida igual que todavía no creó su evidencia (cola de escrituras)
+        # no puede perder el blob porque en ese momento se borra la única evidencia
+        a = self.evidence()
+        storage = a.file.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            name = store_upload(ContentFile(b"misma foto", name="b.jpg"))
+        self.assertEqual(name, a.file.name)
+        self.delete(a)
+        self.assertTrue(storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            discard_stored([name])
+        self.assertFalse(storage.exists(name))
+
+    @override_settings(ORDER_AUDIT_MODE="sync")
+    def test_lost_close_drops_the_new_blob(self):
+        # otra petición cerró la orden antes: la transacción se revierte y el
+        # blob recién escrito no puede quedar huérfano en disco
+        ServiceOrder.objects.filter(pk=self.order.pk).update(status=ServiceOrder.Status.FAILED)
+        upload = SimpleUploadedFile("casa.jpg", b"foto nueva", content_type="image/jpeg")
+        evidences = [(Evidence.Type.FOTO_DOMICILIO, "subida_foto_domicilio", upload, hashlib.sha256(b"foto nueva").hexdigest())]
+        with self.captureOnCommitCallbacks(execute=True):
+            closed = closing.close_order(self.tech, self.order, ServiceOrder.Status.COMPLETED, {}, evidences, "t")
+        self.assertFalse(closed)
+        self.assertFalse(Evidence.objects.exists())
+        self.assertFalse(EvidenceBlob.objects.exists())
+        location = Evidence._meta.get_field("file").storage.location
+        self.assertEqual([f for _, _, files in os.walk(location) for f in files], [])
+
+    def test_dedupe_releases_the_old_name(self):
+        storage = Evidence._meta.get_field("file").storage
+        old = FileSystemStorage(location=storage.location).save("evidences/vieja.jpg", ContentFile(b"misma foto"))
+        for _ in range(2):
+            Evidence.objects.create(order=self.order, kind="foto_domicilio", file=old)
+        EvidenceBlob.objects.create(name=old, refs=2)  # lo que deja la migración 0013
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("dedupe_evidences", stdout=io.StringIO())
+        new = Evidence.objects.values_list("file", flat=True).distinct().get()
+        self.assertTrue(storage.is_content_name(new))
+        self.assertFalse(storage.exists(old))
+        self.assertFalse(EvidenceBlob.objects.filter(name=old).exists())
+        self.assertEqual(EvidenceBlob.objects.get(name=new).refs, 2)
+
+
+class CounterReconcileTests(TestCase):
+    """
+    Los contadores de stats se mantienen en la misma transacción que cada
+    cambio; reconcile_counters encuentra y corrige lo que se desfase.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def create(self, name="Tec", counted=True):
+        order = ServiceOrder.objects.create(technician=self.tech, technician_name=name, jwt_token="t", jwt_hash="h" * 64)
+        if counted:
+            counters.order_created(order)
+        return order
+
+    def test_transitions_and_deletes_keep_counters_in_sync(self):
+        a, b, _ = self.create(), self.create(), self.create("Otro")
+        self.assertTrue(counters.transition(a, ServiceOrder.Status.COMPLETED))
+        # b ya no está pendiente: el compare and set no toca nada
+        ServiceOrder.objects.filter(pk=b.pk).update(status=ServiceOrder.Status.FAILED)
+        counters.status_changed(ServiceOrder.Status.PENDING, ServiceOrder.Status.FAILED)
+        self.assertFalse(counters.transition(b, ServiceOrder.Status.COMPLETED))
+        ServiceOrder.objects.get(pk=b.pk).delete()  # como el admin: descuenta el estado actual
+
+        self.assertEqual(counters.reconcile(dry_run=True), {})
+        self.assertEqual(counters.snapshot(), {
+            "total_orders": 2, "total_evidences": 0,
+            "by_status": {"completed": 1, "pending": 1},
+            "by_technician": {"Tec": 1, "Otro": 1},
+        })
+
+    def test_reconcile_fixes_drift(self):
+        self.create()
+        self.create("Otro", counted=False)  # alta que no pasó por los contadores
+        counters.bump({(counters.STATUS, "expired"): 3})
+
+        out = io.StringIO()
+        call_command("reconcile_counters", "--dry-run", stdout=out)
+        self.assertIn("status:expired guardado=3 real=0", out.getvalue())
+        self.assertEqual(counters.snapshot()["total_orders"], 1)  # dry-run no corrige
+
+        diff = counters.reconcile()
+        self.assertEqual(diff[(counters.TOTAL, "")], (1, 2))
+        self.assertEqual(diff[(counters.TECHNICIAN, "Otro")], (0, 1))
+        self.assertEqual(counters.reconcile(dry_run=True), {})
+        snap = counters.snapshot()
+        self.assertEqual(snap["total_orders"], 2)
+        self.assertEqual(snap["by_status"], {"pending": 2})
+
+
+class ExpirationTests(TestCase):
+    """
+    Expiración por lotes, por id y perezosa al leer, y el scheduler que
+    cumple cada deadline: sólo órdenes abiertas y vencidas, con contadores.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def create(self, minutes, status=ServiceOrder.Status.PENDING):
+        order = ServiceOrder.objects.create(
+            technician=self.tech, technician_name="Tec", jwt_token="t", jwt_hash="h" * 64, status=status,
+            expires_at=timezone.now() + datetime.timedelta(minutes=minutes),
+        )
+        counters.order_created(order)
+        return order
+
+    def statuses(self):
+        return dict(ServiceOrder.objects.values_list("id", "status"))
+
+    def test_expire_due_in_chunks(self):
+        due = [self.create(-i - 1, st) for i, st in enumerate(["pending", "in_use", "pending", "in_use", "pending"])]
+        future, closed = self.create(30), self.create(-5, ServiceOrder.Status.COMPLETED)
+
+        with mock.patch.object(tokens, "order_changed") as changed, self.captureOnCommitCallbacks(execute=True):
+            stats = expiration.expire_due(chunk_size=2)
+        self.assertEqual((stats["expired"], stats["chunks"]), (5, 3))
+        self.assertEqual(sorted(i for call in changed.call_args_list for i in call.args[0]), sorted(o.id for o in due))
+        statuses = self.statuses()
+        self.assertTrue(all(statuses[o.id] == "expired" for o in due))
+        self.assertEqual((statuses[future.id], statuses[closed.id]), ("pending", "completed"))
+        self.assertEqual(counters.reconcile(dry_run=True), {})
+        self.assertEqual(expiration.expire_due()["expired"], 0)
+
+    def test_expire_ids_only_touches_open_and_due(self):
+        due, future, closed = self.create(-1), self.create(30), self.create(-1, ServiceOrder.Status.FAILED)
+        self.assertEqual(expiration.expire_ids([due.id, future.id, closed.id]), 1)
+        self.assertEqual(self.statuses(), {due.id: "expired", future.id: "pending", closed.id: "failed"})
+        self.assertEqual(expiration.expire_ids([]), 0)
+        self.assertEqual(counters.reconcile(dry_run=True), {})
+
+    def test_expire_if_due(self):
+        future, due, closed = self.create(30), self.create(-1, "in_use"), self.create(-1, "completed")
+        self.assertFalse(expiration.expire_if_due(future))
+        self.assertTrue(expiration.expire_if_due(due))
+        self.assertEqual(due.status, "expired")
+        # vencida pero ya cerrada: se informa vencida y no se toca
+        self.assertTrue(expiration.expire_if_due(closed))
+        self.assertEqual(closed.status, "completed")
+        self.assertEqual(self.statuses(), {future.id: "pending", due.id: "expired", closed.id: "completed"})
+
+    def test_scheduler_refills_open_orders_within_the_horizon(self):
+        due, soon = self.create(-1), self.create(1, "in_use")
+        self.create(30)  # fuera del horizonte
+        self.create(-1, "completed")
+        scheduler = expiration.ExpiryScheduler(horizon=120, refill_interval=60)
+        scheduler.refill()
+        scheduler.refill()  # no duplica lo que ya está en el heap
+        self.assertEqual(sorted(order_id for _, order_id in scheduler._heap), [due.id, soon.id])
+
+        self.assertEqual(scheduler.run_pending(), 1)
+        self.assertEqual([order_id for _, order_id in scheduler._heap], [soon.id])
+        self.assertEqual(self.statuses()[due.id], "expired")
+        self.assertEqual(scheduler.expired, 1)
+
+    def test_new_order_wakes_the_scheduler(self):
+        scheduler = expiration.ExpiryScheduler(horizon=120, refill_interval=60)
+        next_refill = time.time() + 60
+        self.assertGreater(scheduler._next_wakeup(next_refill), 50)
+
+        woke = threading.Event()
+
+        def sleeper():
+            with scheduler._cond:
+                scheduler._cond.wait(timeout=30)
+            woke.set()
+
+        thread = threading.Thread(target=sleeper)
+        thread.start()
+        time.sleep(0.1)
+        order = self.create(0.05)
+        # lo que hace create_order cuando el scheduler corre en este proceso
+        with mock.patch.object(expiration, "scheduler", scheduler), mock.patch.object(scheduler, "_thread", thread):
+            expiration.schedule_expiry(order)
+        self.assertTrue(woke.wait(5))
+        thread.join()
+        # ahora duerme sólo hasta el deadline de la orden nueva
+        self.assertLess(scheduler._next_wakeup(next_refill), 5)
+
+
+class RollupTests(TestCase):
+    """
+    Rollups por hora/día: a qué tramo va cada orden, percentiles del tiempo
+    de cierre, retención y la serie sin huecos que devuelve stats_range.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        day = rollups.bucket_start(timezone.now() - datetime.timedelta(days=3), OrderRollup.Period.DAY)
+        cls.hour = day + datetime.timedelta(hours=10)
+
+    def at(self, minutes):
+        return self.hour + datetime.timedelta(minutes=minutes)
+
+    def order(self, name, created, status="pending", closed=None, expires=None):
+        order = ServiceOrder.objects.create(technician=self.tech, technician_name=name, jwt_token="t",
+                                            jwt_hash="h" * 64, status=status)
+        ServiceOrder.objects.filter(pk=order.pk).update(
+            created_at=self.at(created),
+            closed_at=self.at(closed) if closed is not None else None,
+            expires_at=self.at(expires) if expires is not None else None,
+        )
+
+    def seed(self):
+        self.order("Ana", 5, "completed", closed=30)     # cierra en 25 min
+        self.order("Ana", -60, "failed", closed=10)      # creada el tramo anterior, cierra en 70 min
+        self.order("Beto", 1, "expired", expires=20)
+        self.order("Beto", 2, "expired", expires=70)     # vence el tramo siguiente
+        self.order("Beto", 3, "completed", closed=75)    # cierra el tramo siguiente
+
+    def test_compute_bucket_attribution_and_percentiles(self):
+        self.seed()
+        rows = {r.technician_name: r for r in rollups.compute_bucket(OrderRollup.Period.HOUR, self.hour)}
+        counts = {name: tuple(getattr(r, c) for c in rollups.COUNTS) for name, r in rows.items()}
+        # (created, completed, failed, expired)
+        self.assertEqual(counts, {"Ana": (1, 1, 1, 0), "Beto": (3, 0, 0, 1), rollups.ALL: (4, 1, 1, 1)})
+        ana = rows["Ana"]
+        self.assertEqual((ana.ttc_p50, ana.ttc_p90, ana.ttc_p99), (1500.0, 4200.0, 4200.0))
+        self.assertEqual(sum(ana.ttc_hist.values()), 2)
+        self.assertIsNone(rows["Beto"].ttc_p50)
+
+    def test_percentiles(self):
+        values = [float(v) for v in range(1, 11)]
+        self.assertEqual([rollups.percentile(values, p) for p in (50, 90, 99)], [5.0, 9.0, 10.0])
+        self.assertIsNone(rollups.percentile([], 50))
+        # el histograma logarítmico se aleja a lo sumo ~5 % del exacto
+        values = sorted(60.0 * 1.07 ** i for i in range(200))
+        hist = collections.Counter(str(rollups.hist_index(v)) for v in values)
+        for p in (50, 90, 99):
+            exact = rollups.percentile(values, p)
+            self.assertLess(abs(rollups.hist_percentile(hist, p) - exact) / exact, 0.06)
+
+    def test_rebuild_is_idempotent(self):
+        self.seed()
+        end = self.at(180)
+        self.assertEqual(rollups.rebuild(self.hour, end, [OrderRollup.Period.HOUR]), 3)
+        first = list(OrderRollup.objects.values_list("bucket", "technician_name", *rollups.COUNTS).order_by("bucket", "technician_name"))
+        rollups.rebuild(self.hour, end, [OrderRollup.Period.HOUR])
+        again = list(OrderRollup.objects.values_list("bucket", "technician_name", *rollups.COUNTS).order_by("bucket", "technician_name"))
+        self.assertEqual(first, again)
+
+    def test_prune_keeps_each_period_retention(self):
+        now = timezone.now()
+        for period, days in [("hour", 20), ("hour", 5), ("day", 800), ("day", 100)]:
+            OrderRollup.objects.create(period=period, bucket=now - datetime.timedelta(days=days))
+        self.assertEqual(rollups.prune(now), 2)
+        kept = sorted((r.period, (now - r.bucket).days) for r in OrderRollup.objects.all())
+        self.assertEqual(kept, [("day", 100), ("hour", 5)])
+        with override_settings(ORDER_ROLLUP_RETENTION_DAYS={"hour": 3}):
+            self.assertEqual(rollups.prune(now), 1)
+
+    def test_query_zero_fills_and_filters_by_technician(self):
+        self.seed()
+        rollups.rebuild(self.hour, self.at(180), [OrderRollup.Period.HOUR])
+        data = rollups.query(self.at(10), self.at(180), "hour")
+        self.assertEqual([p["bucket"] for p in data["series"]], [self.hour, self.at(60), self.at(120)])
+        self.assertEqual([p["created"] for p in data["series"]], [4, 0, 0])
+        self.assertEqual(data["series"][2], {"bucket": self.at(120), "created": 0, "completed": 0, "failed": 0,
+                                             "expired": 0, "ttc_p50": None, "ttc_p90": None, "ttc_p99": None})
+        self.assertEqual(data["totals"]["completed"], 2)
+        self.assertEqual(set(data["by_technician"]), {"Ana", "Beto"})
+
+        ana = rollups.query(self.at(10), self.at(180), "hour", technician="Ana")
+        self.assertEqual({c: ana["totals"][c] for c in rollups.COUNTS},
+                         {"created": 1, "completed": 1, "failed": 1, "expired": 0})
+        self.assertEqual(ana["by_technician"], {})
+
+    def test_window_is_capped(self):
+        end = rollups.bucket_start(self.hour, OrderRollup.Period.DAY)
+        start = end - datetime.timedelta(days=730)  # toda la retención diaria
+        with self.assertRaises(rollups.WindowTooLarge):
+            rollups.query(start, end, "hour")
+        self.assertEqual(len(rollups.query(start, end, "day")["series"]), 730)
+
+        token = RefreshToken.for_user(self.admin).access_token
+        r = self.client.get("/api/orders/stats_range/", {"start": start.isoformat(), "end": end.isoformat(), "period": "hour"},
+                            HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(r.status_code, 400)
+        self.assertIn("tramos", r.json()["detail"])
+
+
+class OrderListTests(TestCase):
+    """list: paginación por cursor estable ante altas y bajas, y sus filtros."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        cls.other = User.objects.create_user("otro", password="x", role="TECNICO")
+        cls.now = timezone.now()
+        cls.orders = []
+        for i, st in enumerate(["pending", "in_use", "completed", "failed", "expired", "pending", "completed"]):
+            tech = cls.tech if i % 2 == 0 else cls.other
+            order = ServiceOrder.objects.create(technician=tech, technician_name=tech.username, jwt_token="t",
+                                                jwt_hash="h" * 64, status=st,
+                                                expires_at=cls.now + datetime.timedelta(hours=i))
+            ServiceOrder.objects.filter(pk=order.pk).update(created_at=cls.now - datetime.timedelta(days=i))
+            cls.orders.append(order)
+
+    def get(self, user=None, url="/api/orders/", **params):
+        token = RefreshToken.for_user(user or self.admin).access_token
+        r = self.client.get(url, params, HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(r.status_code, 200, r.content)
+        return r.json()
+
+    def ids(self, **params):
+        return [o["id"] for o in self.get(**params)["results"]]
+
+    def test_cursor_pages_are_stable_across_inserts_and_deletes(self):
+        seen = []
+        page = self.get(page_size=3)
+        while True:
+            seen += [o["id"] for o in page["results"]]
+            # altas y bajas entre página y página: ni repetidas ni salteadas
+            ServiceOrder.objects.create(technician=self.tech, technician_name="tec", jwt_token="t", jwt_hash="h" * 64)
+            if not page["next"]:
+                break
+            page = self.get(url=page["next"])
+        self.assertEqual(seen, sorted((o.id for o in self.orders), reverse=True))
+
+        first = self.get(page_size=3)
+        ServiceOrder.objects.filter(pk=first["results"][-1]["id"]).delete()
+        second = self.get(url=first["next"])
+        self.assertTrue(all(o["id"] < first["results"][-1]["id"] for o in second["results"]))
+        self.assertEqual(len(second["results"]), 3)
+
+    def test_filters(self):
+        o = self.orders
+        self.assertEqual(self.ids(status="pending"), [o[5].id, o[0].id])
+        # repetible o separado por comas
+        self.assertEqual(self.ids(status="completed,failed"), [o[6].id, o[3].id, o[2].id])
+        self.assertEqual(self.get(url="/api/orders/?status=completed&status=failed")["results"],
+                         self.get(status="completed,failed")["results"])
+        self.assertEqual(self.ids(technician=self.other.id), [o[5].id, o[3].id, o[1].id])
+        self.assertEqual(self.ids(created_after=(self.now - datetime.timedelta(days=1, hours=1)).isoformat()),
+                         [o[1].id, o[0].id])
+        self.assertEqual(self.ids(created_before=(self.now - datetime.timedelta(days=5, hours=1)).isoformat()),
+                         [o[6].id])
+        self.assertEqual(self.ids(expires_after=(self.now + datetime.timedelta(hours=5)).isoformat(),
+                                  expires_before=(self.now + datetime.timedelta(hours=6, minutes=1)).isoformat()),
+                         [o[6].id, o[5].id])
+
+    def test_technician_sees_only_their_orders(self):
+        self.assertEqual(self.ids(user=self.tech), [o.id for o in reversed(self.orders[::2])])
+        self.assertEqual(self.ids(user=self.tech, technician=self.other.id), [])
+
+    def test_invalid_filter_is_rejected(self):
+        token = RefreshToken.for_user(self.admin).access_token
+        r = self.client.get("/api/orders/", {"status": "nope"}, HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(r.status_code, 400)
+
+
+class TokenCacheTests(TestCase):
+    """
+    validate_token: un acierto de caché no decodifica el JWT ni consulta la
+    BD, y un cambio de estado en cualquier proceso descarta la entrada.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def setUp(self):
+        tokens.token_cache.clear()
+        self.as_tech = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.tech).access_token}"}
+
+    def order(self, minutes=60):
+        order = ServiceOrder.objects.create(
+            technician=self.tech, technician_name="Tec", jwt_token="", jwt_hash="",
+            expires_at=timezone.now() + datetime.timedelta(minutes=minutes),
+        )
+        order.jwt_token, order.ot_token_jti = make_ot_token(self.tech, order)
+        order.jwt_hash = hashlib.sha256(order.jwt_token.encode()).hexdigest()
+        order.save()
+        return order
+
+    def validate(self, order):
+        return tokens.validate_token(order.jwt_token, self.tech, order.id)
+
+    def test_hit_skips_decode_and_database(self):
+        order = self.order()
+        with mock.patch.object(tokens, "decode_order_token", wraps=tokens.decode_order_token) as decode:
+            self.assertEqual(self.validate(order)[0], tokens.VALID)
+            with self.assertNumQueries(0):
+                result, entry = self.validate(order)
+        self.assertEqual(result, tokens.VALID)
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(entry.order["status"], "pending")
+
+    def test_status_change_drops_the_entry(self):
+        order = self.order()
+        self.validate(order)
+        with self.captureOnCommitCallbacks(execute=True):
+            counters.transition(order, ServiceOrder.Status.IN_USE)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.validate(order)[1].order["status"], "in_use")
+
+    def test_change_in_another_process_drops_the_entry(self):
+        # lo que hace order_changed en otro proceso: sólo el contador compartido
+        order = self.order()
+        self.validate(order)
+        tokens.generations.bump(order.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.validate(order)[0], tokens.VALID)
+
+    def test_wrong_token_or_order_is_rejected(self):
+        order, other = self.order(), self.order()
+        self.validate(order)  # en caché
+        self.assertEqual(tokens.validate_token(order.jwt_token, self.tech, other.id)[0], "invalid")
+        self.assertEqual(tokens.validate_token(order.jwt_token + "x", self.tech, order.id)[0], "invalid")
+
+    def test_expired_order_is_rejected(self):
+        # antes respondía 200 aunque la orden ya estuviera vencida
+        order = self.order(minutes=-1)
+        r = self.client.post(f"/api/orders/{order.id}/validate_token/", {"jwt": order.jwt_token},
+                             content_type="application/json", **self.as_tech)
+        self.assertEqual((r.status_code, r.json()["detail"]), (403, "Orden expirada"))
+
+
+class CompactCredentialTests(TestCase):
+    """
+    La credencial compacta del QR (24 caracteres base32) identifica la orden
+    y vale lo mismo que su JWT vigente, hasta que éste se re-emite.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def setUp(self):
+        tokens.token_cache.clear()
+        self.order = ServiceOrder.objects.create(
+            technician=self.tech, technician_name="Tec", jwt_token="", jwt_hash="",
+            expires_at=timezone.now() + datetime.timedelta(hours=1),
+        )
+        self.reissue()
+
+    def reissue(self):
+        self.order.jwt_token, self.order.ot_token_jti = make_ot_token(self.tech, self.order)
+        self.order.jwt_hash = hashlib.sha256(self.order.jwt_token.encode()).hexdigest()
+        self.order.save()
+
+    def test_round_trip(self):
+        value = credentials.compact_for(self.order)
+        self.assertEqual(len(value), credentials.COMPACT_LEN)
+        self.assertRegex(value, r"^[A-Z2-7]+$")
+        self.assertEqual(credentials.parse_compact(value), self.order.id)
+        self.assertEqual(tokens.parse_token(value), (self.order.id, None))
+        # se acepta como la escanee el lector: minúsculas y con espacios
+        self.assertTrue(credentials.matches(self.order, f" {value.lower()} "))
+        self.assertTrue(credentials.matches(self.order, self.order.jwt_token))
+
+        result, entry = tokens.validate_token(value, self.tech, self.order.id)
+        self.assertEqual((result, entry.order_id), (tokens.VALID, self.order.id))
+
+    def test_forged_or_reissued_credential_is_rejected(self):
+        value = credentials.compact_for(self.order)
+        forged = value[:-1] + ("A" if value[-1] != "A" else "B")
+        self.assertEqual(credentials.parse_compact(forged), self.order.id)  # bien formada...
+        self.assertFalse(credentials.matches(self.order, forged))           # ...pero el tag no coincide
+        self.assertIsNone(credentials.parse_compact(value[:-1]))
+        self.assertIsNone(credentials.parse_compact("1" * credentials.COMPACT_LEN))
+
+        self.reissue()
+        self.assertNotEqual(credentials.compact_for(self.order), value)
+        self.assertFalse(credentials.matches(self.order, value))
+        self.assertEqual(tokens.validate_token(value, self.tech, self.order.id)[0], "invalid")
+
+
+@override_settings(ORDER_PRERENDER_MODE="off")
+class BulkImportTests(TestCase):
+    """
+    La importación masiva reserva los ids antes del INSERT para firmar cada
+    JWT con el suyo; sin reserva (otros motores) firma después y actualiza.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def import_orders(self):
+        # un id ya usado y borrado: AUTOINCREMENT no lo repite
+        order = ServiceOrder.objects.create(technician=self.tech, technician_name="Tec", jwt_token="t", jwt_hash="h" * 64)
+        counters.order_created(order)
+        gone = order.pk
+        order.delete()
+        rows = [{"technician_id": self.tech.id, "technician_name": f"Tec {i}", "minutes": 5} for i in range(5)]
+        rows.insert(2, {"technician_id": self.admin.id, "technician_name": "No es técnico"})
+        result = imports.create_orders(self.admin, rows, chunk_size=2)
+        return gone, result
+
+    def assertSignedWithOwnId(self, result):
+        orders = ServiceOrder.objects.in_bulk(result["created"])
+        self.assertEqual(len(orders), 5)
+        for pk, order in orders.items():
+            self.assertEqual(tokens.parse_token(order.jwt_token), (pk, order.ot_token_jti))
+            self.assertTrue(credentials.matches(order, order.jwt_token))
+            self.assertEqual(order.ot_token, order.jwt_token)
+
+    def test_reserved_ids_are_the_inserted_ids(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("la reserva por sqlite_sequence es propia de SQLite")
+        gone, result = self.import_orders()
+        self.assertEqual(result["created"], list(range(gone + 1, gone + 6)))
+        self.assertEqual(result["chunks"], 3)
+        self.assertEqual([e["row"] for e in result["errors"]], [3])
+        self.assertSignedWithOwnId(result)
+        self.assertEqual(counters.reconcile(dry_run=True), {})
+
+    def test_without_reservation_signs_after_insert(self):
+        with mock.patch.object(imports, "_reserve_ids", return_value=None):
+            gone, result = self.import_orders()
+        self.assertEqual(len(result["created"]), 5)
+        self.assertGreater(min(result["created"]), gone)
+        self.assertSignedWithOwnId(result)
+
+    def test_create_order_signs_before_the_insert(self):
+        token = RefreshToken.for_user(self.admin).access_token
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True) as hooks:
+            r = self.client.post("/api/orders/create_order/", {
+                "technician_id": self.tech.id, "technician_name": "Tec", "hours": 2,
+            }, content_type="application/json", HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(r.status_code, 201, r.content)
+        table = ServiceOrder._meta.db_table
+        self.assertFalse([q["sql"] for q in queries if q["sql"].startswith(f'UPDATE "{table}"')])
+        order = ServiceOrder.objects.get(pk=r.json()["order"]["id"])
+        self.assertEqual(tokens.parse_token(order.jwt_token), (order.pk, order.ot_token_jti))
+        self.assertTrue(credentials.matches(order, order.jwt_token))
+        self.assertEqual(len(hooks), 1)  # el pre-render, al confirmar
+        self.assertEqual(counters.reconcile(dry_run=True), {})
+
+
+@override_settings(ORDER_PRERENDER_MODE="sync")
+class PdfCacheTests(TestCase):
+    """
+    PDFs pre-renderizados en la caché en disco: artifacts_ready sólo queda
+    encendido mientras el PDF vigente de la orden sigue en la caché.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.enterContext(override_settings(ORDER_PDF_CACHE_DIR=root))
+
+    def order(self):
+        order = ServiceOrder.objects.create(technician=self.tech, technician_name="Tec", jwt_token="", jwt_hash="",
+                                            expires_at=timezone.now() + datetime.timedelta(hours=1))
+        order.jwt_token, order.ot_token_jti = make_ot_token(self.tech, order)
+        order.jwt_hash = hashlib.sha256(order.jwt_token.encode()).hexdigest()
+        order.save()
+        return order
+
+    def ready(self, order):
+        order.refresh_from_db()
+        return order.artifacts_ready
+
+    def test_schedule_prerender_fills_the_cache(self):
+        order = self.order()
+        artifacts.schedule_prerender(order.id)
+        path, _ = artifacts.pdf_cache.lookup(order)
+        self.assertEqual(len(PdfReader(path).pages), 1)
+        self.assertTrue(self.ready(order))
+        self.assertFalse(artifacts.prerender_order(order.id + 1000))
+
+    @override_settings(ORDER_PRERENDER_MODE="off")
+    def test_prerender_off_does_nothing(self):
+        order = self.order()
+        artifacts.schedule_prerender(order.id)
+        self.assertIsNone(artifacts.pdf_cache.lookup(order))
+        self.assertFalse(self.ready(order))
+
+    def test_token_changed_while_rendering_stays_not_ready(self):
+        order = self.order()
+        render = artifacts.render_order_pdf
+
+        def reissued(o):
+            ServiceOrder.objects.filter(pk=o.pk).update(jwt_hash="otro" * 16)
+            return render(o)
+
+        with mock.patch.object(artifacts, "render_order_pdf", side_effect=reissued):
+            self.assertTrue(artifacts.prerender_order(order.id))
+        self.assertFalse(self.ready(order))
+
+    def test_eviction_clears_artifacts_ready(self):
+        old, new = self.order(), self.order()
+        artifacts.prerender_order(old.id)
+        path, _ = artifacts.pdf_cache.lookup(old)
+        os.utime(path, (time.time() - 60, os.stat(path).st_mtime))  # la menos usada
+        # sólo entra un PDF: guardar el nuevo desaloja el viejo, nunca el recién guardado
+        with override_settings(ORDER_PDF_CACHE_MAX_BYTES=os.path.getsize(path) + 100):
+            artifacts.prerender_order(new.id)
+        self.assertIsNone(artifacts.pdf_cache.lookup(old))
+        self.assertFalse(self.ready(old))
+        self.assertIsNotNone(artifacts.pdf_cache.lookup(new))
+        self.assertTrue(self.ready(new))
+
+        artifacts.pdf_cache.invalidate(new)
+        self.assertFalse(self.ready(new))
+
+    def download(self, order, **headers):
+        token = RefreshToken.for_user(self.tech).access_token
+        return self.client.get(f"/api/orders/{order.id}/download_pdf/", HTTP_AUTHORIZATION=f"Bearer {token}", **headers)
+
+    def test_download_etag_round_trip(self):
+        order = self.order()
+        first = self.download(order)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(PdfReader(io.BytesIO(b"".join(first.streaming_content))).pages), 1)
+        self.assertEqual(first["ETag"], f'"{artifacts.pdf_cache.key_for(order)}"')
+
+        with mock.patch("orders.views.render_order_pdf") as render:
+            again = self.download(order, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        render.assert_not_called()
+
+    def test_reissued_token_changes_the_key(self):
+        order = self.order()
+        etag = self.download(order)["ETag"]
+        old_path = artifacts.pdf_cache.path_for(order)
+        order.jwt_token, order.ot_token_jti = make_ot_token(self.tech, order)
+        order.jwt_hash = hashlib.sha256(order.jwt_token.encode()).hexdigest()
+        order.save()
+
+        self.assertIsNone(artifacts.pdf_cache.lookup(order))
+        fresh = self.download(order, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh["ETag"], etag)
+        # la versión vieja de la orden se borra al guardar la nueva
+        self.assertFalse(old_path.exists())
+        self.assertEqual(list(old_path.parent.glob("*.pdf")), [artifacts.pdf_cache.path_for(order)])
+
+    def test_lru_evicts_the_least_recently_read(self):
+        a, b, c = self.order(), self.order(), self.order()
+        cache = artifacts.pdf_cache
+        # contenido del mismo tamaño: entran exactamente dos
+        for i, order in enumerate([a, b]):
+            path, _ = cache.store(order, b"%" * 1000)
+            os.utime(path, (time.time() - 60 + i, os.stat(path).st_mtime))
+        cache.lookup(a)  # a pasa a ser la más reciente
+        with override_settings(ORDER_PDF_CACHE_MAX_BYTES=2500):
+            cache.store(c, b"%" * 1000)
+        self.assertIsNotNone(cache.lookup(a))
+        self.assertIsNone(cache.lookup(b))
+        self.assertIsNotNone(cache.lookup(c))
+
+    def test_evicted_between_lookup_and_open_renders_again(self):
+        order = self.order()
+        gone = artifacts.pdf_cache.path_for(order)
+        with mock.patch.object(artifacts.pdf_cache, "lookup", return_value=(gone, time.time())):
+            r = self.download(order)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(PdfReader(io.BytesIO(b"".join(r.streaming_content))).pages), 1)
+        self.assertTrue(gone.exists())
+
+
+@override_settings(ORDER_BULK_PDF_WORKERS=1)
+class BulkPdfTests(TestCase):
+    """bulk_pdf: ZIP en streaming con un PDF por orden, o una hoja de etiquetas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        cls.orders = []
+        for _ in range(3):
+            order = ServiceOrder.objects.create(technician=cls.tech, technician_name="Tec", jwt_token="", jwt_hash="")
+            order.jwt_token, order.ot_token_jti = make_ot_token(cls.tech, order)
+            order.jwt_hash = hashlib.sha256(order.jwt_token.encode()).hexdigest()
+            order.save()
+            cls.orders.append(order)
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.enterContext(override_settings(ORDER_PDF_CACHE_DIR=root))
+
+    def bulk(self, **data):
+        token = RefreshToken.for_user(self.admin).access_token
+        return self.client.post("/api/orders/bulk_pdf/", data, content_type="application/json",
+                                HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_zip_has_one_valid_pdf_per_order(self):
+        artifacts.pdf_cache.get_or_render(self.orders[1])  # uno sale de la caché, el resto del pool
+        r = self.bulk(ids=[o.id for o in reversed(self.orders)])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(r.streaming_content))) as zf:
+            self.assertEqual(zf.namelist(), [f"orden_{o.uuid_order}.pdf" for o in self.orders])
+            for name in zf.namelist():
+                self.assertEqual(len(PdfReader(io.BytesIO(zf.read(name))).pages), 1)
+        # lo renderizado en el pool queda en la caché
+        self.assertTrue(all(artifacts.pdf_cache.lookup(o) for o in self.orders))
+
+    def test_closing_the_stream_cancels_pending_renders(self):
+        futures = []
+
+        def submit(*args):
+            # el primero termina; los demás quedan en la cola del pool
+            fut = concurrent.futures.Future()
+            if not futures:
+                fut.set_result(blank_pdf())
+            futures.append(fut)
+            return fut
+
+        pool = mock.Mock(submit=mock.Mock(side_effect=submit))
+        with mock.patch.object(bulk, "get_pool", return_value=pool):
+            pdfs = bulk.iter_order_pdfs(self.orders, window=2)
+            order, data = next(pdfs)
+            pdfs.close()  # el cliente se desconectó
+        self.assertEqual(order, self.orders[0])
+        self.assertEqual(pool.submit.call_count, 2)
+        self.assertTrue(futures[1].cancelled())
+
+    def test_label_sheet_pages(self):
+        extra = [ServiceOrder(id=1000 + i, technician_name="Tec", jwt_token="t") for i in range(22)]
+        for count, per_page, pages in [(0, 12, 1), (12, 12, 1), (13, 12, 2), (25, 12, 3), (25, 80, 1)]:
+            out = io.BytesIO()
+            pdf.render_label_sheet((self.orders + extra)[:count], out, per_page=per_page)
+            self.assertEqual(len(PdfReader(io.BytesIO(out.getvalue())).pages), pages, (count, per_page))
+
+        r = self.bulk(ids=[o.id for o in self.orders], mode="labels", per_page=2)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(PdfReader(io.BytesIO(b"".join(r.streaming_content))).pages), 2)
+
+
+
+@override_settings(ORDER_AUDIT_MODE="sync", ORDER_DERIVATIVES_MODE="sync", ORDER_PRERENDER_MODE="off")
+class EvidenceDerivativeTests(TestCase):
+    """Los derivados se generan después del cierre y nunca lo hacen fallar."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    def test_unreadable_image_does_not_fail_the_close(self):
+        order = ServiceOrder.objects.create(technician=self.tech, technician_name="Tec", jwt_token="t",
+                                            jwt_hash=hashlib.sha256(b"t").hexdigest())
+        token = RefreshToken.for_user(self.tech).access_token
+        with self.assertLogs("orders.derivatives", "WARNING"), self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(f"/api/orders/{order.id}/succeed/", {
+                "jwt": "t", "titular_present": "true",
+                # doc_signed acepta cualquier archivo: PIL no lo puede abrir
+                "doc_signed": SimpleUploadedFile("firmado.jpg", b"no es una imagen", content_type="image/jpeg"),
+                "doc_id": SimpleUploadedFile("dni.jpg", noise_jpeg(2000), content_type="image/jpeg"),
+            }, HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(r.status_code, 200, r.content)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "completed")
+        signed, dni = order.evidences.order_by("kind")
+        self.assertEqual(signed.print_file.name, "")
+        self.assertNotEqual(dni.thumbnail.name, "")
+
+
+@override_settings(ORDER_AUDIT_MODE="sync", ORDER_DERIVATIVES_MODE="off", ORDER_PRERENDER_MODE="off")
+class UploadHashTests(TestCase):
+    """El sha256 que se calcula al recibir la subida es el del archivo guardado."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    # con 4 KB en memoria, la foto chica va por el handler en memoria y la grande por el temporal
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=4096)
+    def test_hash_matches_the_stored_file(self):
+        order = ServiceOrder.objects.create(technician=self.tech, technician_name="Tec", jwt_token="t",
+                                            jwt_hash=hashlib.sha256(b"t").hexdigest())
+        small, large = noise_jpeg(2000), noise_jpeg(64 * 1024)
+        token = RefreshToken.for_user(self.tech).access_token
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(f"/api/orders/{order.id}/succeed/", {
+                "jwt": "t", "titular_present": "true",
+                "doc_signed": SimpleUploadedFile("firmado.jpg", large, content_type="image/jpeg"),
+                "doc_id": SimpleUploadedFile("dni.jpg", small, content_type="image/jpeg"),
+            }, HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(r.status_code, 200, r.content)
+        sent = {"doc_firmado": large, "doc_identidad": small}
+        self.assertEqual(sorted(order.evidences.values_list("kind", flat=True)), sorted(sent))
+        for ev in order.evidences.all():
+            with ev.file.open("rb") as f:
+                stored = hashlib.sha256(f.read()).hexdigest()
+            self.assertEqual(ev.file_hash, stored)
+            self.assertEqual(ev.file_hash, hashlib.sha256(sent[ev.kind]).hexdigest())
+
+    def test_fallback_hash_leaves_the_file_at_the_start(self):
+        f = SimpleUploadedFile("a.jpg", b"contenido")
+        self.assertEqual(uploaded_sha256(f), hashlib.sha256(b"contenido").hexdigest())
+        self.assertEqual(f.read(), b"contenido")
+
+
+
+@override_settings(ORDER_AUDIT_MODE="sync", ORDER_DERIVATIVES_MODE="sync", ORDER_PRERENDER_MODE="off")
+class AsyncCloseTests(TransactionTestCase):
+    """
+    Cierre async (ASGI): los archivos se guardan antes de la transacción y
+    se sueltan si el cierre falla, también si falla una de las escrituras.
+    """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        self.order = ServiceOrder.objects.create(technician=self.tech, technician_name="Tec", jwt_token="t",
+                                                 jwt_hash=hashlib.sha256(b"t").hexdigest())
+
+    def succeed(self):
+        token = RefreshToken.for_user(self.tech).access_token
+        return self.client.post(f"/api/async/orders/{self.order.id}/succeed/", {
+            "jwt": "t", "titular_present": "true",
+            "doc_signed": SimpleUploadedFile("firmado.jpg", noise_jpeg(2000), content_type="image/jpeg"),
+            "doc_id": SimpleUploadedFile("dni.jpg", noise_jpeg(2000), content_type="image/jpeg"),
+        }, HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def assertNothingStored(self):
+        self.assertFalse(EvidenceBlob.objects.filter(refs__gt=0).exists())
+        location = Evidence._meta.get_field("file").storage.location
+        self.assertEqual([f for _, _, files in os.walk(location) for f in files], [])
+
+    def test_close_error_discards_the_stored_files(self):
+        with mock.patch.object(closing, "close_order", side_effect=RuntimeError("caída")):
+            with self.assertRaises(RuntimeError):
+                self.succeed()
+        self.assertNothingStored()
+
+    def test_failed_store_discards_the_others(self):
+        store = closing.store_upload
+
+        def flaky(f):
+            if f.name == "dni.jpg":
+                raise OSError("disco lleno")
+            return store(f)
+
+        with mock.patch.object(closing, "store_upload", side_effect=flaky):
+            with self.assertRaises(OSError):
+                self.succeed()
+        self.assertNothingStored()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "pending")
+
+
+@override_settings(ORDER_WRITE_QUEUE=True)
+class WriteQueueTests(TransactionTestCase):
+    """
+    La cola sólo se activa fuera de una transacción, por eso TransactionTestCase:
+    los trabajos corren en el hilo de la cola, varios en un COMMIT, cada uno en
+    su savepoint, y sus on_commit vuelven al hilo que llamó.
+    """
+
+    def setUp(self):
+        self.addCleanup(writequeue.writes.stop)
+
+    def create(self, username):
+        return User.objects.create_user(username, password="x", role="TECNICO").username
+
+    def in_batch(self, *calls):
+        # Retiene el hilo de la cola con un primer trabajo hasta que los demás
+        # están encolados, así esos llegan juntos al mismo lote
+        release = threading.Event()
+        outcomes = {}
+
+        def call(name, fn):
+            try:
+                outcomes[name] = writequeue.writes.run(fn)
+            except Exception as e:
+                outcomes[name] = e
+
+        threads = [threading.Thread(target=call, args=("gate", release.wait))]
+        threads[0].start()
+        while not writequeue.writes._queue.empty():
+            time.sleep(0.01)
+        threads += [threading.Thread(target=call, args=item) for item in calls]
+        for t in threads[1:]:
+            t.start()
+        while writequeue.writes._queue.qsize() < len(calls):
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join(timeout=10)
+        return outcomes
+
+    def test_jobs_run_in_the_writer_thread(self):
+        self.assertTrue(writequeue.active())
+        result = writequeue.writes.run(lambda: (threading.current_thread().name, self.create("a")))
+        self.assertEqual(result, ("sqlite-writer", "a"))
+        self.assertTrue(User.objects.filter(username="a").exists())
+
+    def test_inside_a_transaction_runs_inline(self):
+        with transaction.atomic():
+            self.assertFalse(writequeue.active())
+            name = writequeue.writes.run(lambda: threading.current_thread().name)
+        self.assertEqual(name, threading.current_thread().name)
+
+    def test_failing_job_rolls_back_only_its_savepoint(self):
+        def broken():
+            self.create("b")
+            raise ValueError("mal")
+
+        outcomes = self.in_batch(("ok1", lambda: self.create("a")), ("bad", broken),
+                                 ("ok2", lambda: self.create("c")))
+        self.assertEqual(outcomes["ok1"], "a")
+        self.assertEqual(outcomes["ok2"], "c")
+        self.assertIsInstance(outcomes["bad"], ValueError)
+        self.assertEqual(set(User.objects.values_list("username", flat=True)), {"a", "c"})
+
+    def test_on_commit_runs_in_the_caller_thread(self):
+        fired = []
+
+        def job(fail):
+            transaction.on_commit(lambda: fired.append((fail, threading.current_thread().name)))
+            if fail:
+                raise ValueError("mal")
+
+        outcomes = self.in_batch(("ok", lambda: job(False)), ("bad", lambda: job(True)))
+        self.assertIsInstance(outcomes["bad"], ValueError)
+        # el del trabajo revertido no corre; el otro, en el hilo de su llamador
+        self.assertEqual(len(fired), 1)
+        fail, thread = fired[0]
+        self.assertFalse(fail)
+        self.assertNotEqual(thread, "sqlite-writer")
+
+    def test_concurrent_callers(self):
+        names = [f"t{i}" for i in range(12)]
+        outcomes = {}
+
+        def call(name):
+            outcomes[name] = writequeue.writes.run(self.create, name)
+
+        threads = [threading.Thread(target=call, args=(name,)) for name in names]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=10)
+        self.assertEqual(outcomes, {name: name for name in names})
+        self.assertEqual(User.objects.filter(username__in=names).count(), len(names))
+
+
+def blank_pdf(pages=1, password=None):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(200, 200)
+    if password:
+        writer.encrypt(password)
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+class FullReportTests(TestCase):
+    """
+    El reporte se envía mientras se arma: un PDF adjunto que no se puede leer
+    se reemplaza por una página con el error y el archivo sigue siendo válido.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        cls.order = ServiceOrder.objects.create(technician=cls.tech, technician_name="Tec", jwt_token="t", jwt_hash="h" * 64)
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    def attach(self, content, name="doc.pdf"):
+        Evidence.objects.create(order=self.order, kind="doc_firmado", file=ContentFile(content, name=name))
+
+    def render(self):
+        data = b"".join(report.stream_full_report(self.order, self.order.evidences.order_by("id")))
+        return PdfReader(io.BytesIO(data), strict=True)
+
+    def test_bad_attachments_become_placeholder_pages(self):
+        self.attach(blank_pdf(2))
+        self.attach(blank_pdf(1, password="secreto"))
+        self.attach(b"%PDF-1.7 truncado")
+        pdf = self.render()
+        # portada + (aviso + 2 páginas) + una página de error por cada adjunto malo
+        self.assertEqual(len(pdf.pages), 6)
+        self.assertIn("Error al incluir el PDF", pdf.pages[4].extract_text())
+
+    def test_failure_while_copying_rolls_back_the_attachment(self):
+        self.attach(blank_pdf(2))
+        copy = report.StreamingPdfWriter._add_pages
+
+        def broken(writer, pages):
+            if len(pages) < 2:  # portadas y avisos
+                return copy(writer, pages)
+            copy(writer, pages[:1])  # ya escribió una página cuando falla
+            raise ValueError("objeto dañado")
+
+        with mock.patch.object(report.StreamingPdfWriter, "_add_pages", broken):
+            pdf = self.render()
+        self.assertEqual(len(pdf.pages), 2)
+        self.assertIn("objeto dañado", pdf.pages[1].extract_text())
+
+
+@override_settings(ORDER_AUDIT_MODE="sync", ORDER_AUDIT_SIGNING="merkle")
+class MerkleAuditTests(TestCase):
+    """Cambiar, borrar o sacar filas o lotes de la auditoría firmada se detecta."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        cls.order = ServiceOrder.objects.create(technician=tech, technician_name="Tec", jwt_token="t", jwt_hash="h" * 64)
+
+    def write_batch(self, n):
+        # n eventos en un solo lote, como un flush del spool
+        entries = []
+        with mock.patch.object(audit, "write_entries", lambda batch, live=False: entries.extend(batch)):
+            for i in range(n):
+                audit.record(self.admin, self.order, "x", None, {"i": i})
+        audit.write_entries(entries)
+        return AuditBatch.objects.order_by("id").last()
+
+    def reasons(self, result):
+        return [f["reason"] for f in result["failures"]]
+
+    def test_intact_log_verifies(self):
+        for n in (3, 4, 1):
+            self.write_batch(n)
+        self.assertEqual(audit.verify(AuditLog.objects.all())["failures"], [])
+        self.assertEqual(audit.verify_chain(), {"batches": 3, "failures": []})
+
+    def test_changed_row_is_detected(self):
+        self.write_batch(3)
+        AuditLog.objects.filter(id=AuditLog.objects.first().id).update(new_values={"i": 99})
+        self.assertIn("la fila fue modificada (no llega a la raíz firmada)",
+                      self.reasons(audit.verify(AuditLog.objects.all())))
+
+    def test_deleted_row_is_detected(self):
+        batch = self.write_batch(3)
+        AuditLog.objects.filter(batch=batch).first().delete()
+        result = audit.verify(self.order.audits.all())
+        self.assertEqual(result["verified"], 2)  # las que quedan verifican solas...
+        self.assertIn("faltan o sobran eventos (2 de 3)", self.reasons(result))  # ...pero falta una
+        self.assertIn("faltan o sobran eventos (2 de 3)", self.reasons(audit.verify_chain()))
+
+    def test_deleted_batch_is_detected(self):
+        first, middle, last = self.write_batch(2), self.write_batch(2), self.write_batch(2)
+        # sacar el lote del medio y reenganchar el siguiente al anterior
+        AuditLog.objects.filter(batch=middle).delete()
+        AuditBatch.objects.filter(id=last.id).update(prev=None)
+        middle.delete()
+        AuditBatch.objects.filter(id=last.id).update(prev=first)
+        # prev_id va en la firma del lote: el siguiente ya no verifica
+        for result in (audit.verify_chain(), audit.verify(AuditLog.objects.all())):
+            self.assertIn({"batch": last.id, "reason": "el lote no coincide con su firma"}, result["failures"])
+
+    def test_batch_chained_to_a_taken_prev_is_retried(self):
+        first = self.write_batch(2)
+        sign = audit.make_audit_root_token
+        raced = []
+
+        def racing_sign(batch):
+            # otro proceso se encadena al mismo anterior justo antes del save
+            if not raced:
+                raced.append(AuditBatch.objects.create(prev=batch.prev, root="", chain="", size=0, root_jwt=""))
+            return sign(batch)
+
+        with mock.patch.object(audit, "make_audit_root_token", side_effect=racing_sign):
+            last = self.write_batch(3)
+        self.assertEqual(len(raced), 1)
+        self.assertEqual(last.prev, first)
+        self.assertEqual(AuditLog.objects.filter(batch=last).count(), 3)
+        self.assertEqual(audit.verify_chain(), {"batches": 2, "failures": []})
+
+    def test_conflicts_give_up_after_the_last_attempt(self):
+        with mock.patch.object(audit, "_insert_batch", side_effect=IntegrityError("prev")) as insert:
+            with self.assertRaises(IntegrityError):
+                self.write_batch(1)
+        self.assertEqual(insert.call_count, audit.BATCH_ATTEMPTS)
+
+
+SPOOL_CHILD = """
+import json, os, sys, django
+django.setup()
+from orders.audit import AuditSpool
+spool = AuditSpool(directory=sys.argv[1], flush_interval=60)
+spool.append(json.loads(sys.argv[2]))
+os._exit(0)  # se cae sin flush
+"""
+
+
+@override_settings(ORDER_AUDIT_MODE="async")
+class AuditSpoolTests(TestCase):
+    """
+    Spool de auditoría: los eventos llegan a AuditLog una sola vez, también
+    los de un proceso caído, y nunca se roba un segmento que alguien usa.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        tech = User.objects.create_user("tec", password="x", role="TECNICO")
+        cls.order = ServiceOrder.objects.create(technician=tech, technician_name="Tec", jwt_token="t", jwt_hash="h" * 64)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # sin hilo de flush: cada test decide cuándo se inserta
+        self.enterContext(mock.patch.object(audit.AuditSpool, "start"))
+        self.spool = self.make_spool()
+
+    def make_spool(self, **kwargs):
+        return audit.AuditSpool(directory=self.directory, flush_interval=60, **kwargs)
+
+    def entry(self, action="x"):
+        # lo que record() agrega al spool
+        entries = []
+        with mock.patch.object(audit.spool, "append", entries.append), self.captureOnCommitCallbacks(execute=True):
+            audit.record(self.admin, self.order, action)
+        return entries[0]
+
+    def files(self, ext):
+        return sorted(n for n in os.listdir(self.directory) if n.endswith(ext))
+
+    def test_record_appends_only_on_commit(self):
+        with mock.patch.object(audit.spool, "append") as append:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                audit.record(self.admin, self.order, "x")
+                append.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        append.assert_called_once()
+
+    def test_append_and_flush(self):
+        first = self.entry()
+        self.spool.append(first)
+        self.spool.append(self.entry())
+        self.assertEqual(len(self.files(".log")), 1)
+        self.assertEqual(self.spool.flush(), 2)
+        self.assertEqual(self.files(".log") + self.files(".ready") + self.files(".busy"), [])
+        # repetir un evento (segmento reinsertado tras una caída) no duplica
+        self.spool.append(first)
+        self.spool.flush()
+        self.assertEqual(AuditLog.objects.filter(action="x").count(), 2)
+
+    def test_claimed_segment_is_not_stolen_however_old(self):
+        self.spool.append(self.entry())
+        self.spool.rotate()
+        [(busy, held)] = self.spool._claim()
+        self.addCleanup(os.close, held)
+        os.utime(busy, (0, 0))  # os.replace conserva el mtime viejo del .log
+        other = self.make_spool()
+        self.assertEqual(other.recover(), 0)
+        self.assertEqual(other.flush(), 0)
+        self.assertTrue(os.path.exists(busy))
+
+    def test_live_writer_is_not_recovered(self):
+        self.spool.append(self.entry())
+        [log] = self.files(".log")
+        os.utime(os.path.join(self.directory, log), (0, 0))
+        self.assertEqual(self.make_spool().recover(), 0)
+        self.assertEqual(self.files(".log"), [log])
+
+    def test_segment_of_a_dead_process_is_recovered(self):
+        child = subprocess.run(
+            [sys.executable, "-c", SPOOL_CHILD, self.directory, json.dumps(self.entry("caido"))],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(child.returncode, 0, child.stderr)
+        self.assertEqual(len(self.files(".log")), 1)
+        self.assertEqual(self.spool.flush(), 1)
+        self.assertTrue(AuditLog.objects.filter(action="caido").exists())
+        self.assertEqual(os.listdir(self.directory), [])  # su .owner también se fue
+
+    def test_failed_insert_is_retried(self):
+        self.spool.append(self.entry())
+        with mock.patch.object(audit, "write_entries", side_effect=DatabaseError("bloqueada")):
+            with self.assertLogs("orders.audit", "ERROR"):
+                self.assertEqual(self.spool.flush(), 0)
+        self.assertEqual(len(self.files(".busy")), 1)
+        self.assertEqual(self.spool.flush(), 1)  # al soltar el flock vuelve a la cola
+
+    def test_segment_removed_by_someone_else(self):
+        self.spool.append(self.entry())
+        read = audit.AuditSpool._read
+
+        def vanish(path):
+            entries = read(path)
+            os.remove(path)
+            return entries
+
+        with mock.patch.object(audit.AuditSpool, "_read", side_effect=vanish):
+            self.assertEqual(self.spool.flush(), 1)
+
+    def test_without_flock_staleness_is_by_age(self):
+        with mock.patch.object(audit, "fcntl", None):
+            spool = self.make_spool(stale_after=30)
+            spool.append(self.entry())
+            [log] = self.files(".log")
+            self.assertEqual(spool.recover(), 0)
+            os.utime(os.path.join(self.directory, log), (0, 0))
+            self.assertEqual(spool.recover(), 1)
+            [(busy, held)] = spool._claim()
+            self.assertIsNone(held)
+            # al reclamarlo se renueva el mtime: no vuelve a parecer abandonado
+            self.assertEqual(spool.recover(), 0)
+            self.assertTrue(os.path.exists(busy))
+
+
+@override_settings(
+    ORDER_QUERY_BUDGET_MODE="raise", ORDER_AUDIT_MODE="sync",
+    ORDER_PRERENDER_MODE="off", ORDER_DERIVATIVES_MODE="off",
+)
+class QueryBudgetTests(TestCase):
+    """
+    Cada acción de ServiceOrderViewSet declara su tope de consultas y lo
+    cumple sin importar cuántas órdenes, evidencias o auditorías haya.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.as_admin = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.admin).access_token}"}
+        self.as_tech = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.tech).access_token}"}
+
+    def create_orders(self, n):
+        for _ in range(n):
+            r = self.client.post("/api/orders/create_order/", {
+                "technician_id": self.tech.id, "technician_name": "Tec", "hours": 2,
+            }, content_type="application/json", **self.as_admin)
+            self.assertEqual(r.status_code, 201, r.content)
+        return ServiceOrder.objects.order_by("id").last()
+
+    def add_evidences(self, order, n):
+        for _ in range(n):
+            Evidence.objects.create(order=order, kind="foto_domicilio", file=ContentFile(b"x", name="a.jpg"))
+
+    def queries(self, method, path, headers, **kwargs):
+        r = getattr(self.client, method)(path, **kwargs, **headers)
+        self.assertLess(r.status_code, 300, r.content)
+        return int(r["X-Query-Count"])
+
+    def read_counts(self, order):
+        return {
+            "list": self.queries("get", "/api/orders/", self.as_admin),
+            "list_tec": self.queries("get", "/api/orders/", self.as_tech),
+            "retrieve": self.queries("get", f"/api/orders/{order.id}/", self.as_admin),
+            "audits": self.queries("get", f"/api/orders/{order.id}/audits/", self.as_admin),
+            "audit_feed": self.queries("get", "/api/orders/audit_feed/", self.as_admin),
+            "verify_audits": self.queries("get", f"/api/orders/{order.id}/verify_audits/", self.as_admin),
+        }
+
+    def test_every_action_declares_a_budget(self):
+        actions = {"list", "retrieve"} | {a.__name__ for a in ServiceOrderViewSet.get_extra_actions()}
+        self.assertEqual(actions - set(ServiceOrderViewSet.query_budgets), set())
+
+    def test_reads_do_not_grow_with_rows(self):
+        order = self.create_orders(2)
+        self.add_evidences(order, 1)
+        audit.record(self.admin, order, "x", {}, {})
+        before = self.read_counts(order)
+
+        order = self.create_orders(30)
+        self.add_evidences(order, 12)
+        for i in range(25):
+            audit.record(self.admin, order, "x", {}, {"i": i})
+        self.assertEqual(self.read_counts(order), before)
+
+    def photo(self, name):
+        return SimpleUploadedFile(f"{name}.jpg", noise_jpeg(2000), content_type="image/jpeg")
+
+    def test_closing_stays_within_budget(self):
+        # el middleware lanza QueryBudgetExceeded si alguna se pasa del tope;
+        # sin filas de contadores (técnico y estados nuevos) es el peor caso
+        order = self.create_orders(1)
+        OrderCounter.objects.all().delete()
+        self.queries("post", f"/api/orders/{order.id}/start/", self.as_tech)
+        OrderCounter.objects.all().delete()
+        self.queries("post", f"/api/orders/{order.id}/fail/", self.as_tech, data={
+            "jwt": order.jwt_token, "justification": "ausencia_titular",
+            "photo_address": self.photo("domicilio"),
+        })
+        order = self.create_orders(1)
+        OrderCounter.objects.all().delete()
+        self.queries("post", f"/api/orders/{order.id}/succeed/", self.as_tech, data={
+            "jwt": order.jwt_token, "titular_present": "true",
+            "doc_signed": self.photo("firmado"), "doc_id": self.photo("dni"),
+        })
+
+    def test_middlewares_stay_async_under_asgi(self):
+        # ni el tope ni el perfilador adaptan la cadena a sync (un salto de hilo por petición)
+        with override_settings(DEBUG=True), self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+    async def test_async_views_are_measured(self):
+        token = RefreshToken.for_user(self.tech).access_token
+        r = await self.async_client.post("/api/async/orders/0/validate_token/", {"jwt": "x"},
+                                         content_type="application/json",
+                                         headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(r.json()["detail"], "JWT inválido")
+        self.assertGreaterEqual(int(r["X-Query-Count"]), 1)  # el usuario, con el ORM async
+
+    def test_exceeding_the_budget_raises(self):
+        budgets = {**ServiceOrderViewSet.query_budgets, "stats": 0}
+        with mock.patch.object(ServiceOrderViewSet, "query_budgets", budgets):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get("/api/orders/stats/", **self.as_admin)
+
+
+class MetricsTests(TestCase):
+    """
+    /metrics suma lo del proceso actual con las fotos que dejan los demás
+    procesos en ORDER_METRICS_DIR.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.enterContext(override_settings(ORDER_METRICS_DIR=directory, ORDER_METRICS_TOKEN=None))
+        self.directory = directory
+
+    def test_actions_are_counted_across_processes(self):
+        with open(os.path.join(self.directory, "999-otro.json"), "w") as f:
+            json.dump({"orders_api_responses": [[["stats", 200], 1000]]}, f)
+        token = RefreshToken.for_user(self.admin).access_token
+        self.assertEqual(self.client.get("/api/orders/stats/", HTTP_AUTHORIZATION=f"Bearer {token}").status_code, 200)
+
+        live = metrics.API_RESPONSES._series[("stats", 200)]
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn(f'orders_api_responses_total{{action="stats",status="200"}} {live + 1000}', body)
+        self.assertIn('orders_api_request_seconds_bucket{action="stats",le="+Inf"}', body)
+
+    def test_snapshots_of_dead_processes_are_compacted(self):
+        dead = subprocess.Popen([sys.executable, "-c", ""])
+        dead.wait()
+        for name in (f"{dead.pid}-aaaa.json", f"{dead.pid}-bbbb.json"):
+            with open(os.path.join(self.directory, name), "w") as f:
+                json.dump({"orders_db_locked": [[[], 3]]}, f)
+        before = metrics.registry.collect()["orders_db_locked"][()]
+
+        metrics.registry.compact()
+        metrics.registry.compact()  # sin nada nuevo no cambia el agregado
+        self.assertEqual(sorted(os.listdir(self.directory)), [".compact.lock", metrics.AGGREGATE_FILE])
+        self.assertEqual(metrics.registry.collect()["orders_db_locked"][()], before)
+
+    def test_token_is_required_when_configured(self):
+        with override_settings(ORDER_METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+
+class SlowRequestProfileTests(TestCase):
+    """Perfiles de peticiones lentas: se guardan, se listan y sólo los ven admins."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user("admin", password="x", role="ADMIN")
+        cls.tech = User.objects.create_user("tec", password="x", role="TECNICO")
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.enterContext(override_settings(
+            ORDER_PROFILE_ENABLED=True, ORDER_PROFILE_SAMPLE_RATE=1, ORDER_PROFILE_DIR=directory,
+            ORDER_PROFILE_MAX_FILES=2,
+        ))
+        self.as_admin = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.admin).access_token}"}
+
+    def test_profiles_are_kept_listed_and_downloadable(self):
+        for _ in range(3):
+            self.client.get("/api/orders/stats/", **self.as_admin)
+        profiles = self.client.get("/api/profiles/", **self.as_admin).json()
+        # el tope de retención incluye el perfil de la propia lista anterior
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(profiles[0]["path"], "/api/orders/stats/")
+        self.assertGreaterEqual(profiles[0]["sql"]["count"], 1)
+
+        r = self.client.get(f"/api/profiles/{profiles[0]['id']}/", {"kind": "folded"}, **self.as_admin)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r["Content-Type"], "text/plain")
+        self.assertEqual(self.client.get("/api/profiles/nope/", **self.as_admin).status_code, 404)
+
+        as_tech = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(self.tech).access_token}"}
+        self.assertEqual(self.client.get("/api/profiles/", **as_tech).status_code, 403)
+
+    async def test_async_request_is_profiled(self):
+        token = RefreshToken.for_user(self.tech).access_token
+        await self.async_client.post("/api/async/orders/0/validate_token/", {"jwt": "x"},
+                                     content_type="application/json",
+                                     headers={"Authorization": f"Bearer {token}"})
+        [meta] = profiling.list_profiles()
+        self.assertEqual(meta["path"], "/api/async/orders/0/validate_token/")
+        self.assertGreaterEqual(meta["sql"]["count"], 1)  # el ORM async corre en el hilo perfilado
+
+
+@override_settings(ORDER_AUDIT_MODE="sync", ORDER_DERIVATIVES_MODE="off", ORDER_PRERENDER_MODE="off")
+class BenchmarkSmokeTests(TransactionTestCase):
+    """
+    bench_api en miniatura: la siembra y cada escenario corren sin errores y
+    el reporte tiene lo que compara el baseline. TransactionTestCase porque
+    los hilos del runner usan su propia conexión y tienen que ver la siembra.
+    """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media, ORDER_PDF_CACHE_DIR=os.path.join(media, "pdf")))
+        self.addCleanup(writequeue.writes.stop)
+        self.addCleanup(tokens.token_cache.clear)
+
+    def test_seed_and_report(self):
+        ds = dataset.seed(technicians=2, orders=12, evidences=3, image_size=2000)
+        self.assertEqual((len(ds.orders), ds.evidences), (12, 3))
+        # 3 evidencias: un cierre exitoso (2) y uno fallido (1)
+        self.assertEqual(len(ds.open_orders), 10)
+        self.assertEqual(Evidence.objects.count(), 3)
+
+        report = {"endpoints": {}}
+        for scenario in runner.scenarios(ds):
+            result = runner.run_scenario(scenario, requests=2, concurrency=2)
+            self.assertEqual(result["requests"], 2, scenario.name)
+            self.assertEqual(result["errors"], 0, (scenario.name, result["status"]))
+            self.assertGreater(result["queries_max"], 0)
+            report["endpoints"][scenario.name] = result
+
+        self.assertEqual(runner.regressions(report, report), [])
+        worse = json.loads(json.dumps(report))
+        worse["endpoints"]["list"]["queries_max"] += 1
+        worse["endpoints"]["stats"]["p95_ms"] = report["endpoints"]["stats"]["p95_ms"] * 2 + 1
+        found = runner.regressions(worse, report)
+        self.assertEqual(sorted(f.split(":")[0] for f in found), ["list", "stats"])
@@ -0,0 +1,274 @@
+import hashlib, mmap, os, threading, time
+from collections import OrderedDict
+import jwt
+from django.conf import settings
+from django.db import connection
+
+from . import credentials
+from .models import ServiceOrder
+
+# Resultados de validación (y el status HTTP con que responde la vista)
+VALID = "valid"
+ERRORS = {
+    "invalid": ("JWT inválido", 403),
+    "not_found": ("Orden no encontrada", 404),
+    "forbidden": ("Técnico no autorizado", 403),
+    "expired": ("Orden expirada", 403),
+}
+
+
+def token_digest(raw):
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def decode_order_token(raw):
+    """
+    Única decodificación del JWT de la OT (firma HS256 incluida). El "exp"
+    del token es el de un access token de simplejwt, no el de la orden:
+    la vigencia real es order.expires_at, así que no se verifica aquí.
+    """
+    return jwt.decode(raw, settings.SECRET_KEY, algorithms=["HS256"], options={"verify_exp": False})
+
+
+def parse_token(raw):
+    """
+    (order_id, jti) del JWT de la OT o (order_id, None) de la credencial
+    compacta, o None si no es ninguna de las dos.
+    """
+    order_id = credentials.parse_compact(raw)
+    if order_id is not None:
+        return order_id, None
+    try:
+        payload = decode_order_token(raw)
+    except jwt.InvalidTokenError:
+        return None
+    if payload.get("typ") != "order":
+        return None
+    return payload.get("order_id"), payload.get("jti")
+
+
+class Generations:
+    """
+    Un contador por orden (order_id % SLOTS), compartido por los procesos
+    del host en un archivo mapeado en memoria junto a la base SQLite
+    (`<base>.tokengen`; en memoria si la base no es un archivo). order_changed
+    lo incrementa al confirmar cada cambio de estado; la caché guarda el
+    valor leído antes de ir a la BD y descarta la entrada si cambió. Leerlo
+    es leer memoria, sin consultas ni syscalls.
+    """
+    SLOTS = 1 << 16
+
+    def __init__(self):
+        self._path = self._view = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        name = str(connection.settings_dict["NAME"])
+        path = None if connection.vendor != "sqlite" or name.startswith((":memory:", "file:")) else name + ".tokengen"
+        path = getattr(settings, "ORDER_TOKEN_GENERATIONS_FILE", None) or path
+        if self._view is None or path != self._path:
+            with self._lock:
+                if self._view is None or path != self._path:
+                    self._view, self._path = self._open(path), path
+        return self._view
+
+    def _open(self, path):
+        size = self.SLOTS * 4
+        if path is None:
+            return memoryview(bytearray(size)).cast("I")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            return memoryview(mmap.mmap(fd, size)).cast("I")
+        finally:
+            os.close(fd)
+
+    def get(self, order_id):
+        return self._current()[order_id % self.SLOTS]
+
+    def bump(self, order_id):
+        # sin lock entre procesos: si dos pisan el mismo valor igual cambió
+        view = self._current()
+        i = order_id % self.SLOTS
+        view[i] = (view[i] + 1) & 0xFFFFFFFF
+
+
+generations = Generations()
+
+
+class VerifiedToken:
+    __slots__ = ("order_id", "technician_id", "exp", "order", "generation")
+
+    def __init__(self, order_id, technician_id, exp, order, generation):
+        self.order_id = order_id
+        self.technician_id = technician_id
+        self.exp = exp        # order.expires_at (timestamp) o None
+        self.order = order    # datos serializados para la respuesta
+        self.generation = generation  # generations.get(order_id) antes de leer la orden
+
+
+class TokenCache:
+    """
+    sha256 del token tal como llegó -> VerifiedToken, en memoria del
+    proceso, LRU con tope de entradas y TTL. Un acierto no decodifica el JWT
+    ni va a la BD. Una entrada nunca vive más allá del vencimiento de su
+    orden, y se descarta cuando la orden cambia de estado en cualquier
+    proceso del host (Generations).
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._by_order = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @property
+    def max_entries(self):
+        return self._max_entries or getattr(settings, "ORDER_TOKEN_CACHE_MAX_ENTRIES", 10000)
+
+    @property
+    def ttl(self):
+        return self._ttl or getattr(settings, "ORDER_TOKEN_CACHE_TTL", 30)
+
+    def get(self, key, now=None):
+        now = now or time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now or generations.get(item[1].order_id) != item[1].generation:
+                if item is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, entry, now=None):
+        now = now or time.time()
+        until = now + self.ttl
+        if entry.exp is not None:
+            until = min(until, entry.exp)
+        if until <= now:
+            return
+        with self._lock:
+            self._data[key] = (until, entry)
+            self._data.move_to_end(key)
+            self._by_order.setdefault(entry.order_id, set()).add(key)
+            while len(self._data) > self.max_entries:
+                self._drop(next(iter(self._data)))
+
+    def _drop(self, key):
+        _, entry = self._data.pop(key)
+        keys = self._by_order.get(entry.order_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_order[entry.order_id]
+
+    def invalidate_order(self, order_id):
+        with self._lock:
+            for key in list(self._by_order.get(order_id, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_order.clear()
+
+
+token_cache = TokenCache()
+
+
+def order_changed(order_ids):
+    """
+    Cambio de estado confirmado: descarta los tokens cacheados de esas
+    órdenes aquí y, vía Generations, en los demás procesos.
+    """
+    for order_id in order_ids:
+        generations.bump(order_id)
+        token_cache.invalidate_order(order_id)
+
+
+def _entry_for(order, generation):
+    from .serializers import ServiceOrderSerializer
+
+    return VerifiedToken(
+        order_id=order.id,
+        technician_id=order.technician_id,
+        exp=order.expires_at.timestamp() if order.expires_at else None,
+        order=ServiceOrderSerializer(order).data,
+        generation=generation,
+    )
+
+
+def _check_cached(raw_tokens, order_id, now):
+    # Fase 1, sin BD: busca el hash del token en caché y sólo decodifica los
+    # que faltan. Devuelve (results, pending)
+    results = [None] * len(raw_tokens)
+    pending = {}  # order_id -> [(i, raw, clave, generación)]
+    for i, raw in enumerate(raw_tokens):
+        key = token_digest(raw)
+        entry = token_cache.get(key, now)
+        if entry is not None:
+            results[i] = ("invalid", None) if order_id is not None and entry.order_id != order_id else (VALID, entry)
+            continue
+        parsed = parse_token(raw)
+        if parsed is None or (order_id is not None and parsed[0] != order_id):
+            results[i] = ("invalid", None)
+            continue
+        oid = parsed[0]
+        # la generación se lee antes que la orden: un cambio entre medio la deja vieja
+        pending.setdefault(oid, []).append((i, raw, key, generations.get(oid)))
+    return results, pending
+
+
+def _resolve(results, pending, orders, user, now):
+    # Fase 2: verifica contra las órdenes leídas ({id: orden}) y autoriza
+    for oid, items in pending.items():
+        order = orders.get(oid)
+        for i, raw, key, generation in items:
+            if order is None:
+                results[i] = ("not_found", None)
+            elif not credentials.matches(order, raw):
+                results[i] = ("invalid", None)
+            else:
+                entry = _entry_for(order, generation)
+                token_cache.put(key, entry, now)
+                results[i] = (VALID, entry)
+
+    for i, (result, entry) in enumerate(results):
+        if result != VALID:
+            continue
+        if entry.technician_id != user.id:
+            results[i] = ("forbidden", None)
+        elif entry.exp is not None and entry.exp < now:
+            results[i] = ("expired", None)
+    return results
+
+
+def validate_tokens(raw_tokens, user, order_id=None):
+    """
+    Valida varios JWT (o credenciales compactas) escaneados. Devuelve una
+    lista paralela de (resultado, VerifiedToken | None). Los que no están en
+    caché se resuelven con una sola consulta a ServiceOrder.
+    `order_id`: si viene, el token tiene que ser de esa orden.
+    """
+    now = time.time()
+    results, pending = _check_cached(raw_tokens, order_id, now)
+    orders = ServiceOrder.objects.in_bulk(list(pending)) if pending else {}
+    return _resolve(results, pending, orders, user, now)
+
+
+async def avalidate_tokens(raw_tokens, user, order_id=None):
+    # Igual que validate_tokens, con el ORM async (para las vistas ASGI)
+    now = time.time()
+    results, pending = _check_cached(raw_tokens, order_id, now)
+    orders = await ServiceOrder.objects.ain_bulk(list(pending)) if pending else {}
+    return _resolve(results, pending, orders, user, now)
+
+
+def validate_token(raw, user, order_id=None):
+    return validate_tokens([raw], user, order_id)[0]
@@ -0,0 +1,56 @@
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingMemoryFileUploadHandler(MemoryFileUploadHandler):
+    """
+    Igual que el handler en memoria de Django pero calcula el SHA-256 mientras
+    llegan los chunks y lo deja en `uploaded_file.sha256`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # antes del super(): si se activa lanza StopFutureHandlers
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        f = super().file_complete(file_size)
+        if f is not None:
+            f.sha256 = self.sha256.hexdigest()
+        return f
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Versión a disco (archivos grandes) del handler anterior."""
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        f = super().file_complete(file_size)
+        if f is not None:
+            f.sha256 = self.sha256.hexdigest()
+        return f
+
+
+def uploaded_sha256(f):
+    # Hash calculado al recibir; si el archivo no pasó por nuestros handlers
+    # se calcula aquí, antes de guardarlo (nunca releyendo desde el disco).
+    digest = getattr(f, "sha256", None)
+    if digest:
+        return digest
+    h = hashlib.sha256()
+    for chunk in f.chunks():
+        h.update(chunk)
+    f.seek(0)
+    return h.hexdigest()
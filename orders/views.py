@@ -1,27 +1,32 @@
-import io, hashlib, datetime, qrcode, jwt
-from django.http import FileResponse, Http404
+import io, os, datetime, tempfile, time
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.conf import settings
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from .jwt_audit import make_ot_token, make_audit_token
+from .artifacts import pdf_cache
+from .pdf import render_order_pdf, render_full_report, render_label_sheet
+from .bulk import stream_orders_zip
+from . import report
+from .pagination import AuditCursorPagination, OrderCursorPagination
+from .expiration import expire_if_due, schedule_expiry
+from . import audit, closing, counters, credentials, imports, metrics, profiling, rollups, tokens
 from .models import AuditLog
-from .jwt_audit import make_audit_token
 
 from .serializers import (
     ServiceOrderCreateSerializer, ServiceOrderSerializer,
     FailInstallationSerializer, SuccessInstallationSerializer,
-    ServiceOrderDetailSerializer
+    ServiceOrderDetailSerializer, BulkPdfSerializer, OrderListFilterSerializer,
+    RollupQuerySerializer, TokenBatchSerializer, OrderImportSerializer, AuditFeedFilterSerializer,
 )
 
 from accounts.models import User
 from .models import ServiceOrder, Evidence
-from django.db.models import Count
+from django.db.models import Prefetch
 from .serializers import AuditLogSerializer
 
 # Permisos simples
@@ -35,25 +40,80 @@ class IsTechnician(permissions.BasePermission):
 
 class ServiceOrderViewSet(ModelViewSet):
     queryset = ServiceOrder.objects.all().order_by("-id")
+    pagination_class = OrderCursorPagination
+
+    # Máximo de consultas SQL por petición (orders/querybudget.py), con la
+    # autenticación JWT incluida. No dependen de cuántas órdenes, evidencias o
+    # auditorías haya; el peor caso incluye crear las claves de OrderCounter que
+    # aún no existan (savepoint + INSERT cada una). None: sin tope (altas por lotes).
+    query_budgets = {
+        "list": 2, "retrieve": 11, "create_order": 7, "bulk_create_orders": None,
+        "download_pdf": 2, "bulk_pdf": 2, "download_full_pdf": 2,
+        "start": 6, "fail": 12, "succeed": 16,
+        "validate_token": 2, "validate_tokens": 2, "stats": 2, "stats_range": 2,
+        "verify_audits": 4, "audits": 3, "audit_feed": 2,
+    }
+
+    def dispatch(self, request, *args, **kwargs):
+        # Duración y status por acción para /metrics (en streaming, hasta la
+        # primera respuesta; el render de cada página se mide aparte)
+        start = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        action = self.action or "unknown"
+        metrics.API_SECONDS.observe(time.perf_counter() - start, action)
+        metrics.API_RESPONSES.inc(action, response.status_code)
+        return response
 
     def get_permissions(self):
         if self.action in ["create_order","list","retrieve","download_pdf"]:
             # listar/ver: admin ve todo; técnico podría ver solo asignadas (lo filtramos)
             return [permissions.IsAuthenticated()]
-        return [permissions.IsAuthenticated()]
+        # el resto respeta los permission_classes de cada @action (p.ej. IsAdmin)
+        return super().get_permissions()
 
     def list(self, request):
-        qs = self.get_queryset()
+        """
+        Lista paginada por cursor. Filtros: status (repetible o separado por
+        comas), technician, created_after/before, expires_after/before.
+        """
+        params = {k: request.query_params.get(k) for k in request.query_params}
+        if "status" in request.query_params:
+            params["status"] = [
+                st for raw in request.query_params.getlist("status") for st in raw.split(",") if st
+            ]
+        f = OrderListFilterSerializer(data=params)
+        f.is_valid(raise_exception=True)
+        filters = f.validated_data
+
+        qs = self.get_queryset().defer("jwt_token", "ot_token", "closing_notes")
         if request.user.role == "TECNICO":
             qs = qs.filter(technician=request.user)
-        return Response(ServiceOrderSerializer(qs, many=True).data)
+        if filters.get("status"):
+            qs = qs.filter(status__in=filters["status"])
+        if "technician" in filters:
+            qs = qs.filter(technician_id=filters["technician"])
+        if "created_after" in filters:
+            qs = qs.filter(created_at__gte=filters["created_after"])
+        if "created_before" in filters:
+            qs = qs.filter(created_at__lt=filters["created_before"])
+        if "expires_after" in filters:
+            qs = qs.filter(expires_at__gte=filters["expires_after"])
+        if "expires_before" in filters:
+            qs = qs.filter(expires_at__lt=filters["expires_before"])
+
+        page = self.paginate_queryset(qs)
+        return self.get_paginated_response(ServiceOrderSerializer(page, many=True).data)
 
     def retrieve(self, request, pk=None):
         try:
-            order = self.get_queryset().get(pk=pk)
+            # las evidencias en una sola consulta, sin importar cuántas sean
+            order = self.get_queryset().prefetch_related(
+                Prefetch("evidences", queryset=Evidence.objects.order_by("id"))
+            ).get(pk=pk)
         except ServiceOrder.DoesNotExist:
             return Response({"detail": "Orden no encontrada"}, status=404)
 
+        expire_if_due(order)
         serializer = ServiceOrderDetailSerializer(order)
         return Response(serializer.data)
 
@@ -72,53 +132,44 @@ class ServiceOrderViewSet(ModelViewSet):
         except User.DoesNotExist:
             return Response({"detail": "Técnico no válido."}, status=400)
 
-        # calcular expiración
-        delta = datetime.timedelta(
-            seconds=data.get("seconds",0),
-            minutes=data.get("minutes",0),
-            hours=data.get("hours",0),
-            days=data.get("days",0),
-        )
-        expires_at = timezone.now() + (delta if delta.total_seconds() > 0 else datetime.timedelta(hours=1))
-
-        # generar JWT de la orden (NO confundir con token de login)
-        payload = {
-            "uuid_order": "temp",  # lo setearemos luego
-            "technician_id": tech.id,
-            "exp": int(expires_at.timestamp()),
-            "iat": int(timezone.now().timestamp()),
-        }
-        # generamos primero un JWT “provisorio” sin uuid para firmar luego del save
-        provisional = jwt.encode(payload, settings.SECRET_KEY, algorithm="HS256")
-
-        # creamos orden con jwt provisional (actualizaremos payload uuid_order real)
-        order = ServiceOrder.objects.create(
-            technician=tech,
-            technician_name=data["technician_name"],
-            jwt_token=provisional,
-            jwt_hash=hashlib.sha256(provisional.encode()).hexdigest(),
-            expires_at=expires_at,
-            status=ServiceOrder.Status.PENDING,
-        )
-
-        # ahora re-firmamos jwt con el uuid real
-        final_payload = {
-            "uuid_order": str(order.uuid_order),
-            "technician_id": tech.id,
-            "exp": int(expires_at.timestamp()),
-            "iat": int(timezone.now().timestamp()),
-        }
-        final_jwt, jti = make_ot_token(request.user, order)
-        order.jwt_token = final_jwt
-        order.jwt_hash = hashlib.sha256(final_jwt.encode()).hexdigest()
-        order.ot_token = final_jwt
-        order.ot_token_jti = jti
-        order.save(update_fields=["jwt_token", "jwt_hash", "ot_token", "ot_token_jti"]) 
+        # JWT firmado antes del INSERT (id reservado), contadores y pre-render
+        # del PDF + QR al confirmar: la primera descarga ya es un envío de archivo
+        order = imports.create_order(request.user, data, tech)
+        schedule_expiry(order)
 
         return Response({
             "order": ServiceOrderSerializer(order).data
         }, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=["POST"], permission_classes=[IsAdmin])
+    def bulk_create_orders(self, request):
+        """
+        Alta masiva: {"orders": [filas como las de create_order]} o un archivo
+        CSV/JSON en `file`. Inserta en lotes (orders/imports.py) y responde
+        los ids creados y los errores por fila (numeradas desde 1).
+        """
+        s = OrderImportSerializer(data=request.data)
+        s.is_valid(raise_exception=True)
+        rows = s.validated_data.get("orders")
+        if rows is None:
+            f = s.validated_data["file"]
+            fmt = "json" if f.name.lower().endswith(".json") else "csv"
+            try:
+                rows = imports.read_rows(f.read(), fmt)
+            except (ValueError, UnicodeDecodeError) as e:
+                return Response({"detail": f"Archivo ilegible: {e}"}, status=400)
+
+        max_rows = getattr(settings, "ORDER_IMPORT_MAX_ROWS", 10000)
+        if len(rows) > max_rows:
+            return Response({"detail": f"Máximo {max_rows} filas por importación"}, status=400)
+
+        result = imports.create_orders(request.user, rows)
+        return Response({
+            "created": len(result["created"]),
+            "ids": result["created"],
+            "errors": result["errors"],
+        }, status=status.HTTP_201_CREATED if result["created"] else 400)
+
     @action(detail=True, methods=["GET"])
     def download_pdf(self, request, pk=None):
         """
@@ -135,59 +186,120 @@ class ServiceOrderViewSet(ModelViewSet):
             return Response({"detail": "No autorizado."}, status=403)
 
         try:
-            # -------- Generar QR --------
-            url_base = "http://localhost:5173/open"  
-            qr_value = f"{url_base}?id={order.id}#jwt={order.jwt_token}"
+            # El PDF sólo depende de la orden + jwt_hash: se sirve desde la caché
+            etag = f'"{pdf_cache.key_for(order)}"'
+            body = None
+            hit = pdf_cache.lookup(order)
+            if hit is not None:
+                not_modified = get_conditional_response(
+                    request, etag=etag, last_modified=int(hit[1]))
+                if not_modified is not None:
+                    return not_modified
+                try:
+                    body = open(hit[0], "rb")
+                except FileNotFoundError:
+                    # otro proceso la desalojó entre lookup y open
+                    hit = None
+            if hit is None:
+                # se sirve lo renderizado, sin releer el archivo recién guardado
+                data = render_order_pdf(order)
+                hit = pdf_cache.store(order, data)
+                body = io.BytesIO(data)
+
+            mtime = hit[1]
+            response = FileResponse(
+                body,
+                as_attachment=True,
+                filename=f"orden_{order.uuid_order}.pdf",
+                content_type="application/pdf"
+            )
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(mtime)
+            response["Cache-Control"] = "private, no-cache"
+            return response
+        except Exception as e:
+            # Manejar errores y devolver un mensaje claro
+            return Response({"detail": f"Error generando el PDF: {str(e)}"}, status=500)
+
+    @action(detail=False, methods=["POST"], permission_classes=[IsAdmin])
+    def bulk_pdf(self, request):
+        """
+        Devuelve un ZIP con los PDFs de varias órdenes (por ids o por filtros).
+        Se renderizan en paralelo y el ZIP se envía en streaming.
+        Con mode=labels devuelve un único PDF con per_page etiquetas QR por hoja.
+        """
+        s = BulkPdfSerializer(data=request.data)
+        s.is_valid(raise_exception=True)
+        data = s.validated_data
+
+        qs = ServiceOrder.objects.all().order_by("id")
+        if "ids" in data:
+            qs = qs.filter(pk__in=data["ids"])
+        else:
+            if "status" in data:
+                qs = qs.filter(status=data["status"])
+            if "technician_id" in data:
+                qs = qs.filter(technician_id=data["technician_id"])
+
+        orders = qs.only(
+            "id", "uuid_order", "technician_name", "jwt_token", "jwt_hash",
+            "created_at", "expires_at",
+        ).iterator(chunk_size=200)
+        stamp = timezone.now().strftime("%Y%m%d_%H%M")
+
+        if data["mode"] == "labels":
+            # Un solo PDF con N etiquetas QR por hoja
+            out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+            render_label_sheet(orders, out, per_page=data["per_page"])
+            out.seek(0)
+            return FileResponse(
+                out,
+                as_attachment=True,
+                filename=f"etiquetas_{stamp}.pdf",
+                content_type="application/pdf"
+            )
+
+        response = StreamingHttpResponse(stream_orders_zip(orders), content_type="application/zip")
+        response["Content-Disposition"] = f'attachment; filename="ordenes_{stamp}.zip"'
+        return response
+
+    @action(detail=True, methods=["GET"])
+    def download_full_pdf(self, request, pk=None):
+        """
+        Genera un PDF completo: datos de la orden + QR + evidencias (imágenes
+        y PDFs adjuntos).
+        """
+        try:
+            order = self.get_queryset().get(pk=pk)
+        except ServiceOrder.DoesNotExist:
+            raise Http404
 
-            qr_img = qrcode.make(qr_value)
-            buf_qr = io.BytesIO()
-            qr_img.save(buf_qr, format="PNG")
-            buf_qr.seek(0)
-            qr_reader = ImageReader(buf_qr)
+        # Verificar permisos
+        if request.user.role == "TECNICO" and order.technician_id != request.user.id:
+            return Response({"detail": "No autorizado."}, status=403)
+
+        filename = f"orden_completa_{order.uuid_order}.pdf"
+        evidences = order.evidences.all().order_by("id")
 
-            # -------- Crear PDF --------
+        if report.PdfReader is None:
+            # sin pypdf: todo en memoria y los PDF adjuntos no se incluyen
             pdf_buffer = io.BytesIO()
-            c = canvas.Canvas(pdf_buffer, pagesize=A4)
-            w, h = A4
-
-            # Título
-            c.setFont("Helvetica-Bold", 16)
-            c.drawString(50, h - 60, "Solicitud de Servicio")
-
-            # Datos de la orden
-            c.setFont("Helvetica", 11)
-            c.drawString(50, h - 90, f"Orden UUID: {order.uuid_order}")
-            c.drawString(50, h - 110, f"Técnico asignado: {order.technician_name}")
-            c.drawString(50, h - 130, f"Creada: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
-            if order.expires_at:
-                c.drawString(50, h - 150, f"Expira: {order.expires_at.strftime('%Y-%m-%d %H:%M')}")
-
-            # Insertar QR en la esquina derecha
-            qr_size = 160
-            c.drawImage(qr_reader, w - qr_size - 50, h - qr_size - 60,
-                        qr_size, qr_size, preserveAspectRatio=True, mask="auto")
-
-            # Nota al pie
-            c.setFont("Helvetica-Oblique", 10)
-            c.drawString(50, 50, "Escanee el QR para abrir la página y copiar el JWT.")
-
-            # Cerrar PDF
-            c.showPage()
-            c.save()
-
-            # Rebobinar el buffer
+            render_full_report(order, evidences, pdf_buffer)
             pdf_buffer.seek(0)
-
-            # Devolver el archivo PDF
             return FileResponse(
                 pdf_buffer,
                 as_attachment=True,
-                filename=f"orden_{order.uuid_order}.pdf",
+                filename=filename,
                 content_type="application/pdf"
             )
-        except Exception as e:
-            # Manejar errores y devolver un mensaje claro
-            return Response({"detail": f"Error generando el PDF: {str(e)}"}, status=500)
+
+        # se envía página a página, con los PDF adjuntos insertados tal cual
+        response = StreamingHttpResponse(
+            report.stream_full_report(order, evidences.iterator()),
+            content_type="application/pdf",
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
 
     @action(detail=True, methods=["POST"])
     def start(self, request, pk=None):
@@ -203,16 +315,15 @@ class ServiceOrderViewSet(ModelViewSet):
         if not ensure_access_technician(request, order):
             return Response({"detail":"No autorizado"}, status=403)
 
-        if not check_expiration(order):
-            order.status = ServiceOrder.Status.EXPIRED
-            order.save(update_fields=["status"])
+        if expire_if_due(order):
             return Response({"detail":"Orden expirada"}, status=400)
 
         if order.status not in [ServiceOrder.Status.PENDING, ServiceOrder.Status.IN_USE]:
             return Response({"detail": f"No se puede iniciar en estado {order.status}"}, status=400)
 
-        order.status = ServiceOrder.Status.IN_USE
-        order.save(update_fields=["status"])
+        if order.status != ServiceOrder.Status.IN_USE:
+            if not counters.transition(order, ServiceOrder.Status.IN_USE):
+                return Response({"detail": "La orden cambió de estado, reintente"}, status=409)
         return Response({"detail": "Orden en uso"}, status=200)
 
     @action(detail=True, methods=["POST"])
@@ -228,9 +339,7 @@ class ServiceOrderViewSet(ModelViewSet):
         if not ensure_access_technician(request, order):
             return Response({"detail":"No autorizado"}, status=403)
 
-        if not check_expiration(order):
-            order.status = ServiceOrder.Status.EXPIRED
-            order.save(update_fields=["status"])
+        if expire_if_due(order):
             return Response({"detail":"Orden expirada"}, status=400)
 
         if order.status not in [ServiceOrder.Status.PENDING, ServiceOrder.Status.IN_USE]:
@@ -240,26 +349,15 @@ class ServiceOrderViewSet(ModelViewSet):
         s.is_valid(raise_exception=True)
         data = s.validated_data
 
-        # Validar JWT vs hash
-        if sha256_str(data["jwt"]) != order.jwt_hash:
+        # Validar JWT (o credencial compacta) vs hash
+        if not credentials.matches(order, data["jwt"]):
             return Response({"detail":"JWT inválido"}, status=400)
 
-        # Guardar evidencia: foto del domicilio
-        ev = Evidence.objects.create(
-            order=order,
-            kind=Evidence.Type.FOTO_DOMICILIO,
-            file=data["photo_address"]
-        )
-        ev.compute_and_set_hash()
-        log_evidence_audit(request.user, order, "subida_foto_domicilio", ev, data["jwt"])
-
-
-        # Cerrar
-        order.status = ServiceOrder.Status.FAILED
-        order.closing_reason = data["justification"]
-        order.closing_notes = data.get("notes","")
-        order.closed_at = timezone.now()
-        order.save(update_fields=["status","closing_reason","closing_notes","closed_at"])
+        # Evidencia, auditoría, cierre y contadores van juntos o no van
+        status_, fields = closing.fail_closing(data)
+        evidences = closing.uploaded_evidences(data, closing.FAIL_EVIDENCES)
+        if not closing.close_order(request.user, order, status_, fields, evidences, data["jwt"]):
+            return Response({"detail": "La orden cambió de estado, reintente"}, status=409)
 
         return Response({"detail":"Orden cerrada como fallida"}, status=200)
 
@@ -276,9 +374,7 @@ class ServiceOrderViewSet(ModelViewSet):
         if not ensure_access_technician(request, order):
             return Response({"detail":"No autorizado"}, status=403)
 
-        if not check_expiration(order):
-            order.status = ServiceOrder.Status.EXPIRED
-            order.save(update_fields=["status"])
+        if expire_if_due(order):
             return Response({"detail":"Orden expirada"}, status=400)
 
         if order.status not in [ServiceOrder.Status.PENDING, ServiceOrder.Status.IN_USE]:
@@ -288,246 +384,179 @@ class ServiceOrderViewSet(ModelViewSet):
         s.is_valid(raise_exception=True)
         data = s.validated_data
 
-        # Validar JWT vs hash
-        if sha256_str(data["jwt"]) != order.jwt_hash:
+        # Validar JWT (o credencial compacta) vs hash
+        if not credentials.matches(order, data["jwt"]):
             return Response({"detail":"JWT inválido"}, status=400)
 
-        # Evidencias:
-        # 1) Doc firmado (puede ser imagen o PDF)
-        ev1 = Evidence.objects.create(
-            order=order,
-            kind=Evidence.Type.DOC_FIRMADO,
-            file=data["doc_signed"]
-        )
-        ev1.compute_and_set_hash()
-        log_evidence_audit(request.user, order, "subida_doc_firmado", ev1, data["jwt"])
+        # Evidencias: doc firmado (imagen o PDF) + doc identidad
+        status_, fields = closing.success_closing(data)
+        evidences = closing.uploaded_evidences(data, closing.SUCCESS_EVIDENCES)
+        if not closing.close_order(request.user, order, status_, fields, evidences, data["jwt"]):
+            return Response({"detail": "La orden cambió de estado, reintente"}, status=409)
 
+        return Response({"detail":"Orden cerrada como exitosa"}, status=200)
 
-        # 2) Doc identidad
-        ev2 = Evidence.objects.create(
-            order=order,
-            kind=Evidence.Type.DOC_IDENTIDAD,
-            file=data["doc_id"]
-        )
-        ev2.compute_and_set_hash()
-        log_evidence_audit(request.user, order, "subida_doc_identidad", ev2, data["jwt"])
+    @action(detail=True, methods=["POST"], permission_classes=[IsTechnician])
+    def validate_token(self, request, pk=None):
+        """
+        Valida que el JWT escaneado coincide con el hash guardado y pertenece al técnico autenticado.
+        Los tokens ya verificados se sirven de tokens.token_cache sin ir a la BD.
+        """
+        jwt_token = request.data.get("jwt")
+        if not jwt_token:
+            return Response({"detail": "Falta el JWT"}, status=400)
 
-    
+        try:
+            order_id = int(pk)
+        except (TypeError, ValueError):
+            return Response({"detail": "Orden no encontrada"}, status=404)
 
-        # Cerrar
-        order.status = ServiceOrder.Status.COMPLETED
-        order.closing_reason = "titular_presente" if data["titular_present"] else "familiar_autorizado"
-        order.closing_notes = data.get("notes","")
-        order.closed_at = timezone.now()
-        order.save(update_fields=["status","closing_reason","closing_notes","closed_at"])
+        result, entry = tokens.validate_token(jwt_token, request.user, order_id)
+        if result != tokens.VALID:
+            detail, code = tokens.ERRORS[result]
+            return Response({"detail": detail}, status=code)
 
-        return Response({"detail":"Orden cerrada como exitosa"}, status=200)
+        return Response({
+            "valid": True,
+            "order": entry.order
+        })
+
+    @action(detail=False, methods=["POST"], permission_classes=[IsTechnician])
+    def validate_tokens(self, request):
+        """
+        Valida en una sola llamada varios JWT escaneados: {"tokens": [...]}.
+        Devuelve un resultado por token, en el mismo orden.
+        """
+        s = TokenBatchSerializer(data=request.data)
+        s.is_valid(raise_exception=True)
+
+        results = []
+        for result, entry in tokens.validate_tokens(s.validated_data["tokens"], request.user):
+            if result == tokens.VALID:
+                results.append({"valid": True, "order": entry.order})
+            else:
+                results.append({"valid": False, "detail": tokens.ERRORS[result][0]})
+        return Response({"results": results})
 
     @action(detail=False, methods=["GET"], permission_classes=[IsAdmin])
     def stats(self, request):
         """
         Devuelve estadísticas de órdenes.
+        Se leen de OrderCounter (orders/counters.py), no de las tablas;
+        manage.py reconcile_counters los recalcula si hiciera falta.
         """
-        qs = ServiceOrder.objects.all()
-
-        total = qs.count()
-        por_estado = qs.values("status").annotate(total=Count("id"))
-        por_tecnico = qs.values("technician_name").annotate(total=Count("id"))
-        evidencias_total = Evidence.objects.count()
+        return Response(counters.snapshot())
 
-        return Response({
-            "total_orders": total,
-            "by_status": {e["status"]: e["total"] for e in por_estado},
-            "by_technician": {e["technician_name"]: e["total"] for e in por_tecnico},
-            "total_evidences": evidencias_total,
-        })
+    @action(detail=False, methods=["GET"], permission_classes=[IsAdmin])
+    def stats_range(self, request):
+        """
+        Creadas / completadas / fallidas / expiradas y tiempo de cierre
+        (p50/p90/p99, segundos) en una ventana, por hora o por día.
+        Sólo lee OrderRollup; ?start=&end=&period=hour|day&technician=
+        """
+        s = RollupQuerySerializer(data=request.query_params)
+        s.is_valid(raise_exception=True)
+        data = s.validated_data
+        end = data.get("end") or timezone.now()
+        start = data.get("start") or end - datetime.timedelta(days=1)
+        try:
+            return Response(rollups.query(start, end, data.get("period"), data.get("technician")))
+        except rollups.WindowTooLarge as e:
+            return Response({"detail": str(e)}, status=400)
 
-# helpers fuera de la clase
-def sha256_str(s: str) -> str:
-    return hashlib.sha256(s.encode()).hexdigest()
+    @action(detail=True, methods=["GET"], permission_classes=[IsAdmin])
+    def verify_audits(self, request, pk=None):
+        """
+        Verifica el historial de auditoría de la orden contra las raíces
+        firmadas de sus lotes (o contra el audit_jwt de cada fila).
+        """
+        try:
+            order = self.get_queryset().get(pk=pk)
+        except ServiceOrder.DoesNotExist:
+            return Response({"detail": "Orden no encontrada"}, status=404)
+        result = audit.verify(order.audits.all())
+        return Response({"order": order.id, "valid": not result["failures"], **result})
+
+    def _audit_page(self, request, qs):
+        # Una consulta por página: el admin viene en el JOIN y sólo se leen
+        # las columnas que muestra AuditLogSerializer (no los JWT ni la prueba)
+        qs = qs.select_related("admin").only(
+            "id", "order_id", "action", "ot_jti", "audit_jti", "old_values", "new_values",
+            "created_at", "admin__username",
+        )
+        paginator = AuditCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        return paginator.get_paginated_response(AuditLogSerializer(page, many=True).data)
 
-def ensure_access_technician(request, order: ServiceOrder):
-    # Sólo el técnico asignado puede operar la orden
-    if request.user.role != "TECNICO" or order.technician_id != request.user.id:
-        return False
-    return True
+    @action(detail=True, methods=["GET"], permission_classes=[IsAdmin])
+    def audits(self, request, pk=None):
+        """
+        Historial de auditoría de una orden, paginado por cursor (más nuevo
+        primero). Solo para administradores.
+        """
+        if not ServiceOrder.objects.filter(pk=pk).exists():
+            return Response({"detail": "Orden no encontrada"}, status=404)
+        return self._audit_page(request, AuditLog.objects.filter(order_id=pk))
 
-def check_expiration(order: ServiceOrder):
-    return not (order.expires_at and order.expires_at < timezone.now())
-
-def log_audit_action(admin_user, order, action, old_values, new_values):
-    audit_jwt, audit_jti = make_audit_token(
-        admin_user=admin_user,
-        order=order,
-        action=action,
-        old=old_values,
-        new=new_values
-    )
-    AuditLog.objects.create(
-        order=order,
-        admin=admin_user,
-        action=action,
-        ot_token_copy=order.ot_token,
-        ot_jti=order.ot_token_jti,
-        audit_jwt=audit_jwt,
-        audit_jti=audit_jti,
-        old_values=old_values,
-        new_values=new_values,
-    )
-
-def validate_order_access(request, order):
+    @action(detail=False, methods=["GET"], permission_classes=[IsAdmin])
+    def audit_feed(self, request):
+        """
+        Auditoría de todas las órdenes, paginada por cursor. Filtros: action,
+        actor (id de usuario), created_after/before.
+        """
+        f = AuditFeedFilterSerializer(data=request.query_params)
+        f.is_valid(raise_exception=True)
+        filters = f.validated_data
+
+        qs = AuditLog.objects.all()
+        if "action" in filters:
+            qs = qs.filter(action=filters["action"])
+        if "actor" in filters:
+            qs = qs.filter(admin_id=filters["actor"])
+        if "created_after" in filters:
+            qs = qs.filter(created_at__gte=filters["created_after"])
+        if "created_before" in filters:
+            qs = qs.filter(created_at__lt=filters["created_before"])
+        return self._audit_page(request, qs)
+
+class ProfileViewSet(viewsets.ViewSet):
     """
-    Valida el acceso a la orden para el usuario técnico.
-    Retorna un Response en caso de error, o None si es válido.
+    Perfiles de peticiones lentas (orders/profiling.py), sólo para admins.
+    GET /api/profiles/ lista los más nuevos primero; GET /api/profiles/<id>/
+    descarga el JSON (petición + SQL) o, con ?kind=folded, las pilas colapsadas.
     """
-    # 1. Verificar rol
-    if request.user.role != "TECNICO":
-        return Response({"detail": "No autorizado."}, status=403)
+    permission_classes = [IsAdmin]
+    query_budgets = {"list": 1, "retrieve": 1}
 
-    # 2. Verificar si es su orden
-    if order.technician_id != request.user.id:
-        return Response({"detail": "No autorizado."}, status=403)
+    def list(self, request):
+        return Response(profiling.list_profiles())
+
+    def retrieve(self, request, pk=None):
+        folded = request.query_params.get("kind") == "folded"
+        path = profiling.profile_path(pk, ".folded" if folded else ".json")
+        if path is None:
+            return Response({"detail": "Perfil no encontrado"}, status=404)
+        return FileResponse(
+            open(path, "rb"),
+            as_attachment=True,
+            filename=os.path.basename(path),
+            content_type="text/plain" if folded else "application/json",
+        )
 
-    # 3. Verificar expiración
-    if order.expires_at and order.expires_at < timezone.now():
-        return Response({"detail": "Orden expirada."}, status=403)
 
-    return None  # Todo bien, acceso permitido
-@action(detail=True, methods=["GET"], permission_classes=[permissions.IsAuthenticated, IsAdmin])
-def audits(self, request, pk=None):
-    """
-    Devuelve la auditoría (historial de modificaciones) de una orden.
-    Solo para administradores.
-    """
-    try:
-        order = self.get_queryset().get(pk=pk)
-    except ServiceOrder.DoesNotExist:
-        return Response({"detail": "Orden no encontrada"}, status=404)
-
-    queryset = order.audits.all().order_by("-created_at")
-    serializer = AuditLogSerializer(queryset, many=True)
-    return Response(serializer.data, status=200)
-@action(detail=True, methods=["POST"], permission_classes=[IsTechnician])
-def validate_token(self, request, pk=None):
-    """
-    Valida que el JWT escaneado coincide con el hash guardado y pertenece al técnico autenticado.
+def metrics_view(request):
     """
-    jwt_token = request.data.get("jwt")
-    if not jwt_token:
-        return Response({"detail": "Falta el JWT"}, status=400)
-
-    try:
-        order = self.get_queryset().get(pk=pk)
-    except ServiceOrder.DoesNotExist:
-        return Response({"detail": "Orden no encontrada"}, status=404)
-
-    # Validar hash
-    expected_hash = hashlib.sha256(jwt_token.encode()).hexdigest()
-    if expected_hash != order.jwt_hash:
-        return Response({"detail": "JWT inválido"}, status=403)
-
-    # Validar que el técnico autenticado es el que está en el token
-    payload = jwt.decode(jwt_token, settings.SECRET_KEY, algorithms=["HS256"])
-    if payload.get("technician_id") != request.user.id:
-        return Response({"detail": "Técnico no autorizado"}, status=403)
-
-    return Response({
-        "valid": True,
-        "order": ServiceOrderSerializer(order).data
-    })
-def log_evidence_audit(user, order, action, evidencia, jwt):
-    """Registrar en auditoría cuando se sube evidencia."""
-    payload = {
-        "evidence_id": evidencia.id,
-        "evidence_kind": evidencia.kind,
-        "filename": evidencia.file.name
-    }
-    audit_jwt, audit_jti = make_audit_token(user, order, action, {}, payload)
-    AuditLog.objects.create(
-        order=order,
-        admin=user,  # o puede ser técnico si lo permites
-        action=action,
-        ot_token_copy=jwt,
-        ot_jti=order.ot_token_jti,
-        audit_jwt=audit_jwt,
-        audit_jti=audit_jti,
-        old_values=None,
-        new_values=payload,
-    )
-@action(detail=True, methods=["GET"])
-def download_full_pdf(self, request, pk=None):
-    """
-    Genera un PDF completo: datos de la orden + QR + evidencias (imagenes).
+    Métricas de todos los procesos en formato de texto de Prometheus. Con
+    ORDER_METRICS_TOKEN definido exige "Authorization: Bearer <token>".
     """
-    try:
-        order = self.get_queryset().get(pk=pk)
-    except ServiceOrder.DoesNotExist:
-        raise Http404
-
-    # Verificar permisos
-    if request.user.role == "TECNICO" and order.technician_id != request.user.id:
-        return Response({"detail": "No autorizado."}, status=403)
-
-    # Preparar QR
-    qr_value = f"{settings.FRONTEND_URL}?id={order.id}#jwt={order.jwt_token}"
-    qr_img = qrcode.make(qr_value)
-    buf_qr = io.BytesIO()
-    qr_img.save(buf_qr, format="PNG")
-    buf_qr.seek(0)
-    qr_reader = ImageReader(buf_qr)
-
-    # Crear PDF
-    pdf_buffer = io.BytesIO()
-    c = canvas.Canvas(pdf_buffer, pagesize=A4)
-    w, h = A4
-
-    # Página 1: info
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, h - 60, "Orden de Servicio - Detalles")
-
-    c.setFont("Helvetica", 11)
-    c.drawString(50, h - 90, f"UUID: {order.uuid_order}")
-    c.drawString(50, h - 110, f"Técnico: {order.technician_name}")
-    c.drawString(50, h - 130, f"Creada: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
-    c.drawString(50, h - 150, f"Estado: {order.status}")
-    if order.expires_at:
-        c.drawString(50, h - 170, f"Expira: {order.expires_at.strftime('%Y-%m-%d %H:%M')}")
-
-    # QR
-    qr_size = 150
-    c.drawImage(qr_reader, w - qr_size - 50, h - qr_size - 70,
-                qr_size, qr_size, preserveAspectRatio=True, mask="auto")
-
-    c.setFont("Helvetica-Oblique", 10)
-    c.drawString(50, 50, "Escanee el QR para ver esta orden en línea.")
-
-    c.showPage()
-
-    # Páginas siguientes: evidencias
-    for ev in order.evidences.all():
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, h - 60, f"Evidencia: {ev.kind}")
-        c.setFont("Helvetica", 10)
-        c.drawString(50, h - 80, f"Subido el: {ev.created_at.strftime('%Y-%m-%d %H:%M')}")
-
-        if ev.file.name.lower().endswith(".pdf"):
-            c.drawString(50, h - 100, "(PDF adjunto no renderizado)")
-        else:
-            try:
-                image_path = ev.file.path
-                img_reader = ImageReader(image_path)
-                c.drawImage(img_reader, 50, 150, width=500, preserveAspectRatio=True, mask="auto")
-            except Exception as e:
-                c.drawString(50, h - 100, f"Error al cargar la imagen: {str(e)}")
-
-        c.showPage()
-
-    c.save()
-    pdf_buffer.seek(0)
-
-    return FileResponse(
-        pdf_buffer,
-        as_attachment=True,
-        filename=f"orden_completa_{order.uuid_order}.pdf",
-        content_type="application/pdf"
-    )
+    token = getattr(settings, "ORDER_METRICS_TOKEN", None)
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.registry.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# helpers fuera de la clase
+def ensure_access_technician(request, order: ServiceOrder):
+    # Sólo el técnico asignado puede operar la orden
+    if request.user.role != "TECNICO" or order.technician_id != request.user.id:
+        return False
+    return True
@@ -0,0 +1,161 @@
+import contextlib, logging, os, queue, threading
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo se ordena lo del propio proceso
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def active():
+    """
+    ¿Pasan las escrituras por la cola? Sólo con SQLite, con ORDER_WRITE_QUEUE
+    y fuera de una transacción: dentro de una (p.ej. los tests) el hilo de la
+    cola esperaría el lock que tiene quien lo llamó.
+    """
+    return (
+        getattr(settings, "ORDER_WRITE_QUEUE", False)
+        and connection.vendor == "sqlite"
+        and not connection.in_atomic_block
+    )
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "done", "result", "error", "hooks")
+
+    def __init__(self, fn, args, kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.done = threading.Event()
+        self.result = self.error = None
+        self.hooks = []
+
+
+class WriteQueue:
+    """
+    Serializa las transacciones cortas de escritura del proceso en un solo
+    hilo. Lo que llega mientras se escribe el lote anterior se ejecuta junto,
+    cada una en su savepoint, con un único COMMIT (un fsync y un paso del
+    lock de SQLite para todas). Si una falla sólo se revierte su savepoint.
+
+    Entre procesos (workers de gunicorn) los lotes se turnan con un flock
+    sobre `<base>.writelock`: el que espera despierta apenas se libera, en vez
+    de dormir los intervalos crecientes del busy handler de SQLite.
+
+    Los on_commit de cada trabajo no corren en el hilo de la cola (allí un
+    respaldo en línea, p.ej. derivados sin Celery, frenaría todas las
+    escrituras): se devuelven y corren en el hilo que llamó, tras el COMMIT.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._lockfile = (None, None)  # (ruta, fd) del flock entre procesos
+
+    def run(self, fn, *args, **kwargs):
+        if not active():
+            return fn(*args, **kwargs)
+        job = _Job(fn, args, kwargs)
+        self._ensure_thread()
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        for _sids, hook, robust in job.hooks:
+            try:
+                hook()
+            except Exception:
+                if not robust:
+                    raise
+                logger.exception("cola de escrituras: falló un on_commit")
+        return job.result
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        # Termina el hilo (después de lo ya encolado) y cierra su conexión
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout=30)
+
+    def _loop(self):
+        limit = getattr(settings, "ORDER_WRITE_QUEUE_BATCH", 32)
+        while True:
+            job = self._queue.get()
+            if job is None:
+                connection.close()
+                return
+            jobs = [job]
+            while len(jobs) < limit:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)  # se atiende después de este lote
+                    break
+                jobs.append(job)
+            try:
+                close_old_connections()
+                self._write(jobs)
+            except Exception as e:
+                # falló el COMMIT (o el BEGIN): no quedó nada de ningún trabajo
+                for job in jobs:
+                    if job.error is None:
+                        job.error, job.hooks = e, []
+            finally:
+                for job in jobs:
+                    job.done.set()
+
+    @contextlib.contextmanager
+    def _process_lock(self):
+        name = str(connection.settings_dict["NAME"])
+        if fcntl is None or name.startswith((":memory:", "file:")):
+            yield
+            return
+        path = getattr(settings, "ORDER_WRITE_LOCK_FILE", None) or name + ".writelock"
+        if self._lockfile[0] != path:
+            if self._lockfile[1] is not None:
+                os.close(self._lockfile[1])
+            self._lockfile = (path, os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        fd = self._lockfile[1]
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _write(self, jobs):
+        with self._process_lock(), transaction.atomic():
+            for job in jobs:
+                start = len(connection.run_on_commit)
+                try:
+                    with transaction.atomic():
+                        job.result = job.fn(*job.args, **job.kwargs)
+                except Exception as e:
+                    job.error = e
+                # los de un savepoint revertido Django ya los descartó
+                job.hooks = connection.run_on_commit[start:]
+            # se corren en el hilo de cada llamador, no al salir de este atomic
+            connection.run_on_commit = []
+
+    def _after_fork(self):
+        # El hijo no tiene el hilo, y un flock sobre el fd heredado lo
+        # compartiría con el padre en vez de excluirlo
+        if self._lockfile[1] is not None:
+            os.close(self._lockfile[1])
+        self.__init__()
+
+
+writes = WriteQueue()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=writes._after_fork)